@@ -1,4 +1,42 @@
+import threading
+from functools import partial
 from typing import Dict, List, Optional, Literal, Callable, Any, Union
+from ..vectorstore.chunker import CodeChunker
+from .prompt_builder import PromptBuilder, compact_template
+from .retrieval import ContextPacker, flatten_results, mmr_select
+from .semantic_cache import SemanticSuggestionCache
+from .suggestion_cache import SuggestionCache
+from .stop_conditions import (
+    BracketBalanceStop, CodeFenceStop, DedentStop, MaxLinesStop, StopCondition, StopEngine
+)
+
+
+class _PartialCleaner:
+    """Turns raw streamed fragments into deltas of the cleaned response"""
+    
+    def __init__(self, clean: Callable[..., str], on_partial: Callable[[str], None]):
+        """Initialize the partial cleaner
+        
+        Args:
+            clean: Cleaning function accepting (response, partial=True)
+            on_partial: Callback receiving each new piece of cleaned text
+        """
+        self.clean = clean
+        self.on_partial = on_partial
+        self.raw = ""
+        self.sent = ""
+    
+    def __call__(self, fragment: str):
+        self.raw += fragment
+        cleaned = self.clean(self.raw, partial=True)
+        
+        # Only emit text that extends what the client already has; anything
+        # else is reconciled by the final response
+        if len(cleaned) > len(self.sent) and cleaned.startswith(self.sent):
+            delta = cleaned[len(self.sent):]
+            self.sent = cleaned
+            self.on_partial(delta)
+
 
 class CodeSuggestion:
     """Class for generating code suggestions using LLM models"""
@@ -80,22 +118,205 @@ class CodeSuggestion:
         """
     }
     
-    def __init__(self, model_pipeline: Union[Callable, Any], vectorstore=None):
+    # Rules that end generation early once the answer is complete, per suggestion
+    # type. Each entry is a StopCondition class (or partial) built from the input
+    # code and language.
+    STOP_RULES: Dict[str, List[Callable[..., StopCondition]]] = {
+        "completion": [CodeFenceStop],
+        "fix": [],
+        "generate": [partial(MaxLinesStop, max_lines=250)],
+        "fim": [BracketBalanceStop, DedentStop, partial(MaxLinesStop, max_lines=8)]
+    }
+    
+    # Answers of these types restate the input, so their line cap is the input's
+    # length plus this margin rather than a fixed number
+    STOP_LINE_MARGINS: Dict[str, int] = {
+        "completion": 40,
+        "fix": 60
+    }
+    
+    # CodeLlama fill-in-the-middle prompt; the model answers with the missing middle
+    FIM_TEMPLATE = "<PRE> {prefix} <SUF>{suffix} <MID>"
+    FIM_STOP = ["<EOT>"]
+    FIM_MAX_NEW_TOKENS = 64
+    
+    # Prefixes that models sometimes generate before the actual answer
+    RESPONSE_PREFIXES = [
+        "Here's the completed code:",
+        "Here is the completed code:",
+        "Here's the fixed code:",
+        "Here is the fixed code:",
+        "Here's the implementation:",
+        "Here is the implementation:"
+    ]
+    
+    def __init__(
+        self,
+        model_pipeline: Union[Callable, Any],
+        vectorstore=None,
+        prompt_builder: Optional[PromptBuilder] = None,
+        cache: Optional[SuggestionCache] = None,
+        semantic_cache: Optional[SemanticSuggestionCache] = None,
+        chunker: Optional[CodeChunker] = None,
+        context_diversity: float = 0.3,
+        retrieval_mode: str = "vector"
+    ):
         """Initialize the CodeSuggestion class
         
         Args:
             model_pipeline: Either a QuantizedModel instance or a pipeline function
             vectorstore: Optional vector store for retrieving context
+            prompt_builder: Fits prompts into the model context (defaults to
+                one using the model's tokenizer and context size)
+            cache: Optional exact-match cache of generated suggestions
+            semantic_cache: Optional cache answering near-duplicate requests
+            chunker: Splits long code into the piece used as the retrieval
+                query (should match the chunking used at ingestion)
+            context_diversity: Weight of novelty against relevance when
+                picking retrieved examples (0 = closest only)
+            retrieval_mode: "vector" for embedding similarity or "hybrid"
+                to fuse it with identifier matches (needs a store with
+                hybrid_search)
         """
         self.model_pipeline = model_pipeline
         self.vectorstore = vectorstore
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.chunker = chunker or CodeChunker()
+        self.context_diversity = context_diversity
+        self.retrieval_mode = retrieval_mode
+        
+        # Templates without the source indentation, which only costs tokens
+        self.prompts = {
+            suggestion_type: compact_template(template)
+            for suggestion_type, template in self.PROMPTS.items()
+        }
+        
+        if prompt_builder is None:
+            prompt_builder = PromptBuilder(
+                count_tokens=getattr(model_pipeline, "count_tokens", None),
+                n_ctx=getattr(model_pipeline, "n_ctx", 2048)
+            )
+        self.prompt_builder = prompt_builder
+        
+        # Retrieved examples get the share of the prompt the builder reserves for context
+        self.context_packer = ContextPacker(
+            count_tokens=prompt_builder.count_tokens,
+            max_tokens=int(prompt_builder.prompt_budget * prompt_builder.context_share)
+        )
+    
+    def cache_key(self, code: str, suggestion_type: str, context: Optional[str] = None) -> Optional[str]:
+        """Key of a request in the suggestion cache, or None without a cache"""
+        if self.cache is None:
+            return None
+        return self.request_key(code, suggestion_type, context)
     
-    def get_context(self, code: str, n_results: int = 3) -> str:
+    def request_key(self, code: str, suggestion_type: str, context: Optional[str] = None) -> str:
+        """Key identifying requests that produce the same suggestion"""
+        return SuggestionCache.make_key(
+            code,
+            suggestion_type,
+            context,
+            model_file=getattr(self.model_pipeline, "model_file", None),
+            temperature=getattr(self.model_pipeline, "temperature", None)
+        )
+    
+    def lookup_cache(
+        self,
+        code: str,
+        suggestion_type: str,
+        context: Optional[str] = None,
+        language: Optional[str] = None
+    ) -> Optional[str]:
+        """Cached suggestion of a request, without running the model
+
+        Lets a server answer cache hits without queueing for the model.
+        Fill-in-the-middle requests pass the prefix as code and the suffix
+        as context, as in their cache key.
+
+        Returns:
+            Suggestion from the exact or semantic cache, or None
+        """
+        cache_key = self.cache_key(code, suggestion_type, context)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        if self.semantic_cache is not None and suggestion_type != "fim":
+            cached, _ = self.semantic_cache.lookup(code, suggestion_type, language, context)
+            return cached
+        return None
+
+    def get_stop_condition(
+        self,
+        suggestion_type: str,
+        code: str,
+        language: Optional[str] = None
+    ) -> Optional[StopEngine]:
+        """Build the early-stop engine of a request
+        
+        Args:
+            suggestion_type: Type of suggestion being generated
+            code: Input code (the prefix for fill-in-the-middle)
+            language: Language of the code (None = unknown)
+            
+        Returns:
+            StopEngine, or None if the type declares no rules
+        """
+        engine = StopEngine.from_rules(self.STOP_RULES.get(suggestion_type, []), code, language)
+        margin = self.STOP_LINE_MARGINS.get(suggestion_type)
+        if margin is not None:
+            engine.conditions.append(MaxLinesStop(code, max_lines=len(code.splitlines()) + margin))
+        return engine if engine.conditions else None
+    
+    def get_prompt_prefixes(self) -> Dict[str, str]:
+        """Static leading text of each prompt template
+        
+        The prefix runs up to the last line break before the first placeholder,
+        so it tokenizes the same way alone as inside a formatted prompt.
+        
+        Returns:
+            Dict mapping suggestion type to its fixed prompt prefix
+        """
+        prefixes = {}
+        for suggestion_type, template in self.prompts.items():
+            head = template.split("{", 1)[0]
+            prefixes[suggestion_type] = head[:head.rfind("\n") + 1]
+        return prefixes
+    
+    def warm_prompt_cache(self):
+        """Precompute the model state of every prompt prefix, if supported"""
+        warm_prefix = getattr(self.model_pipeline, "warm_prefix", None)
+        if warm_prefix is None:
+            return
+        for prefix in self.get_prompt_prefixes().values():
+            warm_prefix(prefix)
+    
+    def get_context(
+        self,
+        code: str,
+        n_results: int = 3,
+        language: Optional[str] = None,
+        cursor: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        mode: Optional[str] = None
+    ) -> str:
         """Retrieve relevant context from the vector store
         
+        Code longer than a stored snippet is reduced to the function or class
+        around the cursor, so the query embedding is comparable to the
+        snippet embeddings and not truncated by the model. Extra candidates
+        are fetched so near-duplicates can be dropped (maximal marginal
+        relevance) before the examples are packed into the token budget.
+        
         Args:
             code: The code to get context for
             n_results: Number of context examples to retrieve
+            language: Language of the code
+            cursor: Character offset of the cursor in code
+            max_tokens: Token budget of the context (None = the prompt
+                builder's context share)
+            mode: "vector" or "hybrid" (None = retrieval_mode)
             
         Returns:
             String with context information
@@ -103,42 +324,44 @@ class CodeSuggestion:
         if not self.vectorstore:
             return ""
             
-        results = self.vectorstore.search(code, n_results=n_results)
-        
-        # Format context from search results
-        context_items = []
-        for i, (doc, metadata) in enumerate(zip(results.get('documents', [[]]), results.get('metadatas', [[]]))):
-            if doc and metadata:
-                context_items.append(f"Example {i+1} ({metadata.get('language', 'code')}):\n{doc[0]}")
+        query = self.chunker.query_chunk(code, language, cursor)
+        mode = mode or self.retrieval_mode
+        search = self.vectorstore.search
+        if mode == "hybrid" and hasattr(self.vectorstore, "hybrid_search"):
+            search = self.vectorstore.hybrid_search
+        results = search(
+            query,
+            n_results=n_results * 3,
+            include=["documents", "metadatas", "distances", "embeddings"]
+        )
         
-        return "\n\n".join(context_items) if context_items else ""
+        snippets = mmr_select(flatten_results(results), n_results, diversity=self.context_diversity)
+        return self.context_packer.pack(snippets, max_tokens)
     
-    def _clean_response(self, response: str) -> str:
+    def _clean_response(self, response: str, partial: bool = False) -> str:
         """Clean up the model response by removing prompt artifacts
         
         Args:
             response: Raw model response
+            partial: Whether the response is still being generated
             
         Returns:
             Cleaned response
         """
+        if partial:
+            response = response.strip()
+        
         # Remove the instruction tag if it appears in the response
         if "[/INST]" in response:
             response = response.split("[/INST]", 1)[1].strip()
         
         # Remove common prefixes that models sometimes generate
-        prefixes_to_remove = [
-            "Here's the completed code:",
-            "Here is the completed code:",
-            "Here's the fixed code:",
-            "Here is the fixed code:",
-            "Here's the implementation:",
-            "Here is the implementation:"
-        ]
-        
-        for prefix in prefixes_to_remove:
+        for prefix in self.RESPONSE_PREFIXES:
             if response.startswith(prefix):
                 response = response[len(prefix):].strip()
+            elif partial and prefix.startswith(response):
+                # Hold back text that may still turn into a removable prefix
+                return ""
         
         return response
     
@@ -157,7 +380,11 @@ class CodeSuggestion:
         self, 
         code: str, 
         suggestion_type: SUGGESTION_TYPES = "completion",
-        context: Optional[str] = None
+        context: Optional[str] = None,
+        on_partial: Optional[Callable[[str], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        cursor: Optional[int] = None,
+        language: Optional[str] = None
     ) -> str:
         """Generate a code suggestion
         
@@ -165,28 +392,116 @@ class CodeSuggestion:
             code: Code to suggest improvements for
             suggestion_type: Type of suggestion to generate
             context: Additional context (if None, will try to get from vectorstore)
+            on_partial: Optional callback receiving cleaned text increments
+                while the suggestion is being generated
+            cancel_event: Optional flag that aborts the generation between tokens
+            cursor: Character offset of the cursor in code; code is trimmed
+                around it when it does not fit the prompt budget
+            language: Language of the code, separating semantic cache entries
             
         Returns:
             Suggested code with explanations
         """
         if suggestion_type not in self.PROMPTS:
             raise ValueError(f"Invalid suggestion type: {suggestion_type}")
+        
+        # Identical requests are answered from the cache without running the model
+        cache_key = self.cache_key(code, suggestion_type, context)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        # Nearly identical requests reuse an earlier suggestion
+        code_vector = None
+        if self.semantic_cache is not None:
+            cached, code_vector = self.semantic_cache.lookup(code, suggestion_type, language, context)
+            if cached is not None:
+                return cached
             
         # Get context if not provided
         if context is None and self.vectorstore:
-            context = self.get_context(code)
+            context = self.get_context(code, language=language, cursor=cursor)
             
-        # Format the prompt with the template
-        prompt_template = self.PROMPTS[suggestion_type]
-        formatted_prompt = prompt_template.format(
+        # Format the prompt within the token budget of the model
+        formatted_prompt, max_tokens = self.prompt_builder.build(
+            self.prompts[suggestion_type],
             code=code,
-            context=context if context else "No additional context."
+            context=context,
+            cursor=cursor
         )
         
+        # Only pass streaming/cancellation hooks when used, so plain pipelines keep working
+        generate_kwargs = {}
+        stop_condition = self.get_stop_condition(suggestion_type, code, language)
+        if stop_condition is not None:
+            generate_kwargs["stop_condition"] = stop_condition
+        if on_partial is not None:
+            generate_kwargs["on_token"] = _PartialCleaner(self._clean_response, on_partial)
+        if cancel_event is not None:
+            generate_kwargs["cancel_event"] = cancel_event
+        
         # Generate text from the model
-        result = self.model_pipeline.generate(formatted_prompt, max_tokens=1536)
+        result = self.model_pipeline.generate(formatted_prompt, max_tokens=max_tokens, **generate_kwargs)
         
         # Clean the response before returning it
         result = self._clean_response(result)
         
-        return result
\ No newline at end of file
+        if cache_key is not None and result:
+            self.cache.put(cache_key, result)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(code, result, suggestion_type, language, context, vector=code_vector)
+        
+        return result
+    
+    def generate_infill(
+        self,
+        prefix: str,
+        suffix: str = "",
+        max_tokens: Optional[int] = None,
+        on_partial: Optional[Callable[[str], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        language: Optional[str] = None
+    ) -> str:
+        """Generate the code between a prefix and a suffix (fill-in-the-middle)
+        
+        Args:
+            prefix: Code before the cursor
+            suffix: Code after the cursor
+            max_tokens: Maximum tokens for the middle (default FIM_MAX_NEW_TOKENS)
+            on_partial: Optional callback receiving text increments as generated
+            cancel_event: Optional flag that aborts the generation between tokens
+            language: Language of the code, deciding its comment syntax
+            
+        Returns:
+            Text to insert at the cursor, with its whitespace preserved
+        """
+        # The suffix takes the place of the context in the cache key
+        cache_key = self.cache_key(prefix, "fim", suffix)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        prompt, max_tokens = self.prompt_builder.build_infill(
+            self.FIM_TEMPLATE,
+            prefix=prefix,
+            suffix=suffix,
+            max_new_tokens=max_tokens or self.FIM_MAX_NEW_TOKENS
+        )
+        
+        generate_kwargs = {"stop": self.FIM_STOP, "strip": False}
+        stop_condition = self.get_stop_condition("fim", prefix, language)
+        if stop_condition is not None:
+            generate_kwargs["stop_condition"] = stop_condition
+        if on_partial is not None:
+            generate_kwargs["on_token"] = on_partial
+        if cancel_event is not None:
+            generate_kwargs["cancel_event"] = cancel_event
+        
+        result = self.model_pipeline.generate(prompt, max_tokens=max_tokens, **generate_kwargs)
+        
+        if cache_key is not None and result:
+            self.cache.put(cache_key, result)
+        
+        return result
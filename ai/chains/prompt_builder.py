@@ -0,0 +1,230 @@
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+
+def compact_template(template: str) -> str:
+    """Strip indentation and repeated blank lines from a prompt template
+
+    Args:
+        template: Prompt template as written in the source
+
+    Returns:
+        Template with the same text and placeholders but no padding
+    """
+    compacted = []
+    for line in template.strip().splitlines():
+        line = line.strip()
+        if not line and compacted and not compacted[-1]:
+            continue
+        compacted.append(line)
+    return "\n".join(compacted)
+
+
+def approximate_token_count(text: str) -> int:
+    """Rough token count for models without a tokenizer (~4 chars per token)"""
+    return (len(text) + 3) // 4
+
+
+class PromptBuilder:
+    """Fits code and retrieved context into the model's context window"""
+
+    def __init__(
+        self,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        n_ctx: int = 2048,
+        max_new_tokens: int = 1536,
+        min_new_tokens: int = 128,
+        prompt_budget: Optional[int] = None,
+        context_share: float = 0.35,
+        cursor_share: float = 0.75,
+        empty_context: str = "No additional context."
+    ):
+        """Initialize the prompt builder
+
+        Args:
+            count_tokens: Function returning the token count of a text
+                (None = approximate from the character count)
+            n_ctx: Context window of the model
+            max_new_tokens: Upper bound for the generation length
+            min_new_tokens: Tokens always left free for the generation
+            prompt_budget: Maximum prompt size in tokens
+                (None = everything except min_new_tokens)
+            context_share: Share of the free prompt budget reserved for
+                retrieved context when there is any
+            cursor_share: Share of the code budget spent before the cursor
+            empty_context: Text used when there is no context
+        """
+        # Recent counts are kept: code is counted when a request arrives and
+        # again while its prompt is built
+        self.count_tokens = lru_cache(maxsize=256)(count_tokens or approximate_token_count)
+        self.n_ctx = n_ctx
+        self.max_new_tokens = max_new_tokens
+        self.min_new_tokens = min_new_tokens
+        self.prompt_budget = min(
+            prompt_budget or n_ctx,
+            max(0, n_ctx - min_new_tokens)
+        )
+        self.context_share = context_share
+        self.cursor_share = cursor_share
+        self.empty_context = empty_context
+
+    def build(
+        self,
+        template: str,
+        code: str,
+        context: Optional[str] = None,
+        cursor: Optional[int] = None
+    ) -> Tuple[str, int]:
+        """Format a template within the prompt budget
+
+        Code is kept around the cursor first; context gets its reserved
+        share plus whatever the code does not use.
+
+        Args:
+            template: Template with {code} and {context} placeholders
+            code: Code (or requirement) to insert
+            context: Retrieved or user-provided context
+            cursor: Character offset of the cursor in code (None = end)
+
+        Returns:
+            Tuple of (prompt, max_tokens for the generation)
+        """
+        context = context or ""
+        fixed = self.count_tokens(template.format(code="", context=self.empty_context))
+        available = max(0, self.prompt_budget - fixed)
+
+        # Token counts of pieces are not exactly additive, so shrink and retry on overflow
+        for _ in range(3):
+            context_budget = int(available * self.context_share) if context else 0
+            code_text = self.fit_code(code, available - context_budget, cursor)
+            context_text = self.fit_text(context, available - self.count_tokens(code_text))
+
+            prompt = template.format(code=code_text, context=context_text or self.empty_context)
+            prompt_tokens = self.count_tokens(prompt)
+            overflow = prompt_tokens - self.prompt_budget
+            if overflow <= 0 or available == 0:
+                break
+            available = max(0, available - overflow)
+
+        max_tokens = max(1, min(self.max_new_tokens, self.n_ctx - prompt_tokens))
+        return prompt, max_tokens
+
+    def build_infill(
+        self,
+        template: str,
+        prefix: str,
+        suffix: str,
+        max_new_tokens: int
+    ) -> Tuple[str, int]:
+        """Format a fill-in-the-middle template within the context window
+
+        The end of the prefix and the start of the suffix are kept, with
+        cursor_share of the budget going to the prefix.
+
+        Args:
+            template: Template with {prefix} and {suffix} placeholders
+            prefix: Code before the cursor
+            suffix: Code after the cursor
+            max_new_tokens: Tokens to leave free for the generated middle
+
+        Returns:
+            Tuple of (prompt, max_tokens for the generation)
+        """
+        fixed = self.count_tokens(template.format(prefix="", suffix=""))
+        available = max(0, self.n_ctx - max_new_tokens - fixed)
+
+        for _ in range(3):
+            suffix_budget = int(available * (1 - self.cursor_share)) if suffix else 0
+            prefix_text = self.fit_code(prefix, available - suffix_budget)
+            suffix_text = self.fit_text(suffix, available - self.count_tokens(prefix_text))
+
+            prompt = template.format(prefix=prefix_text, suffix=suffix_text)
+            prompt_tokens = self.count_tokens(prompt)
+            overflow = prompt_tokens + max_new_tokens - self.n_ctx
+            if overflow <= 0 or available == 0:
+                break
+            available = max(0, available - overflow)
+
+        max_tokens = max(1, min(max_new_tokens, self.n_ctx - prompt_tokens))
+        return prompt, max_tokens
+
+    def fit_code(self, code: str, budget: int, cursor: Optional[int] = None) -> str:
+        """Keep whole lines around the cursor within a token budget
+
+        Args:
+            code: Source code
+            budget: Maximum number of tokens
+            cursor: Character offset of the cursor (None = end of code)
+
+        Returns:
+            Contiguous block of lines containing the cursor line
+        """
+        if budget <= 0:
+            return ""
+        if self.count_tokens(code) <= budget:
+            return code
+
+        lines = code.splitlines(keepends=True)
+        cursor = len(code) if cursor is None else max(0, min(cursor, len(code)))
+        cursor_line = min(code.count("\n", 0, cursor), len(lines) - 1)
+
+        costs = {}
+
+        def cost(index: int) -> int:
+            if index not in costs:
+                costs[index] = self.count_tokens(lines[index])
+            return costs[index]
+
+        used = cost(cursor_line)
+        if used > budget:
+            # A single huge line: keep the text just before the cursor
+            line_start = code.rfind("\n", 0, cursor) + 1
+            return self._fit_tail(code[line_start:cursor], budget)
+
+        start = end = cursor_line
+        # Lines before the cursor first, then after it, then before again with what is left
+        for direction, limit in ((-1, budget * self.cursor_share), (1, budget), (-1, budget)):
+            index = start - 1 if direction < 0 else end + 1
+            while 0 <= index < len(lines) and used + cost(index) <= limit:
+                used += cost(index)
+                if direction < 0:
+                    start = index
+                else:
+                    end = index
+                index += direction
+
+        return "".join(lines[start:end + 1])
+
+    def _fit_tail(self, text: str, budget: int) -> str:
+        """Keep the end of a text without line breaks within a token budget"""
+        tokens = self.count_tokens(text)
+        while text and tokens > budget:
+            keep = int(len(text) * budget / tokens * 0.9)
+            text = text[len(text) - keep:] if keep > 0 else ""
+            tokens = self.count_tokens(text)
+        return text
+
+    def fit_text(self, text: str, budget: int) -> str:
+        """Keep the leading lines of a text within a token budget
+
+        Args:
+            text: Text to shorten
+            budget: Maximum number of tokens
+
+        Returns:
+            The text cut after the last whole line that fits
+        """
+        if budget <= 0 or not text:
+            return ""
+        if self.count_tokens(text) <= budget:
+            return text
+
+        kept = []
+        used = 0
+        for line in text.splitlines(keepends=True):
+            line_tokens = self.count_tokens(line)
+            if used + line_tokens > budget:
+                break
+            kept.append(line)
+            used += line_tokens
+        return "".join(kept).rstrip()
@@ -0,0 +1,184 @@
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .prompt_builder import approximate_token_count
+
+
+class RetrievedSnippet:
+    """One search result with its distance and, if requested, its embedding"""
+
+    def __init__(
+        self,
+        document: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        distance: float = 0.0,
+        embedding: Optional[np.ndarray] = None,
+        score: Optional[float] = None
+    ):
+        self.document = document
+        self.metadata = metadata or {}
+        self.distance = distance
+        self.embedding = embedding
+        self.score = score
+
+    @property
+    def relevance(self) -> float:
+        """Fused score of a hybrid search, otherwise the cosine similarity to
+        the query (unit-length embeddings under squared L2 distance)"""
+        if self.score is not None:
+            return self.score
+        return 1.0 - self.distance / 2.0
+
+
+def flatten_results(results: Dict[str, Any], query_index: int = 0) -> List[RetrievedSnippet]:
+    """Turn a search result dict into snippets of one query
+
+    Search results hold one inner list per query; the fields of a query
+    are parallel lists ("documents", "metadatas", "distances", "embeddings",
+    and "scores" for hybrid searches).
+
+    Args:
+        results: Result of a vector store search
+        query_index: Query whose results to return
+
+    Returns:
+        Snippets in result order, without empty documents
+    """
+    def column(name: str) -> list:
+        values = results.get(name)
+        if values is None or len(values) <= query_index or values[query_index] is None:
+            return []
+        return list(values[query_index])
+
+    documents = column("documents")
+    metadatas = column("metadatas")
+    distances = column("distances")
+    embeddings = column("embeddings")
+    scores = column("scores")
+
+    snippets = []
+    for i, document in enumerate(documents):
+        if not document:
+            continue
+        snippets.append(RetrievedSnippet(
+            document,
+            metadatas[i] if i < len(metadatas) else None,
+            float(distances[i]) if i < len(distances) else float(i),
+            np.asarray(embeddings[i], dtype=np.float32) if i < len(embeddings) else None,
+            float(scores[i]) if i < len(scores) else None
+        ))
+    return snippets
+
+
+def mmr_select(
+    snippets: List[RetrievedSnippet],
+    k: int,
+    diversity: float = 0.3,
+    duplicate_threshold: float = 0.95
+) -> List[RetrievedSnippet]:
+    """Pick relevant snippets that are not near-duplicates of each other
+
+    Maximal marginal relevance: each step takes the snippet maximizing
+    (1 - diversity) * relevance - diversity * (similarity to the closest
+    snippet already picked). Snippets at least duplicate_threshold similar
+    to a picked one are dropped. Without embeddings, the first k distinct
+    snippets are kept.
+
+    Args:
+        snippets: Candidates from the search, best first
+        k: Snippets to pick
+        diversity: Weight of novelty against relevance (0 = plain ranking)
+        duplicate_threshold: Cosine similarity counted as a near-duplicate
+
+    Returns:
+        Picked snippets, most valuable first
+    """
+    if k <= 0 or not snippets:
+        return []
+    ranked = list(snippets)
+    if any(snippet.embedding is None for snippet in ranked):
+        # Exact duplicates can still be dropped by text
+        unique, seen = [], set()
+        for snippet in ranked:
+            if snippet.document not in seen:
+                seen.add(snippet.document)
+                unique.append(snippet)
+        return unique[:k]
+
+    vectors = np.stack([snippet.embedding for snippet in ranked])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    vectors = vectors / norms
+    similarity = vectors @ vectors.T
+    relevance = np.array([snippet.relevance for snippet in ranked])
+    if any(snippet.score is not None for snippet in ranked) and relevance.max() > 0:
+        # Fused rank scores are tiny; scale them to the range of similarities
+        relevance = relevance / relevance.max()
+
+    picked: List[int] = []
+    remaining = list(range(len(ranked)))
+    # Highest similarity of every candidate to the picked snippets
+    closest = np.full(len(ranked), -1.0)
+    while remaining and len(picked) < k:
+        scores = (1 - diversity) * relevance[remaining] - diversity * np.maximum(closest[remaining], 0)
+        best = remaining[int(np.argmax(scores))]
+        picked.append(best)
+        closest = np.maximum(closest, similarity[best])
+        remaining = [i for i in remaining if i != best and similarity[best, i] < duplicate_threshold]
+    return [ranked[i] for i in picked]
+
+
+class ContextPacker:
+    """Formats retrieved snippets as prompt context within a token budget"""
+
+    def __init__(self, count_tokens: Optional[Callable[[str], int]] = None, max_tokens: int = 256):
+        """Initialize the packer
+
+        Args:
+            count_tokens: Function returning the token count of a text
+                (None = approximate from the character count)
+            max_tokens: Token budget of the whole context
+        """
+        self.count_tokens = count_tokens or approximate_token_count
+        self.max_tokens = max_tokens
+
+    @staticmethod
+    def header(index: int, snippet: RetrievedSnippet) -> str:
+        metadata = snippet.metadata
+        label = metadata.get("language") or "code"
+        if metadata.get("path"):
+            location = metadata["path"]
+            if metadata.get("start_line"):
+                location += f":{metadata['start_line']}-{metadata.get('end_line', metadata['start_line'])}"
+            label += f", {location}"
+        return f"Example {index} ({label}):"
+
+    def pack(self, snippets: List[RetrievedSnippet], max_tokens: Optional[int] = None) -> str:
+        """Format the snippets that fit the budget, most relevant first
+
+        Snippets are considered in the given order; one that does not fit is
+        skipped so a smaller one behind it can still be used.
+
+        Args:
+            snippets: Snippets in order of preference
+            max_tokens: Budget overriding the default
+
+        Returns:
+            Context text ("" if nothing fits)
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        chosen = []
+        used = 0
+        for snippet in snippets:
+            # The header numbering is not known yet; reserve for a two-digit index
+            cost = self.count_tokens(f"{self.header(10, snippet)}\n{snippet.document}\n\n")
+            if used + cost > budget:
+                continue
+            chosen.append(snippet)
+            used += cost
+
+        chosen.sort(key=lambda snippet: snippet.relevance, reverse=True)
+        return "\n\n".join(
+            f"{self.header(i + 1, snippet)}\n{snippet.document}" for i, snippet in enumerate(chosen)
+        )
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("semantic-cache")
+
+
+class _Bucket:
+    """Entries of one (suggestion type, language, context) combination"""
+
+    def __init__(self, dimension: int):
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+        # Parallel to the rows of vectors: [suggestion, created, last_used]
+        self.entries: List[list] = []
+
+
+class SemanticSuggestionCache:
+    """Reuses suggestions of earlier requests whose code is nearly the same
+
+    Incoming code is embedded and compared by cosine similarity with the code
+    of earlier requests of the same suggestion type, language and context.
+    Requests that only differ in whitespace, names or comments usually score
+    above the threshold and get the earlier suggestion back. Code longer than
+    the embedding model's input is neither looked up nor stored: the model
+    only sees its beginning, so inputs sharing that beginning would match
+    whatever follows it.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        threshold: float = 0.97,
+        suggestion_types: Iterable[str] = ("fix", "generate"),
+        max_entries: int = 256,
+        ttl: float = 3600.0,
+        enabled: bool = True
+    ):
+        """Initialize the cache
+
+        Args:
+            embeddings: CodeEmbeddings or EmbeddingBatcher (anything with embed_array and fits)
+            threshold: Minimum cosine similarity for a hit
+            suggestion_types: Suggestion types served from the cache
+            max_entries: Entries kept per type/language/context (least recently used are evicted)
+            ttl: Seconds an entry stays valid (0 = forever)
+            enabled: Kill switch; a disabled cache never embeds, stores or hits
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.suggestion_types = set(suggestion_types)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+
+        self._buckets: Dict[Tuple[str, str, str], _Bucket] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._too_long = 0
+
+    def handles(self, suggestion_type: str) -> bool:
+        """Whether requests of this type are looked up and stored"""
+        return self.enabled and suggestion_type in self.suggestion_types
+
+    def _embed(self, code: str) -> Optional[np.ndarray]:
+        """Unit-length embedding of code, or None if embedding fails"""
+        try:
+            vector = self.embeddings.embed_array([code], normalize=True)[0]
+        except Exception as e:
+            logger.warning(f"Could not embed code for the semantic cache: {str(e)}")
+            return None
+        return vector if vector.any() else None
+
+    def lookup(
+        self,
+        code: str,
+        suggestion_type: str,
+        language: Optional[str] = None,
+        context: Optional[str] = None
+    ) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Find the suggestion of the most similar earlier request
+
+        Args:
+            code: Input code
+            suggestion_type: Type of suggestion
+            language: Language of the code (None = unknown)
+            context: Context sent with the request
+
+        Returns:
+            Tuple of (suggestion or None, embedding of code to pass to add)
+        """
+        if not self.handles(suggestion_type) or not code.strip():
+            return None, None
+        if not self.embeddings.fits(code):
+            with self._lock:
+                self._too_long += 1
+            return None, None
+        vector = self._embed(code)
+        if vector is None:
+            return None, None
+
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get((suggestion_type, language or "", context or ""))
+            if bucket is not None and len(bucket.entries):
+                self._expire(bucket, now)
+            if bucket is not None and len(bucket.entries):
+                similarities = bucket.vectors @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry = bucket.entries[best]
+                    entry[2] = now
+                    self._hits += 1
+                    logger.info(f"Semantic cache hit (similarity {similarities[best]:.3f})")
+                    return entry[0], vector
+            self._misses += 1
+        return None, vector
+
+    def add(
+        self,
+        code: str,
+        suggestion: str,
+        suggestion_type: str,
+        language: Optional[str] = None,
+        context: Optional[str] = None,
+        vector: Optional[np.ndarray] = None
+    ):
+        """Store the suggestion generated for a request
+
+        Args:
+            code: Input code
+            suggestion: Generated suggestion
+            suggestion_type: Type of suggestion
+            language: Language of the code (None = unknown)
+            context: Context sent with the request
+            vector: Embedding returned by lookup (computed if None)
+        """
+        if not self.handles(suggestion_type) or not suggestion:
+            return
+        if vector is None:
+            if not self.embeddings.fits(code):
+                return
+            vector = self._embed(code)
+            if vector is None:
+                return
+
+        now = time.time()
+        key = (suggestion_type, language or "", context or "")
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(len(vector))
+            bucket.vectors = np.vstack([bucket.vectors, vector[np.newaxis, :]])
+            bucket.entries.append([suggestion, now, now])
+
+            if len(bucket.entries) > self.max_entries:
+                # Evict the least recently used entry
+                oldest = min(range(len(bucket.entries)), key=lambda i: bucket.entries[i][2])
+                self._remove(bucket, [oldest])
+                self._evictions += 1
+
+    def _expire(self, bucket: _Bucket, now: float):
+        """Drop expired entries of a bucket (caller holds the lock)"""
+        if not self.ttl:
+            return
+        expired = [i for i, entry in enumerate(bucket.entries) if now - entry[1] > self.ttl]
+        if expired:
+            self._remove(bucket, expired)
+
+    @staticmethod
+    def _remove(bucket: _Bucket, indices: List[int]):
+        keep = np.ones(len(bucket.entries), dtype=bool)
+        keep[indices] = False
+        bucket.vectors = bucket.vectors[keep]
+        bucket.entries = [entry for entry, kept in zip(bucket.entries, keep) if kept]
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and sizes"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": sum(len(bucket.entries) for bucket in self._buckets.values()),
+                "evictions": self._evictions,
+                "too_long": self._too_long,
+                "threshold": self.threshold
+            }
@@ -0,0 +1,227 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Line comment markers per language; brackets after them are not counted.
+# Unknown languages get none, since "#" and "//" are operators elsewhere
+LINE_COMMENTS: Dict[str, Tuple[str, ...]] = {
+    "python": ("#",), "ruby": ("#",), "shell": ("#",), "powershell": ("#",), "yaml": ("#",),
+    "javascript": ("//",), "typescript": ("//",), "java": ("//",), "kotlin": ("//",),
+    "scala": ("//",), "go": ("//",), "rust": ("//",), "swift": ("//",), "c": ("//",),
+    "cpp": ("//",), "csharp": ("//",), "scss": ("//",), "php": ("//", "#"), "sql": ("--",),
+}
+
+
+def indent_width(line: str, tab_size: int = 4) -> int:
+    """Width of the leading whitespace of a line"""
+    stripped = line.lstrip(" \t")
+    return len(line[:len(line) - len(stripped)].expandtabs(tab_size))
+
+
+class StopCondition:
+    """Decides during generation whether the output is complete
+
+    Conditions are created per request from the input code and see the
+    generated text grow token by token. They must stay picklable so model
+    worker processes can evaluate them.
+    """
+
+    def __init__(self, code: str = "", language: Optional[str] = None):
+        """Initialize the condition
+
+        Args:
+            code: Input code of the request (text before the cursor)
+            language: Language of the code (None = unknown)
+        """
+
+    def check(self, text: str) -> Optional[int]:
+        """Check the generated text so far
+
+        Args:
+            text: Everything generated so far
+
+        Returns:
+            Length of text to keep if generation should stop, otherwise None
+        """
+        raise NotImplementedError
+
+
+class CodeFenceStop(StopCondition):
+    """Stops once the first fenced code block has been closed"""
+
+    def check(self, text: str) -> Optional[int]:
+        opening = text.find("```")
+        if opening < 0:
+            return None
+        # The opening fence may carry a language tag up to the end of its line
+        body = text.find("\n", opening)
+        if body < 0:
+            return None
+        closing = text.find("```", body)
+        if closing < 0:
+            return None
+        return closing + 3
+
+
+class MaxLinesStop(StopCondition):
+    """Stops after a fixed number of lines"""
+
+    def __init__(self, code: str = "", max_lines: int = 40, language: Optional[str] = None):
+        self.max_lines = max_lines
+
+    def check(self, text: str) -> Optional[int]:
+        if text.count("\n") < self.max_lines:
+            return None
+        cut = -1
+        for _ in range(self.max_lines):
+            cut = text.index("\n", cut + 1)
+        return cut
+
+
+class BracketBalanceStop(StopCondition):
+    """Stops at the end of the line that closes the brackets left open in the input
+
+    Inactive when the input has no unclosed brackets. Quotes are skipped
+    heuristically, and line comments when the language is known.
+    """
+
+    OPENERS = "([{"
+    CLOSERS = ")]}"
+
+    def __init__(self, code: str = "", language: Optional[str] = None):
+        self._comment_markers = LINE_COMMENTS.get((language or "").lower(), ())
+        self._depth = 0
+        self._quote = None
+        self._comment = False
+        self._scan(code, 0, stop_at_zero=False)
+        self.active = self._depth > 0
+        # Strings and comments do not carry over from the input
+        self._quote = None
+        self._comment = False
+        self._pos = 0
+        self._balanced = False
+
+    def _scan(self, text: str, start: int, stop_at_zero: bool = True) -> Optional[int]:
+        """Advance the scanner; returns the index where depth first drops to zero"""
+        i = start
+        while i < len(text):
+            char = text[i]
+            if char == "\n":
+                self._quote = None
+                self._comment = False
+            elif self._comment:
+                pass
+            elif self._quote:
+                if char == "\\":
+                    i += 1
+                elif char == self._quote:
+                    self._quote = None
+            elif char in "\"'`":
+                self._quote = char
+            elif any(text.startswith(marker, i) for marker in self._comment_markers):
+                self._comment = True
+            elif char in self.OPENERS:
+                self._depth += 1
+            elif char in self.CLOSERS:
+                self._depth -= 1
+                if stop_at_zero and self._depth <= 0:
+                    return i
+            i += 1
+        return None
+
+    def check(self, text: str) -> Optional[int]:
+        if not self.active:
+            return None
+        if not self._balanced:
+            closed = self._scan(text, self._pos)
+            if closed is None:
+                self._pos = len(text)
+                return None
+            self._balanced = True
+            self._pos = closed + 1
+
+        # Finish the line on which the brackets were closed
+        end_of_line = text.find("\n", self._pos)
+        return end_of_line if end_of_line >= 0 else None
+
+
+class DedentStop(StopCondition):
+    """Stops when a generated line dedents below the indentation at the cursor
+
+    If the cursor line is blank, the block of the previous non-blank line is
+    used, one level deeper when that line opens a block.
+    """
+
+    def __init__(self, code: str = "", language: Optional[str] = None):
+        lines = code.split("\n")
+        cursor_line = lines[-1]
+        if cursor_line.strip():
+            self.start_indent = indent_width(cursor_line)
+        else:
+            previous = next((line for line in reversed(lines[:-1]) if line.strip()), "")
+            self.start_indent = indent_width(previous)
+            if previous.rstrip().endswith((":", "{")):
+                self.start_indent += 1
+        self._pos = None
+
+    def check(self, text: str) -> Optional[int]:
+        if self.start_indent == 0:
+            return None
+        if self._pos is None:
+            # The first line continues the cursor line
+            first_break = text.find("\n")
+            if first_break < 0:
+                return None
+            self._pos = first_break + 1
+
+        while True:
+            end = text.find("\n", self._pos)
+            line = text[self._pos:] if end < 0 else text[self._pos:end]
+            if line.strip():
+                if indent_width(line) < self.start_indent:
+                    # Cut before the line break that leads into the dedented line
+                    return self._pos - 1
+            elif end < 0:
+                # Indentation of a blank partial line is not known yet
+                return None
+            if end < 0:
+                return None
+            self._pos = end + 1
+
+
+class StopEngine:
+    """Combines stop conditions; callable with the generated text so far"""
+
+    def __init__(self, conditions: List[StopCondition]):
+        """Initialize the engine
+
+        Args:
+            conditions: Conditions checked after every generated token
+        """
+        self.conditions = conditions
+        self.reason: Optional[str] = None
+
+    @classmethod
+    def from_rules(
+        cls,
+        rules: List[Callable[..., StopCondition]],
+        code: str,
+        language: Optional[str] = None
+    ) -> "StopEngine":
+        """Build the conditions of a request from rule factories
+
+        Args:
+            rules: StopCondition classes or partials accepting the input code
+                and language
+            code: Input code of the request
+            language: Language of the code (None = unknown)
+        """
+        return cls([rule(code=code, language=language) for rule in rules])
+
+    def __call__(self, text: str) -> Optional[int]:
+        """Length of text to keep if any condition fires, otherwise None"""
+        cut = None
+        for condition in self.conditions:
+            position = condition.check(text)
+            if position is not None and (cut is None or position < cut):
+                cut = position
+                self.reason = type(condition).__name__
+        return cut
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("suggestion-cache")
+
+
+class SuggestionCache:
+    """Exact-match cache of generated suggestions
+
+    Entries live in an in-memory LRU with a time-to-live. An optional SQLite
+    file keeps them across restarts; memory misses fall back to it.
+    """
+
+    # Suggestion types whose input is hashed without normalization
+    RAW_KEY_TYPES = frozenset({"fim"})
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        disk_path: Optional[str] = None,
+        max_disk_entries: int = 100000
+    ):
+        """Initialize the cache
+
+        Args:
+            max_entries: Maximum entries kept in memory
+            ttl: Seconds an entry stays valid (0 = forever)
+            disk_path: SQLite file for the persistent tier (None = memory only)
+            max_disk_entries: Maximum entries kept on disk
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.max_disk_entries = max_disk_entries
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._disk_writes = 0
+
+        self._db = None
+        if disk_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+                self._db = sqlite3.connect(disk_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS suggestions "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Suggestion cache disk tier disabled: {str(e)}")
+                self._db = None
+
+    @staticmethod
+    def normalize_code(code: str) -> str:
+        """Normalize line endings, trailing whitespace and surrounding blank lines"""
+        lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+    @classmethod
+    def make_key(
+        cls,
+        code: str,
+        suggestion_type: str,
+        context: Optional[str] = None,
+        model_file: Optional[str] = None,
+        temperature: Optional[float] = None
+    ) -> str:
+        """Cache key of a request
+
+        Args:
+            code: Input code (normalized before hashing, except the prefix
+                of a fill-in-the-middle request)
+            suggestion_type: Type of suggestion
+            context: Context sent with the request
+            model_file: Model that generates the suggestion
+            temperature: Sampling temperature of the model
+
+        Returns:
+            Hex digest identifying the request
+        """
+        # The whitespace at the cursor decides what the middle of an infill
+        # is, so the prefix (and the suffix, passed as context) is hashed as is
+        if suggestion_type not in cls.RAW_KEY_TYPES:
+            code = cls.normalize_code(code)
+        payload = json.dumps(
+            [code, suggestion_type, context or "", model_file or "", temperature],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl) and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a suggestion, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM suggestions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    self._store(key, row[0], row[1])
+                    self._hits += 1
+                    self._disk_hits += 1
+                    return row[0]
+
+            self._misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        """Store a suggestion"""
+        created = time.time()
+        with self._lock:
+            self._store(key, value, created)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO suggestions (key, value, created) VALUES (?, ?, ?)",
+                        (key, value, created)
+                    )
+                    self._disk_writes += 1
+                    # Prune occasionally rather than on every write
+                    if self._disk_writes % 100 == 0:
+                        self._prune_disk()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not write suggestion cache entry: {str(e)}")
+
+    def _store(self, key: str, value: str, created: float):
+        """Insert into the memory tier and evict the least recently used (caller holds the lock)"""
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _prune_disk(self):
+        """Drop expired and surplus disk entries (caller holds the lock)"""
+        if self.ttl:
+            self._db.execute("DELETE FROM suggestions WHERE created < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM suggestions WHERE key IN ("
+            "SELECT key FROM suggestions ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM suggestions")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and sizes"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self._evictions,
+                "disk": self._db is not None
+            }
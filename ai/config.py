@@ -16,12 +16,54 @@ MODEL_NAME = os.getenv("MODEL_NAME", "TheBloke/CodeLlama-7B-Instruct-GGUF")
 MODEL_FILE = os.getenv("MODEL_FILE", "codellama-7b-instruct.Q4_K_M.gguf")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 DEVICE = "cpu"  # Force CPU
+# "torch" (SentenceTransformer) or "onnx" (int8 export, see `python -m ai.model.onnx_embeddings export`)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", str(Path(DATA_DIR) / "onnx" / EMBEDDING_MODEL.replace("/", "--")))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", str(Path(DATA_DIR) / "embedding_cache"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.7"))
 
+# Inference settings (MODEL_WORKERS > 0 starts a multi-process worker pool)
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", "0"))
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", "0")) or None
+MODEL_QUEUE_SIZE = int(os.getenv("MODEL_QUEUE_SIZE", "32"))
+# Seconds a worker may run a job without progress before it is restarted (0 disables)
+MODEL_PROGRESS_TIMEOUT = float(os.getenv("MODEL_PROGRESS_TIMEOUT", "120"))
+# Generations run at once (0 = one per model worker), generations waiting for the
+# model, and milliseconds one may wait before it is answered "busy" (0 = no limit)
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "0"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_QUEUE_TIMEOUT_MS = float(os.getenv("INFERENCE_QUEUE_TIMEOUT_MS", "10000"))
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR", Path(DATA_DIR) / "prompt_cache")
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0")) or None
+MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "1536"))
+FIM_MAX_NEW_TOKENS = int(os.getenv("FIM_MAX_NEW_TOKENS", "64"))
+
+# Suggestion result cache (size 0 disables it, empty path keeps it in memory only)
+SUGGESTION_CACHE_SIZE = int(os.getenv("SUGGESTION_CACHE_SIZE", "1024"))
+SUGGESTION_CACHE_TTL = float(os.getenv("SUGGESTION_CACHE_TTL", "3600"))
+SUGGESTION_CACHE_PATH = os.getenv("SUGGESTION_CACHE_PATH", str(Path(DATA_DIR) / "suggestion_cache.sqlite3"))
+
+# Semantic cache of near-duplicate requests (SEMANTIC_CACHE_ENABLED=0 is the kill switch)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "256"))
+SEMANTIC_CACHE_TYPES = os.getenv("SEMANTIC_CACHE_TYPES", "fix,generate").split(",")
+
 # Vector store settings
 VECTORSTORE_DIR = os.getenv("VECTORSTORE_DIR", DATA_DIR / "vectorstore")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "code_suggestions")
+# "chroma" (ChromaDB) or "mmap" (memory-mapped matrix shared by worker processes)
+VECTORSTORE_BACKEND = os.getenv("VECTORSTORE_BACKEND", "chroma")
+# "vector" (embedding similarity) or "hybrid" (fused with BM25 identifier matches)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+# Milliseconds a request waits for retrieved context before going ahead without it (0 disables retrieval)
+RETRIEVAL_TIMEOUT_MS = float(os.getenv("RETRIEVAL_TIMEOUT_MS", "200"))
 
 # Service settings
 HOST = os.getenv("HOST", "localhost")
-PORT = int(os.getenv("PORT", "8000"))
\ No newline at end of file
+PORT = int(os.getenv("PORT", "8000"))
+# Suggestion requests of one connection processed concurrently
+MAX_REQUESTS_PER_CONNECTION = int(os.getenv("MAX_REQUESTS_PER_CONNECTION", "4"))
\ No newline at end of file
@@ -0,0 +1,173 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from .embeddings import normalize_rows
+
+logger = logging.getLogger("embedding-batcher")
+
+
+class _Request:
+    """Texts of one caller and the slot for its vectors"""
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.vectors: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+
+class EmbeddingBatcher:
+    """Merges concurrent embedding calls into batched model calls
+
+    Callers block in embed_text while a background thread gathers requests
+    for up to max_wait seconds or until max_batch_size texts are queued,
+    embeds them with one call and hands every caller its own vectors.
+    """
+
+    # Upper bounds of the batch-size histogram buckets
+    HISTOGRAM_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, embeddings, max_batch_size: int = 32, max_wait: float = 0.005):
+        """Initialize the batcher
+
+        Args:
+            embeddings: CodeEmbeddings (anything with embed_array)
+            max_batch_size: Texts that end the gathering window early
+            max_wait: Seconds to wait for more requests after the first one
+        """
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._requests: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._histogram = {bound: 0 for bound in self.HISTOGRAM_BOUNDS}
+        self._larger_batches = 0
+        self._batches = 0
+        self._texts = 0
+        self._requests_served = 0
+
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def embed_text(self, text: Union[str, List[str]]) -> List[List[float]]:
+        """Generate embeddings for text, batched with concurrent callers
+
+        Args:
+            text: Text or list of texts to embed
+
+        Returns:
+            List of embedding vectors
+        """
+        return self.embed_array(text).tolist()
+
+    def embed_array(self, text: Union[str, List[str]], normalize: bool = False) -> np.ndarray:
+        """Generate embeddings for text as one float32 array, batched with concurrent callers
+
+        Args:
+            text: Text or list of texts to embed
+            normalize: Scale every vector to unit length
+
+        Returns:
+            Array of shape (number of texts, embedding dimension)
+        """
+        texts = [text] if isinstance(text, str) else list(text)
+        if not texts:
+            return self.embeddings.embed_array([])
+        request = _Request(texts)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return normalize_rows(request.vectors) if normalize else request.vectors
+
+    def count_tokens(self, text: str) -> int:
+        """Word pieces of text for the embedding model"""
+        return self.embeddings.count_tokens(text)
+
+    def fits(self, text: str) -> bool:
+        """Whether the embedding model embeds text without truncating it"""
+        return self.embeddings.fits(text)
+
+    def _run(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            batch = [first]
+            size = len(first.texts)
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+
+            # Gather more requests until the window closes or the batch is full
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            self._embed(batch, size)
+            if stop:
+                return
+
+    def _embed(self, batch: List[_Request], size: int):
+        """Embed the texts of a batch with one call and split the vectors"""
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = self.embeddings.embed_array(texts, batch_size=max(size, 1))
+        except Exception as e:
+            logger.error(f"Embedding batch of {size} texts failed: {str(e)}")
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        # Callers get views of the batch array rather than copies
+        offset = 0
+        for request in batch:
+            request.vectors = vectors[offset:offset + len(request.texts)]
+            offset += len(request.texts)
+            request.done.set()
+
+        with self._lock:
+            self._batches += 1
+            self._texts += size
+            self._requests_served += len(batch)
+            bound = next((b for b in self.HISTOGRAM_BOUNDS if size <= b), None)
+            if bound is None:
+                self._larger_batches += 1
+            else:
+                self._histogram[bound] += 1
+
+    def shutdown(self):
+        """Stop the background thread after the queued requests"""
+        self._requests.put(None)
+        self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch counters and the distribution of batch sizes (texts per batch)"""
+        with self._lock:
+            histogram = {f"<={bound}": count for bound, count in self._histogram.items()}
+            histogram[f">{self.HISTOGRAM_BOUNDS[-1]}"] = self._larger_batches
+            return {
+                "batches": self._batches,
+                "requests": self._requests_served,
+                "texts": self._texts,
+                "mean_batch_size": self._texts / self._batches if self._batches else 0.0,
+                "batch_sizes": histogram,
+                "max_batch_size": self.max_batch_size,
+                "max_wait": self.max_wait
+            }
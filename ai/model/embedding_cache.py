@@ -0,0 +1,269 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger("embedding-cache")
+
+
+@contextlib.contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on path, shared with other processes"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class EmbeddingCache:
+    """Content-addressed cache of embedding vectors
+
+    Vectors are keyed by a hash of the model name and the text. Recently
+    used vectors stay in an in-memory LRU. The optional disk tier appends
+    vectors to a float32 file that is memory-mapped for reads, with an
+    index file mapping keys to rows, so lookups never deserialize vectors.
+    Processes sharing the directory (the service and the ingest CLI) append
+    under a file lock and pick up each other's entries on a miss.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    INDEX_FILE = "index.txt"
+    META_FILE = "meta.json"
+    LOCK_FILE = "lock"
+
+    def __init__(self, model_name: str, max_entries: int = 4096, directory: Optional[str] = None):
+        """Initialize the cache
+
+        Args:
+            model_name: Embedding model; vectors of other models are never returned
+            max_entries: Vectors kept in memory
+            directory: Directory of the disk tier (None = memory only)
+        """
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.directory = directory
+
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        # Disk tier: key -> row in the vectors file
+        self._rows: Dict[str, int] = {}
+        # Bytes of the index file already read into _rows
+        self._index_offset = 0
+        self._dimension: Optional[int] = None
+        self._mmap: Optional[np.memmap] = None
+        if directory:
+            try:
+                self._open_disk()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Embedding cache disk tier disabled: {str(e)}")
+                self.directory = None
+
+    def key(self, text: str) -> str:
+        """Cache key of a text"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open_disk(self):
+        """Load the index, discarding the files if they belong to another model"""
+        os.makedirs(self.directory, exist_ok=True)
+        with _file_lock(self._path(self.LOCK_FILE)):
+            meta = self._read_meta()
+            if meta.get("model") != self.model_name:
+                # Start over; rows of another model must not be mixed in
+                for name in (self.VECTORS_FILE, self.INDEX_FILE):
+                    if os.path.exists(self._path(name)):
+                        os.remove(self._path(name))
+                meta = {"model": self.model_name, "dimension": None}
+                self._write_meta(meta)
+            self._dimension = meta.get("dimension")
+            self._load_index()
+
+    def _read_meta(self) -> Dict[str, Any]:
+        if not os.path.exists(self._path(self.META_FILE)):
+            return {}
+        with open(self._path(self.META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        with open(self._path(self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def _load_index(self):
+        """Read index entries appended since the last read, by any process (caller holds the lock)
+
+        Needs no file lock: writers append the vectors before the index lines
+        that point at them, and a torn last line is read once it is complete.
+        """
+        path = self._path(self.INDEX_FILE)
+        if self._dimension is None:
+            # Another process may have written the first vectors
+            self._dimension = self._read_meta().get("dimension")
+        if not self._dimension or not os.path.exists(path) or os.path.getsize(path) <= self._index_offset:
+            return
+        available = self._disk_rows()
+        with open(path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        self._index_offset += len(complete)
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            parts = line.split()
+            # A row without vector data is ignored
+            if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < available:
+                self._rows[parts[0]] = int(parts[1])
+
+    def _disk_rows(self) -> int:
+        """Number of complete vectors in the vectors file"""
+        path = self._path(self.VECTORS_FILE)
+        if not self._dimension or not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // (4 * self._dimension)
+
+    def _read_row(self, row: int) -> np.ndarray:
+        """Vector at a row of the memory-mapped file (caller holds the lock)"""
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            # Remap to cover rows appended since the last mapping
+            self._mmap = np.memmap(
+                self._path(self.VECTORS_FILE),
+                dtype=np.float32,
+                mode="r",
+                shape=(self._disk_rows(), self._dimension)
+            )
+        return np.array(self._mmap[row])
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up the vectors of texts
+
+        Args:
+            texts: Texts to look up
+
+        Returns:
+            Vector per text, None for misses
+        """
+        keys = [self.key(text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = []
+        with self._lock:
+            if self.directory and any(key not in self._entries and key not in self._rows for key in keys):
+                try:
+                    self._load_index()
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not read embedding cache index: {str(e)}")
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                elif key in self._rows:
+                    vector = self._read_row(self._rows[key])
+                    self._store(key, vector)
+                    self._hits += 1
+                    self._disk_hits += 1
+                else:
+                    self._misses += 1
+                vectors.append(vector)
+        return vectors
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Store the vectors of texts
+
+        Args:
+            texts: Embedded texts
+            vectors: Array of shape (len(texts), dimension)
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            new_rows = []
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                self._store(key, vector)
+                if self.directory and key not in self._rows:
+                    new_rows.append((key, vector))
+            if new_rows:
+                try:
+                    self._append(new_rows)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not write embedding cache entries: {str(e)}")
+
+    def _append(self, new_rows: List[tuple]):
+        """Append vectors to the disk tier (caller holds the lock)
+
+        Row numbers are taken from the file size only while holding the file
+        lock, so processes appending at the same time never share rows.
+        """
+        with _file_lock(self._path(self.LOCK_FILE)):
+            self._load_index()
+            # Vectors another process stored meanwhile are not written twice
+            new_rows = [(key, vector) for key, vector in new_rows if key not in self._rows]
+            if not new_rows:
+                return
+
+            dimension = len(new_rows[0][1])
+            if self._dimension is None:
+                self._dimension = dimension
+                self._write_meta({"model": self.model_name, "dimension": dimension})
+            elif dimension != self._dimension:
+                raise ValueError(f"Vector dimension {dimension} does not match the cache ({self._dimension})")
+
+            first_row = self._disk_rows()
+            # Vectors are written before the index so the index never points past the data
+            with open(self._path(self.VECTORS_FILE), "ab") as f:
+                # Drop a partial row left by an interrupted write
+                f.truncate(first_row * 4 * dimension)
+                np.stack([vector for _, vector in new_rows]).astype(np.float32).tofile(f)
+            index_path = self._path(self.INDEX_FILE)
+            with open(index_path, "a", encoding="utf-8") as f:
+                if os.path.exists(index_path) and os.path.getsize(index_path) > self._index_offset:
+                    # Terminate a line torn by an interrupted write
+                    f.write("\n")
+                for offset, (key, _) in enumerate(new_rows):
+                    f.write(f"{key} {first_row + offset}\n")
+                    self._rows[key] = first_row + offset
+            self._index_offset = os.path.getsize(index_path)
+
+    def _store(self, key: str, vector: np.ndarray):
+        """Insert into the memory tier (caller holds the lock)"""
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and sizes"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "disk_entries": len(self._rows)
+            }
@@ -1,5 +1,10 @@
-from typing import List, Union
-from sentence_transformers import SentenceTransformer
+import copy
+import os
+from typing import List, Optional, Union
+
+import numpy as np
+
+from .embedding_cache import EmbeddingCache
 
 class CodeEmbeddings:
     """Text embeddings for code snippets"""
@@ -8,7 +13,11 @@ class CodeEmbeddings:
         self, 
         model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
         cache_dir: str = "C:/huggingface_cache",
-        device: str = "cpu"
+        device: str = "cpu",
+        embedding_cache_size: int = 4096,
+        embedding_cache_dir: Optional[str] = None,
+        backend: str = "torch",
+        onnx_dir: Optional[str] = None
     ):
         """Initialize the embedding model
         
@@ -16,19 +25,73 @@ class CodeEmbeddings:
             model_name: Name of the embedding model
             cache_dir: Directory for model cache
             device: Device to run on ('cpu' or 'cuda')
+            embedding_cache_size: Vectors kept in memory (0 disables the embedding cache)
+            embedding_cache_dir: Directory for cached vectors on disk
+                (None = keep them in memory only)
+            backend: "torch" for SentenceTransformer or "onnx" for the
+                ONNX Runtime export in onnx_dir (see ai.model.onnx_embeddings)
+            onnx_dir: Directory of the exported ONNX model, which must be an
+                export of model_name
         """
         self.model_name = model_name
         self.cache_dir = cache_dir
         self.device = device
+        self.backend = backend
+        
+        # Load the model; torch is only imported for the torch backend
+        if backend == "onnx":
+            from .onnx_embeddings import OnnxEncoder
+            self.model = OnnxEncoder(onnx_dir, model_name)
+        elif backend == "torch":
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(
+                model_name, 
+                cache_folder=cache_dir,
+                device=device
+            )
+        else:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        
+        self._token_counter: Optional[TokenCounter] = None
         
-        # Load the model
-        self.model = SentenceTransformer(
-            model_name, 
-            cache_folder=cache_dir,
-            device=device
-        )
+        # Identical texts are only embedded once
+        self.cache = None
+        if embedding_cache_size > 0:
+            # Backends produce slightly different vectors, so they do not share entries
+            cache_name = model_name if backend == "torch" else f"{model_name}@{backend}"
+            self.cache = EmbeddingCache(
+                cache_name,
+                max_entries=embedding_cache_size,
+                # One directory per model, named like the Hugging Face cache does
+                directory=os.path.join(embedding_cache_dir, cache_name.replace("/", "--"))
+                if embedding_cache_dir else None
+            )
         
-        print(f"Embedding model {model_name} loaded")
+        print(f"Embedding model {model_name} loaded ({backend} backend)")
+    
+    @property
+    def max_seq_length(self) -> int:
+        """Word pieces the model reads; longer texts are truncated"""
+        return self.model.max_seq_length
+    
+    def token_counter(self) -> "TokenCounter":
+        """Word-piece counter of the model's tokenizer, picklable for worker processes
+        
+        The counter tokenizes with its own copy of the tokenizer, whose
+        truncation settings encode changes while it runs.
+        """
+        if self._token_counter is None:
+            self._token_counter = TokenCounter(copy.deepcopy(self.model.tokenizer))
+        return self._token_counter
+    
+    def count_tokens(self, text: str) -> int:
+        """Word pieces of text, without the special tokens the model adds"""
+        return self.token_counter()(text)
+    
+    def fits(self, text: str) -> bool:
+        """Whether the model embeds text without truncating it"""
+        tokenizer = self.model.tokenizer
+        return self.count_tokens(text) + tokenizer.num_special_tokens_to_add() <= self.max_seq_length
     
     def embed_text(self, text: Union[str, List[str]]) -> List[List[float]]:
         """Generate embeddings for text
@@ -39,11 +102,73 @@ class CodeEmbeddings:
         Returns:
             List of embedding vectors
         """
+        return self.embed_array(text).tolist()
+    
+    def embed_array(
+        self,
+        text: Union[str, List[str]],
+        normalize: bool = False,
+        batch_size: int = 32,
+        sort_by_length: bool = True
+    ) -> np.ndarray:
+        """Generate embeddings for text as one float32 array
+        
+        Args:
+            text: Text or list of texts to embed
+            normalize: Scale every vector to unit length
+            batch_size: Texts per model call
+            sort_by_length: Batch texts of similar length together, which
+                keeps padding inside a batch small
+            
+        Returns:
+            Array of shape (number of texts, embedding dimension)
+        """
         # Ensure text is a list
         if isinstance(text, str):
             text = [text]
-            
-        # Generate embeddings
-        embeddings = self.model.encode(text)
         
-        return embeddings.tolist()
\ No newline at end of file
+        if self.cache is None:
+            vectors = self._encode(list(text), batch_size, sort_by_length)
+        else:
+            # Only texts missing from the cache go to the model, each once
+            cached = self.cache.get_many(text)
+            missing = list(dict.fromkeys(t for t, v in zip(text, cached) if v is None))
+            if missing:
+                encoded = self._encode(missing, batch_size, sort_by_length)
+                self.cache.put_many(missing, encoded)
+                by_text = dict(zip(missing, encoded))
+                cached = [v if v is not None else by_text[t] for t, v in zip(text, cached)]
+            vectors = np.stack(cached) if cached else self._encode([], batch_size, sort_by_length)
+        
+        return normalize_rows(vectors) if normalize else vectors
+    
+    def _encode(self, texts: List[str], batch_size: int, sort_by_length: bool) -> np.ndarray:
+        """Run the model over texts in batches, returning rows in input order"""
+        vectors = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i])) if sort_by_length else list(range(len(texts)))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            vectors[rows] = self.model.encode(
+                [texts[i] for i in rows],
+                batch_size=len(rows),
+                convert_to_numpy=True
+            )
+        return vectors
+
+
+class TokenCounter:
+    """Counts the word pieces of a text with an embedding model's tokenizer"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, text: str) -> int:
+        # verbose=False: texts longer than the model input are expected here
+        return len(self.tokenizer.encode(text, add_special_tokens=False, verbose=False))
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale the rows of an array to unit length (zero rows stay zero)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
@@ -1,13 +1,21 @@
 import os
 import gc
+import hashlib
 import logging
-from typing import Optional
+import pickle
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
 import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("llm-model")
 
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is aborted through its cancellation flag"""
+
+
 class QuantizedModel:
     """Lightweight wrapper for quantized LLM models using llama-cpp-python"""
     
@@ -18,7 +26,8 @@ class QuantizedModel:
         download_dir: str = "C:/models",
         temperature: float = 0.7,
         n_ctx: int = 2048,
-        n_threads: Optional[int] = None
+        n_threads: Optional[int] = None,
+        prompt_cache_dir: Optional[str] = None
     ):
         """Initialize a quantized LLM model
         
@@ -29,12 +38,19 @@ class QuantizedModel:
             temperature: Temperature for text generation
             n_ctx: Context size
             n_threads: Number of threads to use (None = auto)
+            prompt_cache_dir: Directory for evaluated prompt-prefix states
+                (None = keep them in memory only)
         """
         self.model_name = model_name
         self.model_file = model_file
         self.download_dir = download_dir
         self.temperature = temperature
+        self.n_ctx = n_ctx
         self.n_threads = n_threads if n_threads else min(8, (os.cpu_count() or 4))
+        self.prompt_cache_dir = prompt_cache_dir
+        
+        # Prefix text -> llama state right after evaluating that prefix
+        self._prefix_states: Dict[str, object] = {}
         
         # Create download directory if it doesn't exist
         os.makedirs(download_dir, exist_ok=True)
@@ -100,31 +116,216 @@ class QuantizedModel:
         
         logger.info(f"Model downloaded to {self.model_path}")
 
-    def generate(self, prompt: str, max_tokens: int = 1024) -> str:
-        """Generate text based on a prompt"""
-        # Clean up memory before generation
-        gc.collect()
+    def count_tokens(self, text: str) -> int:
+        """Number of model tokens in a text (without the BOS token)"""
+        return len(self.model.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _prefix_state_path(self, prefix: str) -> Optional[str]:
+        """Disk location of the saved state for a prompt prefix"""
+        if not self.prompt_cache_dir:
+            return None
+        # States are only valid for the exact model file and context size
+        try:
+            model_size = os.path.getsize(self.model_path)
+        except OSError:
+            model_size = 0
+        key = f"{os.path.basename(self.model_path)}:{model_size}:{self.n_ctx}:{prefix}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.prompt_cache_dir, f"{digest}.llstate")
+
+    def warm_prefix(self, prefix: str) -> bool:
+        """Evaluate a fixed prompt prefix once and keep its llama state
         
-        # Log the start time for perf monitoring
-        start_time = time.time()
-        logger.info(f"Generating text for prompt: {prompt[:50]}...")
+        Prompts starting with a warmed prefix only evaluate the remaining
+        tokens. States are loaded from / saved to prompt_cache_dir if set.
         
-        # Generate completion with optimized parameters for CPU
-        output = self.model.create_completion(
-            prompt=prompt,
+        Args:
+            prefix: Static leading text shared by many prompts
+            
+        Returns:
+            True if a state for the prefix is available
+        """
+        if not prefix or prefix in self._prefix_states:
+            return bool(prefix)
+        
+        path = self._prefix_state_path(prefix)
+        state = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    state = pickle.load(f)
+                logger.info(f"Loaded prompt prefix state from {path}")
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable prompt prefix state {path}: {str(e)}")
+        
+        if state is None:
+            tokens = self.model.tokenize(prefix.encode("utf-8"))
+            if len(tokens) >= self.n_ctx:
+                logger.warning(f"Prompt prefix of {len(tokens)} tokens does not fit the context, not cached")
+                return False
+            
+            start_time = time.time()
+            self.model.reset()
+            self.model.eval(tokens)
+            state = self.model.save_state()
+            logger.info(f"Evaluated {len(tokens)}-token prompt prefix in {time.time() - start_time:.2f} seconds")
+            
+            if path:
+                try:
+                    os.makedirs(self.prompt_cache_dir, exist_ok=True)
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp_path, path)
+                except Exception as e:
+                    logger.warning(f"Could not save prompt prefix state: {str(e)}")
+        
+        self._prefix_states[prefix] = state
+        return True
+
+    def _restore_prefix(self, prompt: str):
+        """Load the cached state of the longest warmed prefix of the prompt
+        
+        llama.cpp then reuses the matching tokens and only evaluates the rest.
+        """
+        matches = [p for p in self._prefix_states if prompt.startswith(p)]
+        if not matches:
+            return
+        state = self._prefix_states[max(matches, key=len)]
+        
+        # Skip the copy if the context already starts with this prefix,
+        # e.g. when the previous request used the same template
+        n_tokens = state.n_tokens
+        if (
+            self.model.n_tokens >= n_tokens
+            and self.model.input_ids[:n_tokens].tolist() == state.input_ids[:n_tokens].tolist()
+        ):
+            return
+        self.model.load_state(state)
+
+    def _completion_params(self, max_tokens: int, stop: Optional[List[str]] = None) -> dict:
+        """Sampling parameters shared by blocking and streaming generation"""
+        return dict(
             max_tokens=max_tokens,
             temperature=self.temperature,
             top_p=0.9,
             repeat_penalty=1.2,
             top_k=40,
-            stop=["</s>", "<s>", "[INST]", "<<SYS>>"]
+            stop=["</s>", "<s>", "[INST]", "<<SYS>>"] + (stop or [])
         )
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        stop: Optional[List[str]] = None
+    ) -> Iterator[str]:
+        """Stream generated text fragments as the model produces them
+
+        Args:
+            prompt: Prompt to complete
+            max_tokens: Maximum number of tokens to generate
+            stop: Additional stop strings
+
+        Yields:
+            Text fragments in generation order (not stripped)
+        """
+        for chunk in self.model.create_completion(
+            prompt=prompt,
+            stream=True,
+            **self._completion_params(max_tokens, stop)
+        ):
+            fragment = chunk["choices"][0]["text"]
+            if fragment:
+                yield fragment
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        on_token: Optional[Callable[[str], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        stop: Optional[List[str]] = None,
+        strip: bool = True,
+        stop_condition: Optional[Callable[[str], Optional[int]]] = None
+    ) -> str:
+        """Generate text based on a prompt
+
+        Args:
+            prompt: Prompt to complete
+            max_tokens: Maximum number of tokens to generate
+            on_token: Optional callback receiving each text fragment as soon as
+                it is generated. When given, the completion is streamed.
+            cancel_event: Optional flag checked between tokens; once set, the
+                generation stops and GenerationCancelled is raised
+            stop: Additional stop strings
+            strip: Strip surrounding whitespace from the result (disable for
+                infilling, where it is significant)
+            stop_condition: Optional callable checked after every token with the
+                text generated so far; returning a length stops generation and
+                keeps only that much text (see ai.chains.stop_conditions)
+
+        Returns:
+            The full generated text
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled("Generation cancelled before start")
+        
+        # Clean up memory before generation
+        gc.collect()
+        
+        # Log the start time for perf monitoring
+        start_time = time.time()
+        logger.info(f"Generating text for prompt: {prompt[:50]}...")
+        
+        # Start from the evaluated static prefix when one is cached
+        self._restore_prefix(prompt)
+        
+        if on_token is None and cancel_event is None and stop_condition is None:
+            # Generate completion with optimized parameters for CPU
+            output = self.model.create_completion(
+                prompt=prompt,
+                **self._completion_params(max_tokens, stop)
+            )
+            
+            # Extract the generated text
+            generated_text = output["choices"][0]["text"]
+        else:
+            # Stream token by token so callbacks, cancellation and stop rules run in between
+            generated_text = ""
+            n_tokens = 0
+            stream = self.stream(prompt, max_tokens=max_tokens, stop=stop)
+            try:
+                for fragment in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.info(f"Generation cancelled after {n_tokens} tokens")
+                        raise GenerationCancelled("Generation cancelled")
+                    if n_tokens == 0:
+                        logger.info(f"First token after {time.time() - start_time:.2f} seconds")
+                    n_tokens += 1
+                    
+                    previous_length = len(generated_text)
+                    generated_text += fragment
+                    cut = stop_condition(generated_text) if stop_condition is not None else None
+                    if cut is not None:
+                        generated_text = generated_text[:max(cut, 0)]
+                        fragment = generated_text[previous_length:]
+                    
+                    if on_token is not None and fragment:
+                        on_token(fragment)
+                    if cut is not None:
+                        reason = getattr(stop_condition, "reason", None) or "stop condition"
+                        logger.info(f"Stopped early by {reason} after {n_tokens} tokens")
+                        break
+            finally:
+                # Closing the stream stops llama.cpp from evaluating further tokens
+                stream.close()
         
-        # Extract the generated text
-        generated_text = output["choices"][0]["text"].strip()
+        if strip:
+            generated_text = generated_text.strip()
         
         # Log generation time
         end_time = time.time()
         logger.info(f"Generated {len(generated_text)} chars in {end_time - start_time:.2f} seconds")
         
-        return generated_text
\ No newline at end of file
+        return generated_text
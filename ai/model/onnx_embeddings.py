@@ -0,0 +1,352 @@
+"""
+ONNX Runtime backend for the code embedding model
+
+Export the configured EMBEDDING_MODEL once, check it against PyTorch and
+compare the two backends:
+
+    python -m ai.model.onnx_embeddings export
+    python -m ai.model.onnx_embeddings parity
+    python -m ai.model.onnx_embeddings benchmark
+
+Then run the service with EMBEDDING_BACKEND=onnx.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+CONFIG_FILE = "embedding_config.json"
+
+# Code-like sample texts for parity checks and benchmarks
+SAMPLE_TEXTS = [
+    "def add(a, b):\n    return a + b",
+    "for (let i = 0; i < items.length; i++) { total += items[i].price; }",
+    "class UserRepository:\n    def find_by_email(self, email):\n        return self.session.query(User).filter_by(email=email).first()",
+    "SELECT id, name FROM users WHERE created_at > NOW() - INTERVAL '7 days' ORDER BY name;",
+    "public static int fibonacci(int n) { return n < 2 ? n : fibonacci(n - 1) + fibonacci(n - 2); }",
+    "async function fetchJson(url) {\n  const response = await fetch(url);\n  return response.json();\n}",
+    "import numpy as np\nmatrix = np.random.rand(100, 100)\ninverse = np.linalg.inv(matrix)",
+    "# TODO: handle timeouts when the upstream service is slow",
+]
+
+
+class OnnxEncoder:
+    """Sentence encoder running an exported transformer with ONNX Runtime
+
+    Mirrors the part of the SentenceTransformer API that CodeEmbeddings uses
+    (encode, get_sentence_embedding_dimension, tokenizer and max_seq_length),
+    including its pooling and normalization, without importing torch.
+    """
+
+    def __init__(self, model_dir: str, model_name: Optional[str] = None, num_threads: Optional[int] = None):
+        """Load an exported model
+
+        Args:
+            model_dir: Directory written by export_onnx
+            model_name: Model the export must have been made from (None = any)
+            num_threads: Intra-op threads of ONNX Runtime (None = runtime default)
+
+        Raises:
+            FileNotFoundError: If model_dir holds no export
+            ValueError: If the export was made from another model than model_name
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        config_path = os.path.join(model_dir, CONFIG_FILE)
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(
+                f"No exported embedding model in {model_dir}; "
+                "run `python -m ai.model.onnx_embeddings export` first"
+            )
+        with open(config_path, encoding="utf-8") as f:
+            self.config = json.load(f)
+        if model_name is not None and self.config.get("model_name") != model_name:
+            # Vectors of another model would not match the ones already indexed
+            raise ValueError(
+                f"{model_dir} holds an export of {self.config.get('model_name')}, not {model_name}; "
+                "export the configured model with `python -m ai.model.onnx_embeddings export`"
+            )
+
+        self.model_dir = model_dir
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, self.config["model_file"]),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.config["max_seq_length"]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def encode(self, sentences: List[str], batch_size: int = 32, convert_to_numpy: bool = True) -> np.ndarray:
+        """Embed sentences
+
+        Args:
+            sentences: Texts to embed
+            batch_size: Texts per inference call
+            convert_to_numpy: Accepted for SentenceTransformer compatibility;
+                the result is always an array
+
+        Returns:
+            float32 array of shape (len(sentences), dimension)
+        """
+        vectors = np.empty((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            tokens = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            feed = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+            hidden = self.session.run(None, feed)[0]
+            vectors[start:start + len(batch)] = self._pool(hidden, tokens["attention_mask"])
+        return vectors
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Token vectors to sentence vectors, as the SentenceTransformer pipeline does"""
+        mask = attention_mask[:, :, np.newaxis].astype(np.float32)
+        pooling = self.config["pooling"]
+        if pooling == "cls":
+            pooled = hidden[:, 0]
+        elif pooling == "max":
+            pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        else:
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+
+def export_onnx(
+    model_name: str,
+    output_dir: str,
+    cache_dir: Optional[str] = None,
+    quantize: bool = True,
+    opset: int = 14
+) -> str:
+    """Export a SentenceTransformer model to ONNX, quantized to int8 by default
+
+    Args:
+        model_name: SentenceTransformer model name
+        output_dir: Directory for the model, tokenizer and embedding config
+        cache_dir: Hugging Face cache directory
+        quantize: Apply dynamic int8 quantization to the weights
+        opset: ONNX opset version
+
+    Returns:
+        Path of the model file used by OnnxEncoder
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, cache_folder=cache_dir, device="cpu")
+    transformer = st_model[0]
+    hf_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    pooling = next((m for m in st_model if isinstance(m, Pooling)), None)
+    pooling_mode = pooling.get_pooling_mode_str() if pooling is not None else "mean"
+    normalize = any(isinstance(m, Normalize) for m in st_model)
+
+    sample = tokenizer(SAMPLE_TEXTS[:2], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    print(f"Exporting {model_name} to {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+
+    model_file = "model.onnx"
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        model_file = "model_int8.onnx"
+        print(f"Quantizing weights to int8: {model_file}")
+        quantize_dynamic(fp32_path, os.path.join(output_dir, model_file), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "model_file": model_file,
+            "pooling": pooling_mode,
+            "normalize": normalize,
+            "max_seq_length": st_model.max_seq_length,
+            "dimension": st_model.get_sentence_embedding_dimension()
+        }, f, indent=2)
+
+    print(f"Exported embedding model to {output_dir}")
+    return os.path.join(output_dir, model_file)
+
+
+def check_parity(
+    model_name: str,
+    model_dir: str,
+    cache_dir: Optional[str] = None,
+    texts: Optional[List[str]] = None,
+    min_cosine: float = 0.99
+) -> Dict[str, Any]:
+    """Compare ONNX embeddings with the PyTorch SentenceTransformer output
+
+    Args:
+        model_name: SentenceTransformer model name
+        model_dir: Directory written by export_onnx
+        cache_dir: Hugging Face cache directory
+        texts: Texts to compare (default: built-in code samples)
+        min_cosine: Lowest acceptable cosine similarity per text
+
+    Returns:
+        Dict with min/mean cosine similarity, max absolute difference and passed
+    """
+    from sentence_transformers import SentenceTransformer
+
+    texts = texts or SAMPLE_TEXTS
+    reference = SentenceTransformer(model_name, cache_folder=cache_dir, device="cpu").encode(
+        texts, convert_to_numpy=True
+    ).astype(np.float32)
+    candidate = OnnxEncoder(model_dir, model_name).encode(texts)
+
+    def unit(vectors: np.ndarray) -> np.ndarray:
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    cosines = (unit(reference) * unit(candidate)).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+        "passed": bool(cosines.min() >= min_cosine)
+    }
+
+
+def _resident_memory_mb() -> Optional[float]:
+    """Resident memory of this process in MB, if it can be measured"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        import resource
+        # Peak resident size; kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return None
+
+
+def _benchmark_backend(backend: str, model_name: str, model_dir: str, cache_dir: Optional[str],
+                       texts: List[str], batch_size: int, results):
+    """Measure one backend (runs in its own process so memory is not shared)"""
+    try:
+        start = time.perf_counter()
+        if backend == "onnx":
+            encoder = OnnxEncoder(model_dir, model_name)
+        else:
+            from sentence_transformers import SentenceTransformer
+            encoder = SentenceTransformer(model_name, cache_folder=cache_dir, device="cpu")
+        load_seconds = time.perf_counter() - start
+
+        # Warm-up run so one-time initialization is not measured
+        encoder.encode(texts[:batch_size], batch_size=batch_size)
+        start = time.perf_counter()
+        encoder.encode(texts, batch_size=batch_size)
+        seconds = time.perf_counter() - start
+
+        results.put({
+            "backend": backend,
+            "load_seconds": round(load_seconds, 3),
+            "texts_per_second": round(len(texts) / seconds, 1),
+            "memory_mb": _resident_memory_mb()
+        })
+    except Exception as e:
+        results.put({"backend": backend, "error": str(e)})
+
+
+def benchmark(
+    model_name: str,
+    model_dir: str,
+    cache_dir: Optional[str] = None,
+    num_texts: int = 512,
+    batch_size: int = 32
+) -> List[Dict[str, Any]]:
+    """Compare encode throughput and memory of the PyTorch and ONNX backends
+
+    Args:
+        model_name: SentenceTransformer model name
+        model_dir: Directory written by export_onnx
+        cache_dir: Hugging Face cache directory
+        num_texts: Texts encoded per backend
+        batch_size: Texts per inference call
+
+    Returns:
+        One result dict per backend
+    """
+    texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] + f"  # {i}" for i in range(num_texts)]
+    context = mp.get_context("spawn")
+    results = []
+    for backend in ("torch", "onnx"):
+        queue = context.Queue()
+        process = context.Process(
+            target=_benchmark_backend,
+            args=(backend, model_name, model_dir, cache_dir, texts, batch_size, queue)
+        )
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+if __name__ == "__main__":
+    from ai.config import CACHE_DIR, EMBEDDING_MODEL, EMBEDDING_ONNX_DIR
+
+    parser = argparse.ArgumentParser(description="ONNX embedding backend tools")
+    parser.add_argument("command", choices=["export", "parity", "benchmark"])
+    parser.add_argument("--model-name", default=EMBEDDING_MODEL, help="Embedding model name")
+    parser.add_argument("--output-dir", default=str(EMBEDDING_ONNX_DIR), help="Directory of the exported model")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Model cache directory")
+    parser.add_argument("--no-quantize", action="store_true", help="Export full-precision weights")
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="Lowest cosine similarity to the PyTorch output accepted by the parity check")
+    parser.add_argument("--num-texts", type=int, default=512, help="Texts encoded per backend in the benchmark")
+    parser.add_argument("--batch-size", type=int, default=32, help="Texts per inference call in the benchmark")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model_name, args.output_dir, args.cache_dir, quantize=not args.no_quantize)
+        args.command = "parity"
+
+    if args.command == "parity":
+        report = check_parity(args.model_name, args.output_dir, args.cache_dir, min_cosine=args.min_cosine)
+        print(json.dumps(report, indent=2))
+        if not report["passed"]:
+            raise SystemExit(f"Parity check failed: min cosine {report['min_cosine']:.4f} < {args.min_cosine}")
+    elif args.command == "benchmark":
+        for result in benchmark(args.model_name, args.output_dir, args.cache_dir, args.num_texts, args.batch_size):
+            print(json.dumps(result))
@@ -0,0 +1,524 @@
+import os
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from .llm_model import GenerationCancelled
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("model-pool")
+
+
+class WorkerPoolBusy(RuntimeError):
+    """Raised when the scheduler queue is full"""
+
+
+# Seconds between progress reports of a worker generating without streaming
+_HEARTBEAT_INTERVAL = 1.0
+
+
+def _worker_main(
+    worker_id: int,
+    model_kwargs: Dict[str, Any],
+    prefixes: List[str],
+    tasks,
+    results,
+    cancel_slot
+):
+    """Entry point of a model worker process
+
+    Loads its own QuantizedModel and runs jobs from its task queue one at a
+    time, reporting tokens and outcomes on the shared results queue.
+    """
+    from .llm_model import QuantizedModel
+
+    try:
+        model = QuantizedModel(**model_kwargs)
+        for prefix in prefixes:
+            model.warm_prefix(prefix)
+    except Exception as e:
+        results.put(("failed", worker_id, str(e)))
+        return
+    results.put(("ready", worker_id))
+
+    class _CancelFlag:
+        """Cancellation flag for one job, set by the parent through cancel_slot"""
+
+        def __init__(self, job_id: int):
+            self.job_id = job_id
+
+        def is_set(self) -> bool:
+            return cancel_slot.value == self.job_id
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        if task[0] == "warm":
+            model.warm_prefix(task[1])
+            continue
+
+        job_id, prompt, max_tokens, stream, options = task
+        results.put(("started", worker_id, job_id))
+        if stream:
+            on_token = lambda fragment: results.put(("token", worker_id, job_id, fragment))
+        else:
+            on_token = _Heartbeat(results, worker_id, job_id)
+
+        try:
+            text = model.generate(
+                prompt,
+                max_tokens=max_tokens,
+                on_token=on_token,
+                cancel_event=_CancelFlag(job_id),
+                **options
+            )
+            results.put(("done", worker_id, job_id, text))
+        except GenerationCancelled:
+            results.put(("cancelled", worker_id, job_id))
+        except Exception as e:
+            results.put(("error", worker_id, job_id, str(e)))
+
+
+class _Heartbeat:
+    """Token callback reporting progress of a job at most once per interval"""
+
+    def __init__(self, results, worker_id: int, job_id: int):
+        self.results = results
+        self.worker_id = worker_id
+        self.job_id = job_id
+        self.last = time.time()
+
+    def __call__(self, fragment: str):
+        now = time.time()
+        if now - self.last >= _HEARTBEAT_INTERVAL:
+            self.last = now
+            self.results.put(("alive", self.worker_id, self.job_id))
+
+
+class _Job:
+    """A generation request waiting in, or dispatched by, the scheduler"""
+
+    def __init__(
+        self,
+        job_id: int,
+        prompt: str,
+        max_tokens: int,
+        stream: bool,
+        options: Dict[str, Any]
+    ):
+        self.job_id = job_id
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.stream = stream
+        # Extra keyword arguments for QuantizedModel.generate (stop, strip, stop_condition)
+        self.options = options
+        self.worker_id: Optional[int] = None
+        self.cancelled = False
+        self.enqueued_at = time.time()
+        # Events from the worker: ("token", text), ("done", text), ("cancelled",), ("error", message)
+        self.events: "queue.Queue[tuple]" = queue.Queue()
+
+
+class _Worker:
+    """Parent-side handle and health record of a model process"""
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process = None
+        self.tasks = None
+        self.cancel_slot = None
+        self.ready = False
+        self.healthy = False
+        self.active: Dict[int, _Job] = {}
+        self.served = 0
+        self.failures = 0
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self.last_seen = 0.0
+
+    @property
+    def load(self) -> int:
+        return len(self.active)
+
+
+class ModelWorkerPool:
+    """Pool of model processes with a scheduler in front
+
+    Every worker process owns a separate llama.cpp model with its share of
+    the CPU threads. Requests wait in a bounded queue and are dispatched to
+    the least-loaded healthy worker. The pool exposes the same generate()
+    signature as QuantizedModel, so it can be used as a drop-in model.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        model_kwargs: Optional[Dict[str, Any]] = None,
+        total_threads: Optional[int] = None,
+        max_queue_size: int = 32,
+        max_jobs_per_worker: int = 1,
+        health_check_interval: float = 5.0,
+        max_failures: int = 3,
+        progress_timeout: float = 120.0
+    ):
+        """Initialize the worker pool
+
+        Args:
+            num_workers: Number of model processes to start
+            model_kwargs: Keyword arguments for each worker's QuantizedModel
+            total_threads: CPU threads shared out between workers (None = all cores)
+            max_queue_size: Maximum number of requests waiting for a worker
+            max_jobs_per_worker: Jobs a worker may hold at once (running + queued)
+            health_check_interval: Seconds between worker liveness checks
+            max_failures: Consecutive failures before a worker is restarted
+            progress_timeout: Seconds a worker with an active job may go without
+                reporting progress before it is considered hung and restarted
+                (0 disables the check)
+        """
+        self.num_workers = max(1, num_workers)
+        self.model_kwargs = dict(model_kwargs or {})
+        self.total_threads = total_threads or os.cpu_count() or 4
+        self.threads_per_worker = max(1, self.total_threads // self.num_workers)
+        self.model_kwargs["n_threads"] = self.threads_per_worker
+        self.max_queue_size = max_queue_size
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+        self.progress_timeout = progress_timeout
+
+        # Attributes used by callers that inspect the model
+        self.model_file = self.model_kwargs.get("model_file")
+        self.temperature = self.model_kwargs.get("temperature", 0.7)
+        self.n_ctx = self.model_kwargs.get("n_ctx", 2048)
+        self._tokenizer = None
+
+        # llama.cpp threads do not survive fork, so always spawn
+        self._ctx = multiprocessing.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._workers: List[_Worker] = [_Worker(i) for i in range(self.num_workers)]
+        self._pending: Deque[_Job] = deque()
+        self._jobs: Dict[int, _Job] = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Condition()
+        self._running = False
+        self._threads: List[threading.Thread] = []
+        self._finished = 0
+        self._rejected = 0
+        # Prompt prefixes every worker keeps evaluated, replayed on restarts
+        self._prefixes: List[str] = []
+
+    def start(self, wait: bool = True, timeout: float = 600.0):
+        """Start the worker processes and the scheduler threads
+
+        Args:
+            wait: Block until every worker has loaded its model (or failed)
+            timeout: Maximum seconds to wait for the workers
+        """
+        # Vocabulary-only model so prompts can be measured without a worker round trip
+        from llama_cpp import Llama
+        model_path = os.path.join(self.model_kwargs.get("download_dir", ""), self.model_file)
+        self._tokenizer = Llama(model_path=model_path, vocab_only=True, verbose=False)
+
+        self._running = True
+        for worker in self._workers:
+            self._spawn(worker)
+
+        for target, name in ((self._dispatch_loop, "pool-dispatch"), (self._collect_loop, "pool-collect")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info(
+            f"Started {self.num_workers} model workers with {self.threads_per_worker} threads each"
+        )
+
+        if wait:
+            deadline = time.time() + timeout
+            with self._lock:
+                while time.time() < deadline and not all(
+                    w.ready or w.last_error for w in self._workers
+                ):
+                    self._lock.wait(timeout=1.0)
+                if not any(w.healthy for w in self._workers):
+                    raise RuntimeError("No model worker could be started")
+
+    def _spawn(self, worker: _Worker):
+        """Start (or restart) the process of a worker"""
+        worker.tasks = self._ctx.Queue()
+        worker.cancel_slot = self._ctx.Value("q", 0)
+        worker.ready = False
+        worker.healthy = False
+        worker.failures = 0
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker.worker_id, self.model_kwargs, list(self._prefixes),
+                worker.tasks, self._results, worker.cancel_slot
+            ),
+            name=f"model-worker-{worker.worker_id}",
+            daemon=True
+        )
+        worker.process.start()
+        worker.last_seen = time.time()
+
+    def _pick_worker(self) -> Optional[_Worker]:
+        """Least-loaded healthy worker with spare capacity (caller holds the lock)"""
+        candidates = [
+            w for w in self._workers
+            if w.healthy and w.load < self.max_jobs_per_worker
+        ]
+        if not candidates:
+            return None
+        # Ties go to the worker that has served the fewest requests
+        return min(candidates, key=lambda w: (w.load, w.served))
+
+    def _dispatch_loop(self):
+        """Move queued jobs to workers as capacity frees up"""
+        with self._lock:
+            while self._running:
+                worker = self._pick_worker() if self._pending else None
+                if worker is None:
+                    self._lock.wait(timeout=1.0)
+                    continue
+
+                job = self._pending.popleft()
+                if not worker.active:
+                    # An idle worker's silence does not count against the job
+                    worker.last_seen = time.time()
+                job.worker_id = worker.worker_id
+                worker.active[job.job_id] = job
+                worker.tasks.put((job.job_id, job.prompt, job.max_tokens, job.stream, job.options))
+
+    def _collect_loop(self):
+        """Route worker messages to their jobs and watch worker health"""
+        last_check = time.time()
+        while self._running:
+            try:
+                message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                if message is not None:
+                    self._handle_message(message)
+                if time.time() - last_check >= self.health_check_interval:
+                    last_check = time.time()
+                    self._check_health()
+
+    def _handle_message(self, message: tuple):
+        """Apply one worker message (caller holds the lock)"""
+        kind, worker_id = message[0], message[1]
+        worker = self._workers[worker_id]
+        worker.last_seen = time.time()
+
+        if kind == "ready":
+            worker.ready = worker.healthy = True
+            worker.last_error = None
+            logger.info(f"Model worker {worker_id} ready")
+            self._lock.notify_all()
+            return
+        if kind == "failed":
+            worker.last_error = message[2]
+            logger.error(f"Model worker {worker_id} failed to load: {message[2]}")
+            self._lock.notify_all()
+            return
+
+        job = worker.active.get(message[2])
+        if job is None:
+            return
+        if kind == "token":
+            job.events.put(("token", message[3]))
+            return
+        if kind in ("started", "alive"):
+            return
+
+        del worker.active[job.job_id]
+        worker.served += 1
+        if kind == "done":
+            worker.failures = 0
+            self._finish(job, ("done", message[3]))
+        elif kind == "cancelled":
+            self._finish(job, ("cancelled",))
+        else:
+            worker.failures += 1
+            worker.last_error = message[3]
+            self._finish(job, ("error", message[3]))
+            if worker.failures >= self.max_failures:
+                logger.warning(f"Model worker {worker_id} failed {worker.failures} times in a row, restarting")
+                self._restart(worker)
+        self._lock.notify_all()
+
+    def _check_health(self):
+        """Restart workers whose process died or hangs (caller holds the lock)"""
+        now = time.time()
+        for worker in self._workers:
+            if not worker.ready and worker.last_error:
+                # The model could not be loaded; restarting would fail the same way
+                continue
+            if worker.process is not None and not worker.process.is_alive():
+                worker.last_error = f"Process exited with code {worker.process.exitcode}"
+                logger.error(f"Model worker {worker.worker_id} died: {worker.last_error}")
+                self._restart(worker)
+            elif worker.active and self.progress_timeout and now - worker.last_seen > self.progress_timeout:
+                worker.last_error = f"No progress for {now - worker.last_seen:.0f}s"
+                logger.error(f"Model worker {worker.worker_id} hangs: {worker.last_error}")
+                self._restart(worker)
+
+    def _restart(self, worker: _Worker):
+        """Fail the jobs of a worker and replace its process (caller holds the lock)"""
+        for job in list(worker.active.values()):
+            self._finish(job, ("error", f"Model worker {worker.worker_id} stopped: {worker.last_error}"))
+        worker.active.clear()
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+        worker.restarts += 1
+        if self._running:
+            self._spawn(worker)
+
+    def _finish(self, job: _Job, outcome: tuple):
+        """Deliver the final outcome of a job (caller holds the lock)"""
+        self._jobs.pop(job.job_id, None)
+        self._finished += 1
+        job.events.put(outcome)
+
+    def _submit(self, prompt: str, max_tokens: int, stream: bool, options: Dict[str, Any]) -> _Job:
+        """Queue a job, rejecting it when the scheduler queue is full"""
+        with self._lock:
+            if not self._running:
+                raise RuntimeError("Worker pool is not running")
+            if len(self._pending) >= self.max_queue_size:
+                self._rejected += 1
+                raise WorkerPoolBusy(f"All {self.num_workers} model workers are busy, try again later")
+            job = _Job(next(self._job_ids), prompt, max_tokens, stream, options)
+            self._jobs[job.job_id] = job
+            self._pending.append(job)
+            self._lock.notify_all()
+            return job
+
+    def _cancel(self, job: _Job):
+        """Stop a queued or running job"""
+        with self._lock:
+            job.cancelled = True
+            if job.worker_id is None:
+                if job in self._pending:
+                    self._pending.remove(job)
+                    self._finish(job, ("cancelled",))
+            else:
+                # The worker checks its slot between tokens
+                self._workers[job.worker_id].cancel_slot.value = job.job_id
+
+    def count_tokens(self, text: str) -> int:
+        """Number of model tokens in a text (without the BOS token)"""
+        return len(self._tokenizer.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def warm_prefix(self, prefix: str) -> bool:
+        """Have every worker precompute the state of a prompt prefix
+
+        Mirrors QuantizedModel.warm_prefix. Workers process the request
+        before their next job; restarted workers warm it while loading.
+        """
+        with self._lock:
+            if not prefix or prefix in self._prefixes:
+                return bool(prefix)
+            self._prefixes.append(prefix)
+            for worker in self._workers:
+                if worker.tasks is not None:
+                    worker.tasks.put(("warm", prefix))
+        return True
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        on_token: Optional[Callable[[str], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        stop: Optional[List[str]] = None,
+        strip: bool = True,
+        stop_condition: Optional[Callable[[str], Optional[int]]] = None
+    ) -> str:
+        """Generate text on the least-loaded worker
+
+        Blocks the calling thread until the job finishes. Arguments mirror
+        QuantizedModel.generate; stop_condition is evaluated in the worker
+        process and must be picklable (e.g. a StopEngine).
+
+        Raises:
+            WorkerPoolBusy: If the scheduler queue is full
+            GenerationCancelled: If cancel_event is set before the job finishes
+        """
+        job = self._submit(
+            prompt,
+            max_tokens,
+            stream=on_token is not None,
+            options={"stop": stop, "strip": strip, "stop_condition": stop_condition}
+        )
+
+        while True:
+            if cancel_event is not None and cancel_event.is_set() and not job.cancelled:
+                self._cancel(job)
+            try:
+                event = job.events.get(timeout=0.05)
+            except queue.Empty:
+                continue
+
+            kind = event[0]
+            if kind == "token":
+                on_token(event[1])
+            elif kind == "done":
+                return event[1]
+            elif kind == "cancelled":
+                raise GenerationCancelled("Generation cancelled")
+            else:
+                raise RuntimeError(event[1])
+
+    def stats(self) -> Dict[str, Any]:
+        """Scheduler and per-worker health statistics"""
+        with self._lock:
+            return {
+                "workers": [
+                    {
+                        "id": w.worker_id,
+                        "healthy": w.healthy,
+                        "alive": bool(w.process and w.process.is_alive()),
+                        "load": w.load,
+                        "served": w.served,
+                        "failures": w.failures,
+                        "restarts": w.restarts,
+                        "last_error": w.last_error
+                    }
+                    for w in self._workers
+                ],
+                "queued": len(self._pending),
+                "max_queue_size": self.max_queue_size,
+                "finished": self._finished,
+                "rejected": self._rejected,
+                "threads_per_worker": self.threads_per_worker
+            }
+
+    def shutdown(self, timeout: float = 5.0):
+        """Stop the scheduler and the worker processes"""
+        with self._lock:
+            self._running = False
+            for job in list(self._pending):
+                self._finish(job, ("error", "Worker pool shut down"))
+            self._pending.clear()
+            self._lock.notify_all()
+
+        for worker in self._workers:
+            if worker.tasks is not None:
+                worker.tasks.put(None)
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        logger.info("Model worker pool stopped")
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from ..model.llm_model import GenerationCancelled
+from .inference_executor import InferenceExecutor
+
+logger = logging.getLogger("request-coalescing")
+
+
+class CancelSignal(threading.Event):
+    """Cancellation flag of one request that can also notify waiters
+
+    The model polls it between tokens like a plain threading.Event; callbacks
+    let a coalesced request stop waiting on a generation it shares.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Call callback once the flag is set (immediately if already set)"""
+        if self.is_set():
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[], None]):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def set(self):
+        super().set()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class SharedGeneration:
+    """A generation in flight and the requests waiting for it"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.future: Optional[asyncio.Future] = None
+        # Set once every subscriber has gone away
+        self.cancel_event = threading.Event()
+        self.subscribers = 0
+        # Partial-frame queues of streaming subscribers
+        self.streams: List[asyncio.Queue] = []
+        # Text streamed so far, replayed to subscribers that join late
+        self.text = ""
+
+    def publish(self, delta: str):
+        """Forward a streamed increment to every streaming subscriber"""
+        self.text += delta
+        for stream in self.streams:
+            stream.put_nowait(delta)
+
+
+class RequestCoalescer:
+    """Runs identical concurrent requests as a single generation
+
+    Requests with the same key share one in-flight generation and all
+    receive its result. The generation is cancelled only when every
+    request waiting for it has been cancelled.
+    """
+
+    def __init__(self, executor: Optional[InferenceExecutor] = None):
+        """Initialize the coalescer
+
+        Args:
+            executor: Executor running the generations (None = the loop's
+                default thread pool, without admission control)
+        """
+        self.executor = executor
+        # Request key -> generation in flight
+        self._inflight: Dict[str, SharedGeneration] = {}
+        self.generations = 0
+        self.coalesced = 0
+
+    async def run(
+        self,
+        key: str,
+        generate: Callable[[Optional[Callable[[str], None]], threading.Event], str],
+        cancel_event: Optional[CancelSignal] = None,
+        partials: Optional[asyncio.Queue] = None,
+        priority: int = 1,
+        queue_timeout: Optional[float] = None
+    ) -> str:
+        """Wait for the generation of a request, starting it if none is in flight
+
+        Args:
+            key: Key identifying identical requests
+            generate: Blocking function called in the executor with
+                (on_partial or None, cancel_event) that returns the suggestion
+            cancel_event: Cancellation flag of this request
+            partials: Queue receiving streamed increments for this request
+            priority: Queue priority of a new generation, lower runs first
+            queue_timeout: Seconds a new generation may wait for the executor
+                (None = its default)
+
+        Returns:
+            Generated suggestion
+
+        Raises:
+            GenerationCancelled: If this request is cancelled before the result
+            InferenceBusy: If the executor does not admit the generation, or
+                it waits past its queue timeout
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled("Request cancelled")
+
+        loop = asyncio.get_running_loop()
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = self._start(loop, key, generate, partials is not None, priority, queue_timeout)
+        else:
+            self.coalesced += 1
+            logger.info(f"Joined in-flight generation ({shared.subscribers} other request(s) waiting)")
+
+        shared.subscribers += 1
+        if partials is not None:
+            if shared.text:
+                partials.put_nowait(shared.text)
+            shared.streams.append(partials)
+
+        cancelled = loop.create_future()
+        on_cancel = lambda: loop.call_soon_threadsafe(
+            lambda: cancelled.done() or cancelled.set_result(None)
+        )
+        if cancel_event is not None:
+            cancel_event.add_callback(on_cancel)
+
+        try:
+            await asyncio.wait({shared.future, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+            if shared.future.done():
+                return shared.future.result()
+            raise GenerationCancelled("Request cancelled")
+        finally:
+            if cancel_event is not None:
+                cancel_event.remove_callback(on_cancel)
+            cancelled.cancel()
+            if partials is not None:
+                shared.streams.remove(partials)
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.future.done():
+                # Nobody wants the result any more; new requests start afresh
+                shared.cancel_event.set()
+                self._forget(shared)
+
+    def _start(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        key: str,
+        generate: Callable[..., str],
+        stream: bool,
+        priority: int,
+        queue_timeout: Optional[float]
+    ) -> SharedGeneration:
+        shared = SharedGeneration(key)
+        on_partial = None
+        if stream:
+            on_partial = lambda delta: loop.call_soon_threadsafe(shared.publish, delta)
+        if self.executor is not None:
+            shared.future = self.executor.submit(
+                generate, on_partial, shared.cancel_event,
+                priority=priority, timeout=queue_timeout, cancel_event=shared.cancel_event
+            )
+        else:
+            shared.future = loop.run_in_executor(None, generate, on_partial, shared.cancel_event)
+        self._inflight[key] = shared
+        self.generations += 1
+
+        def _finished(future: asyncio.Future):
+            self._forget(shared)
+            # Retrieve the outcome even when every subscriber has left
+            if not future.cancelled():
+                future.exception()
+
+        shared.future.add_done_callback(_finished)
+        return shared
+
+    def _forget(self, shared: SharedGeneration):
+        if self._inflight.get(shared.key) is shared:
+            del self._inflight[shared.key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Generation and coalescing counters"""
+        return {
+            "in_flight": len(self._inflight),
+            "generations": self.generations,
+            "coalesced": self.coalesced
+        }
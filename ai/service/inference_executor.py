@@ -0,0 +1,311 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from ..model.llm_model import GenerationCancelled
+
+logger = logging.getLogger("inference-executor")
+
+# Queue priority of each request type (lower runs first): the text at the
+# cursor is stale within seconds, a generate can wait
+REQUEST_PRIORITIES = {
+    "completion": 0,
+    "fim": 0,
+    "fix": 1,
+    "optimization": 1,
+    "refactoring": 1,
+    "generate": 2
+}
+
+
+class InferenceBusy(RuntimeError):
+    """Raised when a generation is not admitted, or waited past its deadline"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Job:
+    """A queued generation and the future awaiting its result"""
+
+    def __init__(
+        self,
+        priority: int,
+        sequence: int,
+        fn: Callable[..., Any],
+        args: tuple,
+        future: asyncio.Future,
+        deadline: Optional[float],
+        cancel_event: Optional[threading.Event]
+    ):
+        self.priority = priority
+        self.sequence = sequence
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.loop = future.get_loop()
+        self.deadline = deadline
+        self.cancel_event = cancel_event
+        self.queued_at = time.monotonic()
+        # "queued", then "running" or "dropped"
+        self.state = "queued"
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None):
+        """Complete the future from any thread"""
+        def _set():
+            if self.future.done():
+                return
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        self.loop.call_soon_threadsafe(_set)
+
+
+class InferenceExecutor:
+    """Runs generations on a fixed number of threads behind a bounded priority queue
+
+    The model is not thread-safe and is saturated by a few generations, so
+    running more at once only makes all of them slower. Jobs beyond the
+    concurrency wait in a queue ordered by priority, then arrival. When the
+    queue is full a job is rejected at once, unless it outranks a queued
+    one, which is rejected in its place. A job still queued at its deadline
+    is dropped. Rejected and dropped jobs fail with InferenceBusy, carrying
+    an estimate of when to retry, so load sheds quickly instead of piling
+    up latency.
+    """
+
+    def __init__(self, max_workers: int = 1, max_queue_size: int = 16, queue_timeout: Optional[float] = 10.0):
+        """Start the worker threads
+
+        Args:
+            max_workers: Generations run at once
+            max_queue_size: Jobs waiting for a thread; further ones are rejected
+            queue_timeout: Default seconds a job may wait in the queue (None = no limit)
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Condition()
+        self._queue: List[_Job] = []
+        self._queued = 0
+        self._running = 0
+        self._sequence = itertools.count()
+        self._closed = False
+
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._expired = 0
+        self._cancelled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._started = 0
+        self._total_run = 0.0
+
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True)
+            for i in range(self.max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        priority: int = 1,
+        timeout: Optional[float] = None,
+        cancel_event: Optional[threading.Event] = None
+    ) -> asyncio.Future:
+        """Queue fn(*args) and return a future of its result
+
+        Must be called from the event loop thread.
+
+        Args:
+            fn: Blocking function to run
+            priority: Queue priority, lower runs first (see REQUEST_PRIORITIES)
+            timeout: Seconds the job may wait in the queue (None = the default)
+            cancel_event: Flag of the job; once set, a queued job is not started
+
+        Returns:
+            Future resolving to the result of fn
+
+        Raises:
+            InferenceBusy: If the queue is full
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Inference executor is shut down")
+            self._submitted += 1
+            if self._full():
+                self._prune()
+            if self._full():
+                victim = self._lowest_priority()
+                if victim is None or victim.priority <= priority:
+                    self._rejected += 1
+                    raise InferenceBusy(
+                        f"Inference queue is full ({self._queued} waiting), try again later",
+                        self._retry_after()
+                    )
+                # The newcomer is more urgent; the least urgent job makes room
+                self._drop(victim, "rejected")
+                victim.resolve(error=InferenceBusy(
+                    "Displaced from the inference queue by a more urgent request", self._retry_after()
+                ))
+
+            now = time.monotonic()
+            job = _Job(
+                priority, next(self._sequence), fn, args, loop.create_future(),
+                now + timeout if timeout is not None else None, cancel_event
+            )
+            heapq.heappush(self._queue, job)
+            self._queued += 1
+            self._lock.notify()
+
+        if job.deadline is not None:
+            job.timer = loop.call_later(timeout, self._expire, job)
+        return job.future
+
+    def _full(self) -> bool:
+        """Whether a new job would exceed the queue (caller holds the lock)"""
+        idle = self.max_workers - self._running
+        return self._queued >= self.max_queue_size + max(idle, 0)
+
+    def _lowest_priority(self) -> Optional[_Job]:
+        """Least urgent queued job, the latest among equals (caller holds the lock)"""
+        queued = [job for job in self._queue if job.state == "queued"]
+        return max(queued, default=None)
+
+    def _drop(self, job: _Job, reason: str):
+        """Take a queued job out of the queue (caller holds the lock)
+
+        The heap entry is skipped when it reaches the top.
+        """
+        job.state = "dropped"
+        self._queued -= 1
+        if reason == "rejected":
+            self._rejected += 1
+        elif reason == "expired":
+            self._expired += 1
+        else:
+            self._cancelled += 1
+        if job.timer is not None:
+            job.loop.call_soon_threadsafe(job.timer.cancel)
+
+    def _prune(self):
+        """Drop queued jobs whose requests were cancelled (caller holds the lock)"""
+        for job in self._queue:
+            if job.state == "queued" and job.cancel_event is not None and job.cancel_event.is_set():
+                self._drop(job, "cancelled")
+                job.resolve(error=GenerationCancelled("Request cancelled"))
+
+    def _expire(self, job: _Job):
+        """Fail a job still queued at its deadline"""
+        with self._lock:
+            if job.state != "queued":
+                return
+            self._drop(job, "expired")
+            waited = time.monotonic() - job.queued_at
+            retry_after = self._retry_after()
+        logger.warning(f"Generation waited {waited:.1f}s in the inference queue; dropped")
+        job.resolve(error=InferenceBusy(
+            f"Request waited {waited:.1f}s for the model, try again later", retry_after
+        ))
+
+    def _retry_after(self) -> float:
+        """Estimated seconds until the queue has drained (caller holds the lock)"""
+        mean_run = self._total_run / self._completed if self._completed else 1.0
+        backlog = self._queued + self._running
+        return round(max(0.1, mean_run * backlog / self.max_workers), 1)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._closed and not self._queue:
+                    self._lock.wait()
+                if self._closed and not self._queue:
+                    return
+                job = heapq.heappop(self._queue)
+                if job.state != "queued":
+                    continue
+                job.state = "running"
+                self._queued -= 1
+                if job.cancel_event is not None and job.cancel_event.is_set():
+                    self._cancelled += 1
+                    job.resolve(error=GenerationCancelled("Request cancelled"))
+                    continue
+                waited = time.monotonic() - job.queued_at
+                self._started += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+                self._running += 1
+
+            if job.timer is not None:
+                job.loop.call_soon_threadsafe(job.timer.cancel)
+            started = time.monotonic()
+            try:
+                result = job.fn(*job.args)
+            except BaseException as e:
+                job.resolve(error=e)
+            else:
+                job.resolve(result)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._total_run += time.monotonic() - started
+
+    def retry_after(self) -> float:
+        """Estimated seconds until a new job would be admitted without waiting"""
+        with self._lock:
+            return self._retry_after()
+
+    def shutdown(self):
+        """Fail queued jobs and stop the threads once running jobs finish"""
+        with self._lock:
+            self._closed = True
+            for job in self._queue:
+                if job.state == "queued":
+                    self._drop(job, "cancelled")
+                    job.resolve(error=GenerationCancelled("Server shutting down"))
+            self._queue.clear()
+            self._lock.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, waiting times and admission counters"""
+        with self._lock:
+            now = time.monotonic()
+            waiting = [job for job in self._queue if job.state == "queued"]
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queued": self._queued,
+                "max_queue_size": self.max_queue_size,
+                "queued_by_priority": {
+                    str(priority): sum(1 for job in waiting if job.priority == priority)
+                    for priority in sorted({job.priority for job in waiting})
+                },
+                "oldest_wait_ms": 1000 * max((now - job.queued_at for job in waiting), default=0.0),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "expired": self._expired,
+                "cancelled": self._cancelled,
+                "mean_wait_ms": 1000 * self._total_wait / self._started if self._started else 0.0,
+                "max_wait_ms": 1000 * self._max_wait,
+                "mean_run_ms": 1000 * self._total_run / self._completed if self._completed else 0.0,
+                "queue_timeout_ms": 1000 * self.queue_timeout if self.queue_timeout is not None else None
+            }
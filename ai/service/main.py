@@ -8,10 +8,24 @@ from pathlib import Path
 # Add the parent directory to sys.path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from ai.config import HOST, PORT, MODEL_NAME, MODEL_FILE, CACHE_DIR, MODEL_DOWNLOAD_DIR, VECTORSTORE_DIR
+from ai.config import (
+    HOST, PORT, MAX_REQUESTS_PER_CONNECTION, MODEL_NAME, MODEL_FILE, CACHE_DIR, MODEL_DOWNLOAD_DIR, VECTORSTORE_DIR, VECTORSTORE_BACKEND, RETRIEVAL_MODE, RETRIEVAL_TIMEOUT_MS,
+    MODEL_WORKERS, MODEL_THREADS, MODEL_QUEUE_SIZE, MODEL_PROGRESS_TIMEOUT, PROMPT_CACHE_DIR,
+    INFERENCE_CONCURRENCY, INFERENCE_QUEUE_SIZE, INFERENCE_QUEUE_TIMEOUT_MS,
+    PROMPT_TOKEN_BUDGET, MAX_NEW_TOKENS, FIM_MAX_NEW_TOKENS,
+    SUGGESTION_CACHE_SIZE, SUGGESTION_CACHE_TTL, SUGGESTION_CACHE_PATH,
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TYPES,
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DIR, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS,
+    EMBEDDING_MODEL, EMBEDDING_BACKEND, EMBEDDING_ONNX_DIR
+)
+from ai.chains.semantic_cache import SemanticSuggestionCache
+from ai.chains.suggestion_cache import SuggestionCache
 from ai.model.llm_model import QuantizedModel
+from ai.model.worker_pool import ModelWorkerPool
 from ai.model.embeddings import CodeEmbeddings
-from ai.vectorstore.chroma_store import ChromaVectorStore
+from ai.model.embedding_batcher import EmbeddingBatcher
+from ai.vectorstore import VECTORSTORE_BACKENDS, create_vector_store
+from ai.vectorstore.chunker import CodeChunker
 from ai.service.ws_server import CodeSuggestionServer
 
 # Configure logging
@@ -38,73 +52,191 @@ async def start_ws_server(args):
         logger.info(f"Model file size: {model_size_mb:.2f} MB")
         
         # Initialize model with conservative memory settings - use only supported parameters
-        model = QuantizedModel(
+        model_kwargs = dict(
             model_name=args.model_name,
             model_file=model_path,
             download_dir=args.download_dir,
             temperature=0.7,
             n_ctx=512,        # Reduced context window 
-            n_threads=2       # Single thread
+            n_threads=2,      # Single thread
+            prompt_cache_dir=str(args.prompt_cache_dir) if args.prompt_cache_dir else None
         )
-        logger.info("Model loaded successfully with reduced memory settings")
+        if args.workers > 0:
+            # One model per process, each with its share of the CPU threads
+            model = ModelWorkerPool(
+                num_workers=args.workers,
+                model_kwargs=model_kwargs,
+                total_threads=args.threads,
+                max_queue_size=args.queue_size,
+                progress_timeout=args.progress_timeout
+            )
+            model.start()
+            logger.info(f"Model worker pool started with {args.workers} workers")
+        else:
+            model = QuantizedModel(**model_kwargs)
+            logger.info("Model loaded successfully with reduced memory settings")
     except Exception as e:
         logger.error(f"Error initializing model: {str(e)}")
         logger.info("Starting server with mock model functionality")
         model = None  # Server will use mock implementations if model is None
     
+    embeddings = None
+    embedding_batcher = None
     try:
         # Initialize embeddings
         logger.info("Initializing embeddings...")
         embeddings = CodeEmbeddings(
             model_name=args.embedding_model,
             cache_dir=args.cache_dir,
-            device="cpu"
+            device="cpu",
+            embedding_cache_size=args.embedding_cache_size,
+            embedding_cache_dir=args.embedding_cache_dir or None,
+            backend=args.embedding_backend,
+            onnx_dir=args.embedding_onnx_dir
         )
         
-        # Create a properly formatted embedding function for ChromaDB
-        class ChromaEmbeddingFunction:
-            def __init__(self, embeddings_model):
-                self.embeddings_model = embeddings_model
-                
-            def __call__(self, input):
-                """ChromaDB expects this specific signature with 'input' parameter"""
-                return self.embeddings_model.embed_text(input)
+        # Concurrent embedding calls share one batched model call
+        if args.embedding_batch_size > 1:
+            embedding_batcher = EmbeddingBatcher(
+                embeddings,
+                max_batch_size=args.embedding_batch_size,
+                max_wait=args.embedding_batch_wait_ms / 1000
+            )
         
         # Initialize vector store with properly formatted embedding function
-        logger.info("Initializing vector store...")
-        vector_store = ChromaVectorStore(
-            persist_directory=args.vectorstore_dir,
+        logger.info(f"Initializing {args.vectorstore_backend} vector store...")
+        vector_store = create_vector_store(
+            args.vectorstore_backend,
+            persist_directory=str(args.vectorstore_dir),
             collection_name=args.collection_name,
-            embedding_function=ChromaEmbeddingFunction(embeddings)
+            embeddings=embedding_batcher or embeddings
         )
     except Exception as e:
         logger.error(f"Error initializing embeddings or vector store: {str(e)}")
         logger.info("Starting server without vector store functionality")
         vector_store = None  # Server will work without vector store
     
+    # Cache identical requests in memory and, optionally, on disk
+    suggestion_cache = None
+    if args.suggestion_cache_size > 0:
+        suggestion_cache = SuggestionCache(
+            max_entries=args.suggestion_cache_size,
+            ttl=args.suggestion_cache_ttl,
+            disk_path=args.suggestion_cache_path or None
+        )
+    
+    # Answer near-duplicate requests with earlier suggestions (needs the embeddings)
+    semantic_cache = None
+    if embeddings is not None and not args.no_semantic_cache:
+        semantic_cache = SemanticSuggestionCache(
+            embedding_batcher or embeddings,
+            threshold=args.semantic_cache_threshold,
+            suggestion_types=[t.strip() for t in args.semantic_cache_types.split(",") if t.strip()],
+            max_entries=args.semantic_cache_size,
+            ttl=args.suggestion_cache_ttl
+        )
+    
+    # Retrieval queries are cut like the snippets: by the embedding tokenizer's count
+    chunker = CodeChunker(count_tokens=embeddings.token_counter()) if embeddings is not None else None
+    
     # Create and start the WebSocket server
     logger.info(f"Starting WebSocket server on {args.host}:{args.port}...")
     server = CodeSuggestionServer(
         host=args.host,
         port=args.port,
         model=model,
-        vector_store=vector_store
+        vector_store=vector_store,
+        prompt_budget=args.prompt_budget,
+        max_new_tokens=args.max_new_tokens,
+        fim_max_new_tokens=args.fim_max_new_tokens,
+        suggestion_cache=suggestion_cache,
+        semantic_cache=semantic_cache,
+        embedding_batcher=embedding_batcher,
+        chunker=chunker,
+        retrieval_mode=args.retrieval_mode,
+        retrieval_timeout=args.retrieval_timeout_ms / 1000,
+        max_requests_per_connection=args.max_requests_per_connection,
+        inference_concurrency=args.inference_concurrency,
+        inference_queue_size=args.inference_queue_size,
+        inference_queue_timeout=args.inference_queue_timeout_ms / 1000 or None
     )
     
-    await server.start()
+    try:
+        await server.start()
+    finally:
+        if isinstance(model, ModelWorkerPool):
+            model.shutdown()
+        if embedding_batcher is not None:
+            embedding_batcher.shutdown()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Code Suggestion Service')
     parser.add_argument('--host', default=HOST, help='Server host')
     parser.add_argument('--port', type=int, default=PORT, help='Server port')
+    parser.add_argument('--max-requests-per-connection', type=int, default=MAX_REQUESTS_PER_CONNECTION,
+                      help='Suggestion requests of one connection processed concurrently')
     parser.add_argument('--model-name', default=MODEL_NAME, help='Model name')
     parser.add_argument('--model-file', default=MODEL_FILE, help='Model file name')
     parser.add_argument('--download-dir', default=MODEL_DOWNLOAD_DIR, help='Model download directory')
     parser.add_argument('--cache-dir', default=CACHE_DIR, help='Model cache directory')
     parser.add_argument('--vectorstore-dir', default=VECTORSTORE_DIR, help='Vector store directory')
+    parser.add_argument('--vectorstore-backend', choices=VECTORSTORE_BACKENDS, default=VECTORSTORE_BACKEND,
+                      help='Vector store backend (mmap shares one memory-mapped index between processes)')
+    parser.add_argument('--retrieval-mode', choices=['vector', 'hybrid'], default=RETRIEVAL_MODE,
+                      help='Context retrieval: embedding similarity, or fused with identifier matches')
+    parser.add_argument('--retrieval-timeout-ms', type=float, default=RETRIEVAL_TIMEOUT_MS,
+                      help='Milliseconds a request waits for retrieved context (0 disables retrieval)')
     parser.add_argument('--collection-name', default='code_suggestions', help='Collection name')
-    parser.add_argument('--embedding-model', default='sentence-transformers/all-MiniLM-L6-v2',
+    parser.add_argument('--embedding-model', default=EMBEDDING_MODEL,
                       help='Embedding model name')
+    parser.add_argument('--embedding-backend', choices=['torch', 'onnx'], default=EMBEDDING_BACKEND,
+                      help='Embedding backend (onnx needs `python -m ai.model.onnx_embeddings export`)')
+    parser.add_argument('--embedding-onnx-dir', default=EMBEDDING_ONNX_DIR,
+                      help='Directory of the exported ONNX embedding model')
+    parser.add_argument('--embedding-cache-size', type=int, default=EMBEDDING_CACHE_SIZE,
+                      help='Embedding vectors kept in memory (0 disables the embedding cache)')
+    parser.add_argument('--embedding-cache-dir', default=EMBEDDING_CACHE_DIR,
+                      help='Directory for cached embedding vectors (empty for memory only)')
+    parser.add_argument('--embedding-batch-size', type=int, default=EMBEDDING_BATCH_SIZE,
+                      help='Texts per batched embedding call (1 disables batching)')
+    parser.add_argument('--embedding-batch-wait-ms', type=float, default=EMBEDDING_BATCH_WAIT_MS,
+                      help='Milliseconds to gather concurrent embedding calls into a batch')
+    parser.add_argument('--workers', type=int, default=MODEL_WORKERS,
+                      help='Number of model worker processes (0 = single in-process model)')
+    parser.add_argument('--threads', type=int, default=MODEL_THREADS,
+                      help='Total CPU threads shared by the model workers')
+    parser.add_argument('--queue-size', type=int, default=MODEL_QUEUE_SIZE,
+                      help='Maximum requests waiting for a model worker')
+    parser.add_argument('--progress-timeout', type=float, default=MODEL_PROGRESS_TIMEOUT,
+                      help='Seconds a model worker may run a job without progress before it is restarted (0 disables)')
+    parser.add_argument('--inference-concurrency', type=int, default=INFERENCE_CONCURRENCY,
+                      help='Generations run at once (0 = one per model worker)')
+    parser.add_argument('--inference-queue-size', type=int, default=INFERENCE_QUEUE_SIZE,
+                      help='Generations waiting for the model before requests are answered busy')
+    parser.add_argument('--inference-queue-timeout-ms', type=float, default=INFERENCE_QUEUE_TIMEOUT_MS,
+                      help='Milliseconds a generation may wait for the model (0 = no limit)')
+    parser.add_argument('--prompt-cache-dir', default=PROMPT_CACHE_DIR,
+                      help='Directory for precomputed prompt-prefix states (empty to disable)')
+    parser.add_argument('--prompt-budget', type=int, default=PROMPT_TOKEN_BUDGET,
+                      help='Maximum prompt size in tokens (default: context size minus generation reserve)')
+    parser.add_argument('--max-new-tokens', type=int, default=MAX_NEW_TOKENS,
+                      help='Maximum tokens generated per suggestion')
+    parser.add_argument('--fim-max-new-tokens', type=int, default=FIM_MAX_NEW_TOKENS,
+                      help='Maximum tokens generated per fill-in-the-middle completion')
+    parser.add_argument('--suggestion-cache-size', type=int, default=SUGGESTION_CACHE_SIZE,
+                      help='Suggestions kept in the in-memory cache (0 disables caching)')
+    parser.add_argument('--suggestion-cache-ttl', type=float, default=SUGGESTION_CACHE_TTL,
+                      help='Seconds a cached suggestion stays valid')
+    parser.add_argument('--suggestion-cache-path', default=SUGGESTION_CACHE_PATH,
+                      help='SQLite file for the persistent suggestion cache (empty for memory only)')
+    parser.add_argument('--no-semantic-cache', action='store_true', default=not SEMANTIC_CACHE_ENABLED,
+                      help='Disable reuse of suggestions for near-duplicate requests')
+    parser.add_argument('--semantic-cache-threshold', type=float, default=SEMANTIC_CACHE_THRESHOLD,
+                      help='Minimum cosine similarity for reusing an earlier suggestion')
+    parser.add_argument('--semantic-cache-size', type=int, default=SEMANTIC_CACHE_SIZE,
+                      help='Entries kept per suggestion type and language in the semantic cache')
+    parser.add_argument('--semantic-cache-types', default=",".join(SEMANTIC_CACHE_TYPES),
+                      help='Comma-separated suggestion types served from the semantic cache')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     parser.add_argument('--mock', action='store_true', help='Use mock model instead of loading real model')
     
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from typing import Optional
+
+
+class CompletionPrefixIndex:
+    """Remembers the last completion per document to serve typing-ahead
+
+    When the user types the first characters of the suggestion that is
+    currently shown, the new buffer is the old one plus a prefix of that
+    suggestion, and the rest of it is still the right answer.
+    """
+
+    def __init__(self, max_documents: int = 32):
+        """Initialize the index
+
+        Args:
+            max_documents: Documents remembered (least recently used are dropped)
+        """
+        self.max_documents = max_documents
+        # Document -> (text before the cursor, suggested continuation, text after the cursor)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def record(self, document: str, prefix: str, continuation: str, suffix: str = ""):
+        """Remember the continuation suggested for a buffer
+
+        Args:
+            document: Document identifier
+            prefix: Text before the cursor when the suggestion was requested
+            continuation: Text suggested for insertion at the cursor
+            suffix: Text after the cursor
+        """
+        if not continuation:
+            self._entries.pop(document, None)
+            return
+        self._entries[document] = (prefix, continuation, suffix)
+        self._entries.move_to_end(document)
+        while len(self._entries) > self.max_documents:
+            self._entries.popitem(last=False)
+
+    def lookup(self, document: str, prefix: str, suffix: str = "") -> Optional[str]:
+        """Rest of the remembered continuation if the user typed into it
+
+        Args:
+            document: Document identifier
+            prefix: Current text before the cursor
+            suffix: Current text after the cursor
+
+        Returns:
+            Remaining continuation, or None if the buffer diverged from it
+        """
+        entry = self._entries.get(document)
+        if entry is None:
+            return None
+        base, continuation, base_suffix = entry
+        if suffix != base_suffix or not prefix.startswith(base):
+            return None
+
+        typed = prefix[len(base):]
+        if len(typed) >= len(continuation) or not continuation.startswith(typed):
+            return None
+        self._entries.move_to_end(document)
+        return continuation[len(typed):]
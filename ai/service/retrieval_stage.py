@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("retrieval-stage")
+
+
+class RetrievalStage:
+    """Fetches context for requests in the background, with a deadline
+
+    Retrieval starts as soon as a request is parsed and runs on its own
+    threads while the request is prepared. The request waits for it only
+    until the deadline and then goes ahead without context; the late
+    result is dropped. A slow vector store therefore bounds, rather than
+    adds to, the latency of suggestions, and cannot occupy the threads
+    that run the model.
+    """
+
+    def __init__(self, get_context: Callable[..., str], timeout: float = 0.2, max_workers: int = 2):
+        """Initialize the stage
+
+        Args:
+            get_context: Function (code, language=, cursor=) returning context text
+            timeout: Seconds from the start of retrieval a request waits for it
+            max_workers: Threads running retrievals; further ones queue
+        """
+        self.get_context = get_context
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._errors = 0
+        self._total_seconds = 0.0
+
+    def start(self, code: str, language: Optional[str] = None, cursor: Optional[int] = None) -> "asyncio.Task":
+        """Begin retrieving context for a request
+
+        Returns:
+            Task resolving to the context text ("" on failure); pass it to wait
+        """
+        with self._lock:
+            self._requests += 1
+        task = asyncio.create_task(self._retrieve(code, language, cursor))
+        task.started = time.monotonic()
+        return task
+
+    async def _retrieve(self, code: str, language: Optional[str], cursor: Optional[int]) -> str:
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            context = await loop.run_in_executor(
+                self._executor, lambda: self.get_context(code, language=language, cursor=cursor)
+            )
+        except Exception as e:
+            # Nobody may be waiting any more, so failures never propagate
+            logger.warning(f"Context retrieval failed: {str(e)}")
+            with self._lock:
+                self._errors += 1
+            return ""
+        with self._lock:
+            self._completed += 1
+            self._total_seconds += time.monotonic() - started
+        return context or ""
+
+    async def wait(self, task: "asyncio.Task") -> Tuple[str, bool]:
+        """Wait for a retrieval until its deadline
+
+        Returns:
+            Tuple of (context text, whether the deadline passed first)
+        """
+        remaining = self.timeout - (time.monotonic() - task.started)
+        try:
+            # Shielded: the retrieval finishes in the background and counts in the stats
+            return await asyncio.wait_for(asyncio.shield(task), max(remaining, 0)), False
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            logger.warning(f"Context retrieval exceeded {self.timeout * 1000:.0f} ms; continuing without context")
+            return "", True
+
+    def shutdown(self):
+        """Stop accepting retrievals; running ones are not waited for"""
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retrieval counters and latency"""
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "completed": self._completed,
+                "timeouts": self._timeouts,
+                "errors": self._errors,
+                "mean_ms": 1000 * self._total_seconds / self._completed if self._completed else 0.0,
+                "timeout_ms": 1000 * self.timeout
+            }
@@ -1,17 +1,108 @@
 import asyncio
+import itertools
 import json
 import logging
 import time
 import websockets
-from typing import Dict, Any, Set, Optional
+from typing import TYPE_CHECKING, Dict, Any, Set, Optional, Union
 from ..chains.code_suggestion import CodeSuggestion
-from ..model.llm_model import QuantizedModel
-from ..vectorstore.chroma_store import ChromaVectorStore
+from ..chains.prompt_builder import PromptBuilder
+from ..chains.semantic_cache import SemanticSuggestionCache
+from ..chains.suggestion_cache import SuggestionCache
+from ..model.embedding_batcher import EmbeddingBatcher
+from ..model.llm_model import QuantizedModel, GenerationCancelled
+from ..model.worker_pool import ModelWorkerPool, WorkerPoolBusy
+from ..vectorstore.chunker import CodeChunker
+from ..vectorstore.mmap_store import MmapVectorStore
+from .coalescing import CancelSignal, RequestCoalescer
+from .inference_executor import REQUEST_PRIORITIES, InferenceBusy, InferenceExecutor
+from .prefix_index import CompletionPrefixIndex
+from .retrieval_stage import RetrievalStage
+
+if TYPE_CHECKING:
+    # Only for annotations; the mmap backend runs without chromadb installed
+    from ..vectorstore.chroma_store import ChromaVectorStore
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("code-suggestion-ws")
 
+
+class ConnectionState:
+    """Per-connection bookkeeping for in-flight suggestion requests"""
+    
+    # Request types answering the text at the cursor; a newer one for the
+    # same document makes older ones useless
+    INTERACTIVE_TYPES = {"completion", "fim"}
+    
+    # Requests admitted per processing slot, running or waiting; each holds its code
+    MAX_PENDING_PER_SLOT = 4
+    
+    def __init__(self, max_concurrent: int = 4):
+        """Initialize the connection state
+        
+        Args:
+            max_concurrent: Requests of the connection processed at once;
+                further ones wait for a slot, up to MAX_PENDING_PER_SLOT
+                times as many in total
+        """
+        # Request id -> running suggestion task
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # Request id -> flag checked by the model between tokens
+        self.cancel_events: Dict[str, CancelSignal] = {}
+        # Request id -> document of an interactive request
+        self.interactive: Dict[str, str] = {}
+        # Last completion per document, to answer typing-ahead without the model
+        self.prefix_index = CompletionPrefixIndex()
+        # Bounds the requests of one connection processed at once
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.max_pending = max_concurrent * self.MAX_PENDING_PER_SLOT
+        # Last request whose responses must follow the ones before it
+        self.ordered_tail: Optional[asyncio.Task] = None
+    
+    def superseded_by(self, request_id: str, suggestion_type: str, document: str) -> list:
+        """Ids of in-flight requests a new request makes obsolete
+        
+        A request replaces an in-flight one with the same id, and an
+        interactive request replaces older interactive requests for the
+        same document. Other requests, such as a long generate, keep running.
+        """
+        superseded = [request_id] if request_id in self.tasks else []
+        if suggestion_type in self.INTERACTIVE_TYPES:
+            superseded.extend(
+                other for other, other_document in self.interactive.items()
+                if other_document == document and other != request_id
+            )
+        return superseded
+    
+    def admits(self, superseded: list) -> bool:
+        """Whether a new request fits beside the in-flight ones it does not supersede"""
+        return len(self.tasks.keys() - set(superseded)) < self.max_pending
+    
+    def cancel(self, request_id: Optional[str] = None) -> int:
+        """Signal in-flight generations to stop
+        
+        Args:
+            request_id: Request to cancel, or None to cancel all of them
+            
+        Returns:
+            Number of generations signalled
+        """
+        if request_id is None:
+            events = list(self.cancel_events.values())
+        else:
+            events = [self.cancel_events[request_id]] if request_id in self.cancel_events else []
+        for event in events:
+            event.set()
+        return len(events)
+    
+    def close(self):
+        """Stop every in-flight request when the connection goes away"""
+        self.cancel()
+        for task in self.tasks.values():
+            task.cancel()
+
+
 class CodeSuggestionServer:
     """WebSocket server for code suggestions"""
     
@@ -19,21 +110,56 @@ class CodeSuggestionServer:
         self,
         host: str = "localhost",
         port: int = 8001,
-        model: Optional[QuantizedModel] = None,
-        vector_store: Optional[ChromaVectorStore] = None
+        model: Optional[Union[QuantizedModel, ModelWorkerPool]] = None,
+        vector_store: Optional[Union["ChromaVectorStore", MmapVectorStore]] = None,
+        prompt_budget: Optional[int] = None,
+        max_new_tokens: int = 1536,
+        fim_max_new_tokens: int = CodeSuggestion.FIM_MAX_NEW_TOKENS,
+        suggestion_cache: Optional[SuggestionCache] = None,
+        semantic_cache: Optional[SemanticSuggestionCache] = None,
+        embedding_batcher: Optional[EmbeddingBatcher] = None,
+        chunker: Optional[CodeChunker] = None,
+        retrieval_mode: str = "vector",
+        retrieval_timeout: float = 0.2,
+        max_requests_per_connection: int = 4,
+        inference_concurrency: int = 0,
+        inference_queue_size: int = 16,
+        inference_queue_timeout: Optional[float] = 10.0
     ):
         """Initialize the WebSocket server
         
         Args:
             host: Server host
             port: Server port
-            model: Initialized Model instance
+            model: Initialized Model instance or started ModelWorkerPool
             vector_store: Initialized vector store
+            prompt_budget: Maximum prompt size in tokens (None = fit the context)
+            max_new_tokens: Upper bound for generated tokens per suggestion
+            fim_max_new_tokens: Upper bound for fill-in-the-middle completions
+            suggestion_cache: Optional exact-match cache of suggestions
+            semantic_cache: Optional cache answering near-duplicate requests
+            embedding_batcher: Batcher used for embeddings, reported in the stats
+            chunker: Splits long code into the retrieval query; should count
+                tokens like the chunker used at ingestion
+            retrieval_mode: "vector" or "hybrid" (vector plus identifier matches)
+            retrieval_timeout: Seconds a request waits for retrieved context
+                before continuing without it (0 disables retrieval)
+            max_requests_per_connection: Requests of one connection
+                processed concurrently; further ones wait
+            inference_concurrency: Generations run at once (0 = one per
+                model worker, or one for an in-process model)
+            inference_queue_size: Generations waiting for the model before
+                further requests are answered "busy"
+            inference_queue_timeout: Seconds a generation may wait for the
+                model before it is answered "busy" (None = no limit)
         """
         self.host = host
         self.port = port
         self.model = model
         self.vector_store = vector_store
+        self.embedding_batcher = embedding_batcher
+        self.fim_max_new_tokens = fim_max_new_tokens
+        self.max_requests_per_connection = max_requests_per_connection
         
         # Initialize components if not provided
         if not self.model:
@@ -43,22 +169,201 @@ class CodeSuggestionServer:
         # Create code suggestion chain - pass the model directly
         self.code_suggestion = CodeSuggestion(
             model_pipeline=self.model,  # Pass the model itself
-            vectorstore=self.vector_store
+            vectorstore=self.vector_store,
+            prompt_builder=PromptBuilder(
+                count_tokens=self.model.count_tokens,
+                n_ctx=self.model.n_ctx,
+                max_new_tokens=max_new_tokens,
+                prompt_budget=prompt_budget
+            ),
+            cache=suggestion_cache,
+            semantic_cache=semantic_cache,
+            chunker=chunker,
+            retrieval_mode=retrieval_mode
         )
         
+        # Evaluate the static system prompts once instead of on every request
+        self.code_suggestion.warm_prompt_cache()
+        
+        # Completions answered from a connection's prefix index
+        self.prefix_hits = 0
+        
+        # Context is retrieved alongside request preparation, within a deadline
+        self.retrieval = None
+        if self.vector_store is not None and retrieval_timeout > 0:
+            self.retrieval = RetrievalStage(self.code_suggestion.get_context, timeout=retrieval_timeout)
+        
+        # Generations run on a fixed number of threads behind a bounded queue;
+        # an in-process model is not thread-safe, so it gets one thread
+        if inference_concurrency <= 0:
+            inference_concurrency = self.model.num_workers if isinstance(self.model, ModelWorkerPool) else 1
+        self.inference = InferenceExecutor(
+            max_workers=inference_concurrency,
+            max_queue_size=inference_queue_size,
+            queue_timeout=inference_queue_timeout
+        )
+        
+        # Identical concurrent requests share one generation
+        self.coalescer = RequestCoalescer(self.inference)
+        
+        # Distinguishes test-client requests sent within the same second
+        self._request_counter = itertools.count(1)
+        
         # Active connections
         self.connections: Set[websockets.WebSocketServerProtocol] = set()
+        self.connection_states: Dict[websockets.WebSocketServerProtocol, ConnectionState] = {}
     
     async def register(self, websocket: websockets.WebSocketServerProtocol):
         """Register a new client connection"""
         self.connections.add(websocket)
+        self.connection_states[websocket] = ConnectionState(self.max_requests_per_connection)
         logger.info(f"Client connected. Total connections: {len(self.connections)}")
     
     async def unregister(self, websocket: websockets.WebSocketServerProtocol):
         """Unregister a client connection"""
         self.connections.remove(websocket)
+        state = self.connection_states.pop(websocket, None)
+        if state:
+            # Nobody is left to receive these suggestions
+            state.close()
         logger.info(f"Client disconnected. Total connections: {len(self.connections)}")
     
+    def get_stats(self) -> Dict[str, Any]:
+        """Collect statistics exposed through the "stats" message"""
+        stats: Dict[str, Any] = {
+            "connections": len(self.connections),
+            "in_flight_requests": sum(len(state.tasks) for state in self.connection_states.values()),
+            "prefix_hits": self.prefix_hits,
+            "coalescing": self.coalescer.stats(),
+            "inference": self.inference.stats()
+        }
+        if isinstance(self.model, ModelWorkerPool):
+            stats["model_pool"] = self.model.stats()
+        if self.code_suggestion.cache is not None:
+            stats["suggestion_cache"] = self.code_suggestion.cache.stats()
+        if self.code_suggestion.semantic_cache is not None:
+            stats["semantic_cache"] = self.code_suggestion.semantic_cache.stats()
+        if self.embedding_batcher is not None:
+            stats["embedding_batcher"] = self.embedding_batcher.stats()
+        if self.retrieval is not None:
+            stats["retrieval"] = self.retrieval.stats()
+        return stats
+    
+    async def _start_suggestion(
+        self,
+        websocket: websockets.WebSocketServerProtocol,
+        request_id: str,
+        data: Dict[str, Any]
+    ):
+        """Run a suggestion request as its own task
+        
+        The connection keeps reading messages while suggestions are generated,
+        so a cancel, a stats request or a cached answer never waits behind a
+        running generation. A request only supersedes in-flight requests with
+        the same id, or older completions for the same document. A request
+        beyond the connection's pending limit is answered "busy" at once.
+        """
+        state = self.connection_states.get(websocket)
+        if state is None:
+            state = self.connection_states[websocket] = ConnectionState(self.max_requests_per_connection)
+        
+        suggestion_type = data.get("type", "completion")
+        document = data.get("documentId") or data.get("uri") or "default"
+        superseded = state.superseded_by(request_id, suggestion_type, document)
+        if not state.admits(superseded):
+            logger.warning(f"Rejected suggestion {request_id}: {len(state.tasks)} requests of the connection in flight")
+            await self._send_busy(
+                websocket, request_id, data,
+                f"Too many requests in flight on this connection ({len(state.tasks)}), try again later",
+                self.inference.retry_after()
+            )
+            return
+        for other in superseded:
+            state.cancel(other)
+        if superseded:
+            logger.info(f"Request {request_id} superseded {len(superseded)} in-flight request(s)")
+        
+        # The test-client format has no request ids, so its answers must
+        # arrive in request order; clients can ask for the same with "ordered"
+        ordered = bool(data.get("fromTestClient") or data.get("ordered"))
+        previous = state.ordered_tail if ordered else None
+        
+        cancel_event = CancelSignal()
+        task = asyncio.create_task(
+            self._run_suggestion(websocket, state, request_id, data, cancel_event, previous)
+        )
+        state.cancel_events[request_id] = cancel_event
+        state.tasks[request_id] = task
+        if suggestion_type in ConnectionState.INTERACTIVE_TYPES:
+            state.interactive[request_id] = document
+        else:
+            state.interactive.pop(request_id, None)
+        if ordered:
+            state.ordered_tail = task
+        
+        def _finished(finished_task: asyncio.Task):
+            # Only drop the entries if a newer request did not reuse the id
+            if state.tasks.get(request_id) is finished_task:
+                del state.tasks[request_id]
+                del state.cancel_events[request_id]
+                state.interactive.pop(request_id, None)
+            if state.ordered_tail is finished_task:
+                state.ordered_tail = None
+            if finished_task.cancelled():
+                return
+            error = finished_task.exception()
+            if isinstance(error, websockets.ConnectionClosed):
+                logger.info(f"Connection closed before suggestion {request_id} was delivered")
+            elif error:
+                logger.error(f"Suggestion task {request_id} failed: {error}")
+        
+        task.add_done_callback(_finished)
+    
+    async def _send_busy(
+        self,
+        websocket: websockets.WebSocketServerProtocol,
+        request_id: str,
+        data: Dict[str, Any],
+        message: str,
+        retry_after: float
+    ):
+        """Answer a request that was not served because of load
+        
+        Tells the client when to try again instead of letting it wait.
+        """
+        if data.get("fromTestClient", False):
+            await websocket.send(json.dumps({
+                "type": "error",
+                "optimizationType": data.get("originalType", data.get("type", "completion")),
+                "suggestions": [],
+                "message": message,
+                "retryAfterMs": round(1000 * retry_after),
+                "timestamp": time.time()
+            }))
+        else:
+            await websocket.send(json.dumps({
+                "id": request_id,
+                "status": "busy",
+                "message": message,
+                "retryAfterMs": round(1000 * retry_after)
+            }))
+    
+    async def _run_suggestion(
+        self,
+        websocket: websockets.WebSocketServerProtocol,
+        state: ConnectionState,
+        request_id: str,
+        data: Dict[str, Any],
+        cancel_event: CancelSignal,
+        previous: Optional[asyncio.Task]
+    ):
+        """Wait for the request's turn, then handle it"""
+        if previous is not None:
+            # Whatever its outcome, the earlier ordered request answers first
+            await asyncio.wait({previous})
+        async with state.slots:
+            await self.handle_suggestion(websocket, request_id, data, cancel_event)
+    
     async def handle_message(self, websocket: websockets.WebSocketServerProtocol, message: str):
         """Handle incoming WebSocket messages
         
@@ -69,6 +374,22 @@ class CodeSuggestionServer:
         try:
             data = json.loads(message)
             
+            # Explicit cancellation of one (or every) in-flight request
+            if data.get("type") == "cancel":
+                state = self.connection_states.get(websocket)
+                cancelled = state.cancel(data.get("id")) if state else 0
+                logger.info(f"Cancel request for {data.get('id', 'all requests')}: {cancelled} generation(s) signalled")
+                return
+            
+            # Service statistics (worker health, queue depth, ...)
+            if data.get("type") == "stats":
+                await websocket.send(json.dumps({
+                    "type": "stats",
+                    "stats": self.get_stats(),
+                    "timestamp": time.time()
+                }))
+                return
+            
             # Support both message formats - check for test client format
             if data.get("type") == "optimization_request":
                 # Handle the test client format
@@ -89,7 +410,7 @@ class CodeSuggestionServer:
                 
                 # Convert to the original format
                 converted_data = {
-                    "id": f"test-{int(time.time())}",
+                    "id": f"test-{int(time.time())}-{next(self._request_counter)}",
                     "type": mapped_suggestion_type,  # Use mapped type
                     "originalType": optimization_type,  # Store original type for response
                     "code": code,
@@ -98,7 +419,7 @@ class CodeSuggestionServer:
                 }
                 
                 # Process with the standard handler
-                await self.handle_suggestion(websocket, converted_data["id"], converted_data)
+                await self._start_suggestion(websocket, converted_data["id"], converted_data)
             else:
                 # Original format
                 request_id = data.get("id", "unknown")
@@ -109,7 +430,11 @@ class CodeSuggestionServer:
                     "performance": "optimization",  # Map performance to optimization
                     "bugfix": "fix",                # Map bugfix to fix
                     "refactoring": "refactoring",   # This one stays the same
-                    "completion": "completion"      # This one stays the same
+                    "completion": "completion",     # This one stays the same
+                    "fix": "fix",
+                    "generate": "generate",
+                    "fim": "fim",                   # Fill-in-the-middle with prefix/suffix
+                    "infill": "fim"
                 }
                 
                 # Convert the suggestion type to the server-expected format and update in data
@@ -118,7 +443,7 @@ class CodeSuggestionServer:
                 
                 logger.info(f"Mapped client type '{suggestion_type}' to server type '{data['type']}'")
                 
-                await self.handle_suggestion(websocket, request_id, data)
+                await self._start_suggestion(websocket, request_id, data)
                 
         except json.JSONDecodeError:
             await websocket.send(json.dumps({
@@ -136,20 +461,27 @@ class CodeSuggestionServer:
         self, 
         websocket: websockets.WebSocketServerProtocol, 
         request_id: str,
-        data: Dict[str, Any]
+        data: Dict[str, Any],
+        cancel_event: Optional[CancelSignal] = None
     ):
         """Handle code suggestion requests"""
         code = data.get("code", "")
         suggestion_type = data.get("type", "completion")  # This is now the mapped type
         original_type = data.get("originalType", suggestion_type)  # Get original client type
         context = data.get("context", None)
+        cursor = data.get("cursor")
+        
+        # Fill-in-the-middle requests send the text around the cursor
+        is_fim = suggestion_type == "fim"
+        if is_fim:
+            prefix, suffix = self._split_fim_request(data)
+            code = prefix + suffix
         
         # Check if this is from the test client
         is_test_client = data.get("fromTestClient", False)
         
-        if context is None:
-            # Format context better
-            context = "No additional context available."
+        # Partial frames are opt-in and only supported by the original format
+        stream = bool(data.get("stream", False)) and not is_test_client
         
         if not code:
             if is_test_client:
@@ -167,6 +499,17 @@ class CodeSuggestionServer:
                     "message": "No code provided"
                 }))
             return
+        
+        # Retrieve context for requests without one while the rest is prepared
+        loop = asyncio.get_running_loop()
+        retrieval = None
+        if context is None and not is_fim and self.retrieval is not None:
+            retrieval = self.retrieval.start(code, language=data.get("language"), cursor=cursor)
+            # Tokenize the code meanwhile; the prompt builder reuses the count
+            tokenizing = loop.run_in_executor(None, self.code_suggestion.prompt_builder.count_tokens, code)
+        if context is None and retrieval is None:
+            # Format context better
+            context = "No additional context available."
             
         # Send acknowledgment - only for original format
         if not is_test_client:
@@ -175,31 +518,130 @@ class CodeSuggestionServer:
                 "status": "processing"
             }))
         
+        # Typing ahead into the previous completion: answer with the rest of it
+        state = self.connection_states.get(websocket)
+        document = data.get("documentId") or data.get("uri") or "default"
+        if state is not None and not is_test_client:
+            if is_fim:
+                remainder = state.prefix_index.lookup(document, prefix, suffix)
+                suggestion = remainder
+            elif suggestion_type == "completion" and cursor is None:
+                remainder = state.prefix_index.lookup(document, code)
+                suggestion = code.lstrip() + remainder if remainder is not None else None
+            else:
+                remainder = None
+            if remainder is not None:
+                # The retrieval finishes unobserved; its result is not needed
+                self.prefix_hits += 1
+                await websocket.send(json.dumps({
+                    "id": request_id,
+                    "status": "success",
+                    "suggestion": suggestion,
+                    "type": original_type,
+                    "source": "prefix"
+                }))
+                return
+        
         # Generate suggestion
         try:
-            # Log the type being passed to the model
-            logger.info(f"Generating suggestion of type: {suggestion_type}")
+            if cancel_event is not None and cancel_event.is_set():
+                # Cancelled or superseded while waiting for a slot
+                raise GenerationCancelled("Request cancelled")
+            context_timed_out = False
+            if retrieval is not None:
+                try:
+                    await tokenizing
+                except Exception:
+                    pass  # Counted again while the prompt is built
+                context, context_timed_out = await self.retrieval.wait(retrieval)
+                context = context or "No additional context available."
             
-            # Start a task to generate the suggestion
-            loop = asyncio.get_running_loop()
-            suggestion = await loop.run_in_executor(
-                None,
-                lambda: self.code_suggestion.generate_suggestion(
-                    code=code,
-                    suggestion_type=suggestion_type,  # Use the mapped type
-                    context=context
+            # Cache hits are answered without queueing for the model
+            if is_fim:
+                lookup = lambda: self.code_suggestion.lookup_cache(prefix, "fim", suffix)
+            else:
+                lookup = lambda: self.code_suggestion.lookup_cache(
+                    code, suggestion_type, context, data.get("language")
                 )
-            )
+            suggestion = await loop.run_in_executor(None, lookup)
+            
+            if suggestion is None:
+                # Log the type being passed to the model
+                logger.info(f"Generating suggestion of type: {suggestion_type}")
+                
+                # Streamed increments are queued for a sender task
+                partials: Optional[asyncio.Queue] = None
+                sender = None
+                if stream:
+                    partials = asyncio.Queue()
+                    sender = asyncio.create_task(
+                        self._send_partials(websocket, request_id, original_type, partials)
+                    )
+                
+                # The generation may be shared with identical requests, so it gets
+                # its own partial callback and cancellation flag
+                if is_fim:
+                    request_key = self.code_suggestion.request_key(prefix, "fim", suffix)
+                    generate = lambda on_partial, shared_cancel: self.code_suggestion.generate_infill(
+                        prefix=prefix,
+                        suffix=suffix,
+                        max_tokens=self.fim_max_new_tokens,
+                        on_partial=on_partial,
+                        cancel_event=shared_cancel,
+                        language=data.get("language")
+                    )
+                else:
+                    request_key = self.code_suggestion.request_key(code, suggestion_type, context)
+                    generate = lambda on_partial, shared_cancel: self.code_suggestion.generate_suggestion(
+                        code=code,
+                        suggestion_type=suggestion_type,  # Use the mapped type
+                        context=context,
+                        on_partial=on_partial,
+                        cancel_event=shared_cancel,
+                        cursor=cursor,
+                        language=data.get("language")
+                    )
+                
+                # Start or join the generation of the suggestion; interactive
+                # requests queue ahead, and a client may shorten the queue deadline
+                queue_timeout = self.inference.queue_timeout
+                if isinstance(data.get("deadlineMs"), (int, float)) and data["deadlineMs"] > 0:
+                    deadline = data["deadlineMs"] / 1000
+                    queue_timeout = deadline if queue_timeout is None else min(deadline, queue_timeout)
+                try:
+                    suggestion = await self.coalescer.run(
+                        request_key,
+                        generate,
+                        cancel_event,
+                        partials,
+                        priority=REQUEST_PRIORITIES.get(suggestion_type, 1),
+                        queue_timeout=queue_timeout
+                    )
+                finally:
+                    if sender:
+                        # Flush pending partial frames before the final response
+                        partials.put_nowait(None)
+                        await sender
             
             # Clean up the suggestion - remove instruction formatting if present
             if "[/INST]" in suggestion:
                 suggestion = suggestion.split("[/INST]", 1)[1].strip()
             
+            # Remember the continuation so further typing into it skips the model
+            if state is not None and not is_test_client:
+                if is_fim:
+                    state.prefix_index.record(document, prefix, suggestion, suffix)
+                elif suggestion_type == "completion" and cursor is None:
+                    body = code.strip()
+                    if body and suggestion.startswith(body):
+                        lead = code[:len(code) - len(code.lstrip())]
+                        state.prefix_index.record(document, lead + body, suggestion[len(body):])
+            
             # Send response - different format based on client type
             if is_test_client:
                 # Format for test client
                 suggestions = [{
-                    "id": f"sugg-{int(time.time())}",
+                    "id": request_id.replace("test-", "sugg-", 1),
                     "type": original_type,  # Use original type in response
                     "lineNumber": 1,
                     "code": code.strip().split("\n")[0] if "\n" in code else code.strip(),
@@ -216,11 +658,35 @@ class CodeSuggestionServer:
                 }))
             else:
                 # Original format
-                await websocket.send(json.dumps({
+                response = {
                     "id": request_id,
                     "status": "success",
                     "suggestion": suggestion,
                     "type": original_type  # Use original type in response
+                }
+                if context_timed_out:
+                    # Generated without retrieved context
+                    response["contextTimedOut"] = True
+                await websocket.send(json.dumps(response))
+        except (InferenceBusy, WorkerPoolBusy) as e:
+            logger.warning(f"Rejected suggestion {request_id}: {str(e)}")
+            retry_after = getattr(e, "retry_after", None) or self.inference.retry_after()
+            await self._send_busy(websocket, request_id, data, str(e), retry_after)
+        except GenerationCancelled:
+            logger.info(f"Suggestion {request_id} cancelled")
+            
+            if is_test_client:
+                await websocket.send(json.dumps({
+                    "type": "optimization_response",
+                    "optimizationType": original_type,
+                    "suggestions": [],
+                    "message": "Request cancelled",
+                    "timestamp": time.time()
+                }))
+            else:
+                await websocket.send(json.dumps({
+                    "id": request_id,
+                    "status": "cancelled"
                 }))
         except Exception as e:
             logger.exception(f"Error generating suggestion: {str(e)}")
@@ -240,6 +706,47 @@ class CodeSuggestionServer:
                     "message": f"Error generating suggestion: {str(e)}"
                 }))
     
+    def _split_fim_request(self, data: Dict[str, Any]):
+        """Get (prefix, suffix) from explicit fields or from code and cursor"""
+        if "prefix" in data or "suffix" in data:
+            return data.get("prefix") or "", data.get("suffix") or ""
+        code = data.get("code", "")
+        cursor = data.get("cursor")
+        if not isinstance(cursor, int):
+            cursor = len(code)
+        cursor = max(0, min(cursor, len(code)))
+        return code[:cursor], code[cursor:]
+    
+    async def _send_partials(
+        self,
+        websocket: websockets.WebSocketServerProtocol,
+        request_id: str,
+        original_type: str,
+        partials: asyncio.Queue
+    ):
+        """Send streamed suggestion increments as partial frames
+        
+        Increments that queue up while a frame is being sent are merged into
+        the next frame. A None item marks the end of the stream.
+        """
+        done = False
+        while not done:
+            delta = await partials.get()
+            if delta is None:
+                break
+            while not partials.empty():
+                more = partials.get_nowait()
+                if more is None:
+                    done = True
+                    break
+                delta += more
+            await websocket.send(json.dumps({
+                "id": request_id,
+                "status": "partial",
+                "delta": delta,
+                "type": original_type
+            }))
+    
     async def handler(self, websocket, path=None):
         """WebSocket connection handler
         
@@ -249,6 +756,8 @@ class CodeSuggestionServer:
         """
         await self.register(websocket)
         try:
+            # Control messages are handled inline, in arrival order; suggestion
+            # requests are dispatched as tasks and do not hold up the loop
             async for message in websocket:
                 await self.handle_message(websocket, message)
         except websockets.ConnectionClosed:
@@ -266,4 +775,9 @@ class CodeSuggestionServer:
             self.port
         )
         logger.info(f"WebSocket server started on ws://{self.host}:{self.port}")
-        await server.wait_closed()  # More reliable than asyncio.Future()
\ No newline at end of file
+        try:
+            await server.wait_closed()  # More reliable than asyncio.Future()
+        finally:
+            self.inference.shutdown()
+            if self.retrieval is not None:
+                self.retrieval.shutdown()
\ No newline at end of file
@@ -0,0 +1,32 @@
+VECTORSTORE_BACKENDS = ("chroma", "mmap")
+
+
+def create_vector_store(backend: str, persist_directory: str, collection_name: str, embeddings):
+    """Open the vector store of the configured backend
+
+    Backends are imported lazily, so the mmap backend does not load chromadb.
+
+    Args:
+        backend: "chroma" (ChromaDB) or "mmap" (memory-mapped matrix, see MmapVectorStore)
+        persist_directory: Directory to persist vector database
+        collection_name: Name of the collection
+        embeddings: CodeEmbeddings or EmbeddingBatcher embedding documents and queries
+
+    Returns:
+        ChromaVectorStore or MmapVectorStore
+    """
+    if backend == "chroma":
+        from .chroma_store import ChromaEmbeddingFunction, ChromaVectorStore
+        return ChromaVectorStore(
+            persist_directory=persist_directory,
+            collection_name=collection_name,
+            embedding_function=ChromaEmbeddingFunction(embeddings)
+        )
+    if backend == "mmap":
+        from .mmap_store import MmapVectorStore
+        return MmapVectorStore(
+            persist_directory=persist_directory,
+            collection_name=collection_name,
+            embedding_function=embeddings.embed_array
+        )
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -1,8 +1,24 @@
+import hashlib
 import os
 from typing import Dict, List, Optional, Union
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 
+from .lexical_index import LexicalIndex, hybrid_search
+
+class ChromaEmbeddingFunction:
+    """Adapts CodeEmbeddings (or an EmbeddingBatcher) to ChromaDB's embedding function"""
+    
+    def __init__(self, embeddings_model):
+        self.embeddings_model = embeddings_model
+        
+    def __call__(self, input):
+        """ChromaDB expects this specific signature with 'input' parameter"""
+        # Chroma accepts the float32 array as is, without a list round-trip
+        return self.embeddings_model.embed_array(input)
+
+
 class ChromaVectorStore:
     """Vector database for storing and retrieving code embeddings"""
     
@@ -10,7 +26,8 @@ class ChromaVectorStore:
         self, 
         persist_directory: str, 
         collection_name: str = "code_suggestions",
-        embedding_function = None
+        embedding_function = None,
+        lexical_index: bool = True
     ):
         """Initialize ChromaDB vector store
         
@@ -18,6 +35,7 @@ class ChromaVectorStore:
             persist_directory: Directory to persist vector database
             collection_name: Name of the collection
             embedding_function: Function to generate embeddings (optional)
+            lexical_index: Keep a BM25 index of the documents for hybrid_search
         """
         self.persist_directory = persist_directory
         self.collection_name = collection_name
@@ -38,6 +56,11 @@ class ChromaVectorStore:
             embedding_function=embedding_function
         )
         
+        # Identifier index next to the collection, updated by every write
+        self.lexical_index = LexicalIndex(
+            os.path.join(persist_directory, f"{collection_name}.lexical.sqlite3")
+        ) if lexical_index else None
+        
         print(f"ChromaDB initialized with collection: {collection_name}")
     
     def add_documents(
@@ -45,7 +68,7 @@ class ChromaVectorStore:
         documents: List[str],
         ids: Optional[List[str]] = None,
         metadatas: Optional[List[Dict]] = None,
-        embeddings: Optional[List[List[float]]] = None
+        embeddings: Optional[Union[np.ndarray, List[List[float]]]] = None
     ) -> List[str]:
         """Add documents to the vector store
         
@@ -53,15 +76,26 @@ class ChromaVectorStore:
             documents: List of documents to add
             ids: List of IDs for the documents
             metadatas: List of metadata for the documents
-            embeddings: List of embeddings for the documents (optional)
+            embeddings: Embeddings for the documents, a float32 array of shape
+                (documents, dimension) or a list of vectors (optional)
             
         Returns:
             List of IDs for the added documents
         """
-        # Generate IDs if not provided
+        # Derive IDs from the content so adding the same document twice does not duplicate it
         if ids is None:
-            import uuid
-            ids = [str(uuid.uuid4()) for _ in range(len(documents))]
+            ids = [hashlib.sha256(document.encode("utf-8")).hexdigest() for document in documents]
+            unique = {}
+            for index, document_id in enumerate(ids):
+                unique.setdefault(document_id, index)
+            if len(unique) < len(ids):
+                keep = sorted(unique.values())
+                documents = [documents[i] for i in keep]
+                ids = [ids[i] for i in keep]
+                metadatas = [metadatas[i] for i in keep] if metadatas is not None else None
+                embeddings = embeddings[keep] if isinstance(embeddings, np.ndarray) else (
+                    [embeddings[i] for i in keep] if embeddings is not None else None
+                )
         
         # Add documents
         self.collection.add(
@@ -70,14 +104,126 @@ class ChromaVectorStore:
             metadatas=metadatas,
             embeddings=embeddings
         )
+        if self.lexical_index is not None:
+            self.lexical_index.add(ids, documents)
+        
+        return ids
+    
+    def upsert_documents(
+        self,
+        documents: List[str],
+        ids: List[str],
+        metadatas: Optional[List[Dict]] = None,
+        embeddings: Optional[Union[np.ndarray, List[List[float]]]] = None
+    ) -> List[str]:
+        """Insert documents or replace the ones with the same IDs
+        
+        Args:
+            documents: List of documents to write
+            ids: List of IDs for the documents
+            metadatas: List of metadata for the documents
+            embeddings: Embeddings for the documents (optional)
+            
+        Returns:
+            List of IDs for the written documents
+        """
+        self.collection.upsert(
+            documents=documents,
+            ids=ids,
+            metadatas=metadatas,
+            embeddings=embeddings
+        )
+        if self.lexical_index is not None:
+            self.lexical_index.add(ids, documents)
         
         return ids
     
+    def delete_documents(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        """Delete documents by ID or metadata filter
+        
+        Args:
+            ids: IDs of the documents to delete
+            where: Filter criteria for the documents to delete
+        """
+        if not ids and not where:
+            return
+        if where and self.lexical_index is not None:
+            # Resolve the filter so the same documents leave the lexical index
+            ids = self.collection.get(ids=ids or None, where=where, include=[])["ids"]
+            where = None
+            if not ids:
+                return
+        self.collection.delete(ids=ids or None, where=where)
+        if self.lexical_index is not None:
+            self.lexical_index.delete(ids)
+    
+    def get_documents(
+        self,
+        ids: List[str],
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Fetch documents by ID
+        
+        Args:
+            ids: IDs of the documents
+            where: Filter criteria the documents must also match
+            include: Fields to return ("documents", "metadatas", "embeddings")
+            
+        Returns:
+            Dict with flat "ids" and the included fields; missing IDs are left out
+        """
+        return self.collection.get(
+            ids=ids,
+            where=where,
+            include=["documents", "metadatas"] if include is None else include
+        )
+    
+    def count(self) -> int:
+        """Number of documents in the collection"""
+        return self.collection.count()
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embedding of a query text"""
+        if not self.embedding_function:
+            raise ValueError("Embedding a query needs an embedding function")
+        return np.asarray(self.embedding_function([query])[0], dtype=np.float32)
+    
+    def rebuild_lexical_index(self, batch_size: int = 1000):
+        """Index every document of the collection lexically (for collections written without it)"""
+        if self.lexical_index is None:
+            return
+        self.lexical_index.clear()
+        for offset in range(0, self.collection.count(), batch_size):
+            page = self.collection.get(include=["documents"], limit=batch_size, offset=offset)
+            self.lexical_index.add(page["ids"], page["documents"])
+    
+    def hybrid_search(
+        self,
+        query: str,
+        n_results: int = 5,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Search by vector similarity and identifier overlap, fused by rank
+        
+        Args:
+            query: Query text
+            n_results: Number of results to return
+            where: Filter criteria
+            include: Result fields to return
+            
+        Returns:
+            Dict with search results and their fused "scores"
+        """
+        return hybrid_search(self, query, n_results=n_results, where=where, include=include)
+    
     def search(
         self, 
-        query: Union[str, List[float]], 
+        query: Union[str, List[float], np.ndarray], 
         n_results: int = 5,
-        where: Optional[Dict] = None
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
     ) -> Dict:
         """Search for similar documents
         
@@ -85,6 +231,8 @@ class ChromaVectorStore:
             query: Query text or embedding vector
             n_results: Number of results to return
             where: Filter criteria
+            include: Result fields to return ("documents", "metadatas",
+                "distances", "embeddings"; None = Chroma's default)
             
         Returns:
             Dict with search results
@@ -93,19 +241,85 @@ class ChromaVectorStore:
         query_embedding = None
         if isinstance(query, str) and self.embedding_function:
             query_embedding = self.embedding_function([query])[0]
+        elif not isinstance(query, str):
+            query_embedding = query
         
         # Perform search
+        options = {"include": include} if include is not None else {}
         if query_embedding is not None:
             results = self.collection.query(
                 query_embeddings=[query_embedding],
                 n_results=n_results,
-                where=where
+                where=where,
+                **options
             )
         else:
             results = self.collection.query(
                 query_texts=[query] if isinstance(query, str) else None,
                 n_results=n_results,
-                where=where
+                where=where,
+                **options
+            )
+        
+        return results
+    
+    def search_many(
+        self,
+        queries: List[Union[str, List[float], np.ndarray]],
+        n_results: Union[int, List[int]] = 5,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """Search for several queries with one embedding call and one query
+        
+        Args:
+            queries: Query texts or embedding vectors
+            n_results: Number of results, for all queries or per query
+            where: Filter criteria shared by the queries
+            include: Result fields to return (see search)
+            
+        Returns:
+            One result dict per query, each in the layout of search
+        """
+        if not queries:
+            return []
+        counts = [n_results] * len(queries) if isinstance(n_results, int) else list(n_results)
+        if len(counts) != len(queries):
+            raise ValueError("n_results needs one count per query")
+        
+        options = {"include": include} if include is not None else {}
+        texts = [i for i, query in enumerate(queries) if isinstance(query, str)]
+        if texts and not self.embedding_function and len(texts) < len(queries):
+            raise ValueError("Mixing text and vector queries needs an embedding function")
+        
+        if texts and not self.embedding_function:
+            # Chroma embeds the texts itself, also in one batch
+            results = self.collection.query(
+                query_texts=list(queries), n_results=max(counts), where=where, **options
+            )
+        else:
+            embeddings = [None] * len(queries)
+            if texts:
+                embedded = self.embedding_function([queries[i] for i in texts])
+                for position, i in enumerate(texts):
+                    embeddings[i] = embedded[position]
+            for i, query in enumerate(queries):
+                if embeddings[i] is None:
+                    embeddings[i] = query
+            results = self.collection.query(
+                query_embeddings=[np.asarray(e, dtype=np.float32) for e in embeddings],
+                n_results=max(counts),
+                where=where,
+                **options
             )
         
-        return results
\ No newline at end of file
+        # One query with the largest count, cut down to each query's own
+        per_query = []
+        for i, count in enumerate(counts):
+            result = dict(results)
+            for field in ("ids", "documents", "metadatas", "distances", "embeddings", "uris", "data"):
+                values = results.get(field)
+                if values is not None:
+                    result[field] = [values[i][:count] if values[i] is not None else None]
+            per_query.append(result)
+        return per_query
\ No newline at end of file
@@ -0,0 +1,355 @@
+import ast
+import re
+from typing import Callable, Dict, List, Optional
+
+# Definition keywords of common languages, followed by the symbol name
+_DEFINITION = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|protected\s+|internal\s+|static\s+|"
+    r"abstract\s+|final\s+|async\s+|override\s+|virtual\s+|pub(?:\([^)]*\))?\s+)*"
+    r"(?:function\*?|def|class|interface|struct|enum|trait|impl|fn|func|module|namespace|type)\s+"
+    r"(?:\([^)]*\)\s*)?([A-Za-z_$][\w$]*)"
+)
+# C-family functions and methods: "ReturnType name(" at the start of a block
+_CALLABLE = re.compile(r"^\s*(?:[\w$<>\[\],.*&:]+\s+)+([A-Za-z_$][\w$]*)\s*\(")
+# Assigned functions: "const name = (...) =>" / "name = function"
+_ASSIGNED = re.compile(r"^\s*(?:export\s+)?(?:const|let|var)?\s*([A-Za-z_$][\w$]*)\s*=\s*(?:async\s+)?(?:function\b|\([^)]*\)\s*=>|\w+\s*=>)")
+
+# Languages whose blocks are delimited by indentation rather than braces
+INDENT_LANGUAGES = {"python", "ruby", "yaml"}
+
+
+def approximate_token_count(text: str) -> int:
+    """Rough word-piece count of code (~3 characters per token)"""
+    return (len(text) + 2) // 3
+
+
+class Chunk:
+    """A piece of source code with its location and enclosing symbol"""
+
+    def __init__(self, text: str, start_line: int, end_line: int, symbol: str = "", parent: str = "", kind: str = "module"):
+        """Initialize the chunk
+
+        Args:
+            text: Source text of the chunk
+            start_line: First line (1-based)
+            end_line: Last line (inclusive)
+            symbol: Qualified name of the function or class ("" for module code)
+            parent: Qualified name of the enclosing class or function
+            kind: "function", "class", "block" or "module"
+        """
+        self.text = text
+        self.start_line = start_line
+        self.end_line = end_line
+        self.symbol = symbol
+        self.parent = parent
+        self.kind = kind
+
+    def metadata(self) -> Dict[str, object]:
+        """Metadata stored with the chunk in the vector store"""
+        return {
+            "start_line": self.start_line,
+            "end_line": self.end_line,
+            "symbol": self.symbol,
+            "parent": self.parent,
+            "kind": self.kind,
+        }
+
+    def __repr__(self):
+        return f"Chunk({self.kind} {self.symbol or '<module>'} lines {self.start_line}-{self.end_line})"
+
+
+class _Unit:
+    """Line range of a definition or of the code between definitions (0-based, end exclusive)"""
+
+    def __init__(self, start: int, end: int, symbol: str = "", parent: str = "", kind: str = "module", children=None):
+        self.start = start
+        self.end = end
+        self.symbol = symbol
+        self.parent = parent
+        self.kind = kind
+        self.children: List["_Unit"] = children or []
+
+
+class CodeChunker:
+    """Splits source code at function and class boundaries
+
+    Python is parsed with ast. Other languages use brace depth or
+    indentation to find top-level blocks. Definitions that exceed the token
+    budget are split at their nested definitions and, failing that, into
+    overlapping line windows.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        max_tokens: int = 240,
+        overlap_tokens: int = 32,
+        min_tokens: int = 24
+    ):
+        """Initialize the chunker
+
+        Args:
+            count_tokens: Token count of a text for the embedding model
+                (None = approximate from the character count)
+            max_tokens: Maximum tokens per chunk; the embedding model
+                truncates longer input
+            overlap_tokens: Tokens repeated between windows of a split definition
+            min_tokens: Module code smaller than this is merged into the
+                neighbouring definition instead of becoming its own chunk
+        """
+        self.count_tokens = count_tokens or approximate_token_count
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+
+    def chunk(self, text: str, language: Optional[str] = None) -> List[Chunk]:
+        """Split source code into chunks
+
+        Args:
+            text: Source code
+            language: Language of the code (None = guess from the syntax)
+
+        Returns:
+            Chunks in source order
+        """
+        lines = text.splitlines()
+        if not any(line.strip() for line in lines):
+            return []
+
+        units = None
+        if language in (None, "python"):
+            units = self._python_units(text, len(lines))
+        if units is None:
+            if language in INDENT_LANGUAGES:
+                units = self._indent_units(lines)
+            else:
+                units = self._brace_units(lines)
+
+        chunks: List[Chunk] = []
+        for unit in self._merge_small(lines, units):
+            self._emit(lines, unit, chunks)
+        return chunks
+
+    def query_chunk(self, text: str, language: Optional[str] = None, cursor: Optional[int] = None) -> str:
+        """The chunk of a query that best represents it for retrieval
+
+        Args:
+            text: Query code
+            language: Language of the code
+            cursor: Character offset of the cursor (None = end of the code)
+
+        Returns:
+            Text of the chunk containing the cursor (the whole text if it fits)
+        """
+        if self.count_tokens(text) <= self.max_tokens:
+            return text
+        chunks = self.chunk(text, language)
+        if not chunks:
+            return text
+        cursor = len(text) if cursor is None else max(0, min(cursor, len(text)))
+        cursor_line = text.count("\n", 0, cursor) + 1
+        # The last chunk starting at or before the cursor line
+        best = chunks[0]
+        for chunk in chunks:
+            if chunk.start_line <= cursor_line:
+                best = chunk
+        return best.text
+
+    # Finding definitions
+
+    def _python_units(self, text: str, line_count: int) -> Optional[List[_Unit]]:
+        """Definitions from the Python syntax tree, or None if it does not parse"""
+        try:
+            tree = ast.parse(text)
+        except (SyntaxError, ValueError):
+            return None
+
+        def definitions(body, parent: str) -> List[_Unit]:
+            units = []
+            for node in body:
+                if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    continue
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+                symbol = f"{parent}.{node.name}" if parent else node.name
+                kind = "class" if isinstance(node, ast.ClassDef) else "function"
+                units.append(_Unit(start, node.end_lineno, symbol, parent, kind, definitions(node.body, symbol)))
+            return units
+
+        return self._fill_gaps(definitions(tree.body, ""), 0, line_count, "")
+
+    def _brace_units(self, lines: List[str]) -> List[_Unit]:
+        """Top-level blocks of brace languages: from a depth-0 line to the line closing it"""
+        units = []
+        depth = 0
+        start = None
+        quote = None
+        in_block_comment = False
+        for index, line in enumerate(lines):
+            if depth == 0 and start is None and line.strip():
+                start = index
+            i = 0
+            while i < len(line):
+                char = line[i]
+                if in_block_comment:
+                    if line.startswith("*/", i):
+                        in_block_comment = False
+                        i += 1
+                elif quote:
+                    if char == "\\":
+                        i += 1
+                    elif char == quote:
+                        quote = None
+                elif line.startswith("//", i) or char == "#":
+                    break
+                elif line.startswith("/*", i):
+                    in_block_comment = True
+                    i += 1
+                elif char in "\"'`":
+                    quote = char
+                elif char in "{([":
+                    depth += 1
+                elif char in "})]":
+                    depth = max(0, depth - 1)
+                i += 1
+            if quote != "`":
+                quote = None
+            stripped = line.strip()
+            # A block ends when its brackets close, or at a depth-0 statement end
+            if start is not None and depth == 0 and (stripped.endswith(("}", "};", ";", ")")) or not stripped):
+                units.append(self._block_unit(lines, start, index + 1))
+                start = None
+        if start is not None:
+            units.append(self._block_unit(lines, start, len(lines)))
+        return self._fill_gaps([u for u in units if u.kind != "module"], 0, len(lines), "")
+
+    def _indent_units(self, lines: List[str]) -> List[_Unit]:
+        """Top-level blocks of indentation languages: a depth-0 line and its indented body"""
+        units = []
+        start = None
+        for index, line in enumerate(lines):
+            stripped = line.strip()
+            # Closing lines ("end", brackets) belong to the block above them
+            if stripped and not line[0].isspace() and not re.match(r"^(end\b|[)\]}])", stripped):
+                if start is not None:
+                    units.append(self._block_unit(lines, start, self._trim_end(lines, start, index)))
+                start = index
+        if start is not None:
+            units.append(self._block_unit(lines, start, len(lines)))
+        return self._fill_gaps([u for u in units if u.kind != "module"], 0, len(lines), "")
+
+    def _block_unit(self, lines: List[str], start: int, end: int) -> _Unit:
+        """Unit of a block, named after the definition on its first lines"""
+        for line in lines[start:min(end, start + 3)]:
+            for pattern in (_DEFINITION, _ASSIGNED, _CALLABLE):
+                match = pattern.match(line)
+                if match and match.group(1) not in ("if", "for", "while", "switch", "catch", "return"):
+                    kind = "class" if re.search(r"\b(class|interface|struct|enum|trait|impl)\b", line) else "function"
+                    return _Unit(start, end, match.group(1), "", kind)
+        return _Unit(start, end, kind="module" if end - start <= 1 else "block")
+
+    @staticmethod
+    def _trim_end(lines: List[str], start: int, end: int) -> int:
+        """End of a block without its trailing blank lines"""
+        while end > start + 1 and not lines[end - 1].strip():
+            end -= 1
+        return end
+
+    def _fill_gaps(self, definitions: List[_Unit], start: int, end: int, parent: str) -> List[_Unit]:
+        """Definitions plus units for the code between them, covering start..end"""
+        units = []
+        position = start
+        for unit in sorted(definitions, key=lambda u: u.start):
+            if unit.start < position:
+                continue  # Overlapping heuristic match
+            if unit.start > position:
+                units.append(_Unit(position, unit.start, parent, parent, "module" if not parent else "block"))
+            units.append(unit)
+            position = unit.end
+        if position < end:
+            units.append(_Unit(position, end, parent, parent, "module" if not parent else "block"))
+        return units
+
+    # Building chunks
+
+    def _tokens(self, lines: List[str], start: int, end: int) -> int:
+        return self.count_tokens("\n".join(lines[start:end]))
+
+    def _merge_small(self, lines: List[str], units: List[_Unit]) -> List[_Unit]:
+        """Merge consecutive module code, and attach tiny gaps to the next definition"""
+        merged: List[_Unit] = []
+        carry = None
+        for unit in units:
+            if not any(line.strip() for line in lines[unit.start:unit.end]):
+                continue
+            if unit.kind in ("module", "block") and not unit.children:
+                if merged and merged[-1].kind == unit.kind and merged[-1].symbol == unit.symbol \
+                        and self._tokens(lines, merged[-1].start, unit.end) <= self.max_tokens:
+                    merged[-1].end = unit.end
+                    continue
+                if self._tokens(lines, unit.start, unit.end) < self.min_tokens:
+                    # Comments or imports right before a definition belong to it
+                    carry = unit.start if carry is None else carry
+                    continue
+            if carry is not None:
+                unit.start = min(unit.start, carry)
+                carry = None
+            merged.append(unit)
+        if carry is not None:
+            if merged:
+                merged[-1].end = max(merged[-1].end, units[-1].end)
+            else:
+                merged.append(_Unit(carry, units[-1].end))
+        return merged
+
+    def _emit(self, lines: List[str], unit: _Unit, chunks: List[Chunk]):
+        """Add the chunks of a unit, descending into nested definitions if it is too big"""
+        if self._tokens(lines, unit.start, unit.end) <= self.max_tokens:
+            chunks.append(self._make_chunk(lines, unit.start, unit.end, unit))
+            return
+        if unit.children:
+            # Header and code between the nested definitions keep the unit's own symbol
+            parts = self._fill_gaps(unit.children, unit.start, unit.end, unit.symbol)
+            for part in self._merge_small(lines, parts):
+                if part.kind == "block":
+                    part.kind = unit.kind
+                    part.parent = unit.parent
+                self._emit(lines, part, chunks)
+            return
+        self._emit_windows(lines, unit, chunks)
+
+    def _emit_windows(self, lines: List[str], unit: _Unit, chunks: List[Chunk]):
+        """Split a unit without nested definitions into overlapping line windows"""
+        start = unit.start
+        while start < unit.end:
+            end = start
+            used = 0
+            while end < unit.end:
+                line_tokens = self.count_tokens(lines[end]) + 1
+                if used + line_tokens > self.max_tokens and end > start:
+                    break
+                used += line_tokens
+                end += 1
+            if used > self.max_tokens:
+                # A single line over the budget: keep its start
+                text = lines[start][:self.max_tokens * 3]
+                chunks.append(Chunk(text, start + 1, start + 1, unit.symbol, unit.parent, unit.kind))
+            else:
+                chunks.append(self._make_chunk(lines, start, end, unit))
+            if end >= unit.end:
+                break
+            # Step back by the overlap, always advancing at least one line
+            next_start = end
+            overlap = 0
+            while next_start - 1 > start and overlap + self.count_tokens(lines[next_start - 1]) <= self.overlap_tokens:
+                next_start -= 1
+                overlap += self.count_tokens(lines[next_start]) + 1
+            start = max(next_start, start + 1)
+
+    @staticmethod
+    def _make_chunk(lines: List[str], start: int, end: int, unit: _Unit) -> Chunk:
+        # Leading and trailing blank lines carry no meaning
+        while start < end - 1 and not lines[start].strip():
+            start += 1
+        while end > start + 1 and not lines[end - 1].strip():
+            end -= 1
+        return Chunk("\n".join(lines[start:end]), start + 1, end, unit.symbol, unit.parent, unit.kind)
@@ -0,0 +1,590 @@
+"""
+Bulk ingestion of a source tree into the vector store
+
+    python -m ai.vectorstore.ingest path/to/repo [--watch]
+
+Files are streamed from the directory tree and split into snippets at
+function and class boundaries in a process pool. Snippets are embedded in large batches and written to Chroma
+in bounded chunks, so memory stays flat however large the repository is.
+A manifest of indexed files makes re-runs incremental: only changed files
+are read and only new snippets embedded, and removed code is deleted.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .chunker import CodeChunker
+
+logger = logging.getLogger("ingest")
+
+# Token counter of the parser processes, set once per process by _init_parser
+_count_tokens: Optional[Callable[[str], int]] = None
+
+# File extension -> language stored in the snippet metadata
+LANGUAGES = {
+    ".py": "python", ".pyi": "python",
+    ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript",
+    ".ts": "typescript", ".tsx": "typescript",
+    ".java": "java", ".kt": "kotlin", ".kts": "kotlin", ".scala": "scala",
+    ".go": "go", ".rs": "rust", ".swift": "swift",
+    ".c": "c", ".h": "c", ".cpp": "cpp", ".cc": "cpp", ".cxx": "cpp", ".hpp": "cpp", ".hh": "cpp",
+    ".cs": "csharp", ".rb": "ruby", ".php": "php",
+    ".sh": "shell", ".bash": "shell", ".ps1": "powershell",
+    ".sql": "sql", ".vue": "vue", ".svelte": "svelte",
+    ".html": "html", ".css": "css", ".scss": "scss",
+}
+
+# Directories that never contain source worth indexing
+EXCLUDED_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", "env",
+    ".tox", ".mypy_cache", ".pytest_cache", "dist", "build", "target", ".idea", ".vscode",
+}
+
+
+def detect_language(path: str) -> Optional[str]:
+    """Language of a source file from its extension, or None if not indexed"""
+    return LANGUAGES.get(os.path.splitext(path)[1].lower())
+
+
+def iter_source_files(
+    root: str,
+    max_file_bytes: int = 1_000_000,
+    excluded_dirs: Set[str] = EXCLUDED_DIRS
+) -> Iterator[str]:
+    """Walk a directory tree lazily, yielding indexable source files
+
+    Args:
+        root: Directory to walk
+        max_file_bytes: Larger files are skipped (usually generated or vendored)
+        excluded_dirs: Directory names that are not descended into
+
+    Yields:
+        File paths
+    """
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d not in excluded_dirs and not d.startswith("."))
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            if detect_language(path) is None:
+                continue
+            try:
+                if os.path.getsize(path) > max_file_bytes:
+                    continue
+            except OSError:
+                continue
+            yield path
+
+
+def snippet_ids(path: str, snippets: List[str]) -> List[str]:
+    """Stable ids of the snippets of a file, derived from path and content
+
+    Unchanged snippets keep their id when other parts of the file change,
+    so re-indexing only embeds what is new. Repeated identical snippets in
+    a file are told apart by their occurrence number.
+    """
+    seen: Dict[str, int] = {}
+    ids = []
+    for snippet in snippets:
+        content_hash = hashlib.sha256(snippet.encode("utf-8")).hexdigest()
+        occurrence = seen.get(content_hash, 0)
+        seen[content_hash] = occurrence + 1
+        ids.append(hashlib.sha256(f"{path}\0{content_hash}\0{occurrence}".encode("utf-8")).hexdigest())
+    return ids
+
+
+def parse_file(
+    path: str,
+    root: str,
+    max_tokens: int = 240,
+    overlap_tokens: int = 32,
+    count_tokens: Optional[Callable[[str], int]] = None
+) -> Tuple[str, Dict[str, Any], List[Tuple[str, str, Dict[str, Any]]]]:
+    """Read a file and split it into snippets (runs in the worker processes)
+
+    Args:
+        path: File to parse
+        root: Repository root; metadata paths are relative to it
+        max_tokens: Maximum tokens per snippet
+        overlap_tokens: Tokens shared by the pieces of a split definition
+        count_tokens: Token count of the embedding model (None = approximate)
+
+    Returns:
+        Tuple of (relative path, manifest entry, snippets as (id, snippet,
+        metadata)); no snippets for unreadable, binary or minified files
+    """
+    relative = Path(os.path.relpath(path, root)).as_posix()
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        stat = os.stat(path)
+    except OSError:
+        return relative, {}, []
+    entry = {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": hashlib.sha256(raw).hexdigest(),
+        "ids": []
+    }
+    if b"\0" in raw[:8192]:
+        return relative, entry, []  # Binary file with a source extension
+    text = raw.decode("utf-8", errors="replace")
+    lines = text.count("\n") + 1
+    if len(text) / lines > 400:
+        return relative, entry, []  # Minified or generated; snippets would be noise
+
+    language = detect_language(path)
+    chunker = CodeChunker(count_tokens=count_tokens, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    chunks = chunker.chunk(text, language)
+    ids = snippet_ids(relative, [chunk.text for chunk in chunks])
+    snippets = []
+    for snippet_id, chunk in zip(ids, chunks):
+        snippets.append((snippet_id, chunk.text, {
+            "path": relative,
+            "language": language,
+            **chunk.metadata()
+        }))
+    entry["ids"] = ids
+    return relative, entry, snippets
+
+
+def _init_parser(count_tokens: Optional[Callable[[str], int]]):
+    """Receive the token counter once per parser process rather than with every task"""
+    global _count_tokens
+    _count_tokens = count_tokens
+
+
+def _parse_files(
+    paths: List[str],
+    root: str,
+    max_tokens: int,
+    overlap_tokens: int,
+    count_tokens: Optional[Callable[[str], int]] = None
+) -> list:
+    """Parse a group of files in one task, which keeps inter-process overhead low"""
+    count_tokens = count_tokens or _count_tokens
+    return [parse_file(path, root, max_tokens, overlap_tokens, count_tokens) for path in paths]
+
+
+def _chunks(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class IngestManifest:
+    """Indexed state of every file of a repository
+
+    Maps relative paths to their mtime, size, content hash and the ids of
+    their snippets in the vector store. Saved atomically as JSON.
+    """
+
+    def __init__(self, path: str, root: str):
+        """Load the manifest, or start an empty one
+
+        Args:
+            path: Manifest file
+            root: Repository root the paths are relative to
+        """
+        self.path = path
+        self.root = root
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("root") == root:
+                    self.files = data.get("files", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable manifest {path}: {str(e)}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"root": self.root, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+
+
+class IngestStats:
+    """Counters and throughput of an ingestion run"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.files = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.snippets = 0
+        self.written = 0
+        self.deleted = 0
+        self.embed_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "files": self.files,
+            "unchanged_files": self.unchanged,
+            "removed_files": self.removed,
+            "snippets": self.snippets,
+            "written": self.written,
+            "deleted": self.deleted,
+            "seconds": round(elapsed, 1),
+            "files_per_second": round(self.files / elapsed, 1),
+            "snippets_per_second": round(self.written / elapsed, 1),
+            "embed_seconds": round(self.embed_seconds, 1),
+            "write_seconds": round(self.write_seconds, 1),
+        }
+
+
+class RepositoryIngestor:
+    """Streams a source tree into a ChromaVectorStore, incrementally
+
+    With a manifest, files whose mtime and size are unchanged are not read,
+    only snippets that are not already stored are embedded, and vectors of
+    changed or removed code are deleted.
+    """
+
+    def __init__(
+        self,
+        vector_store,
+        embeddings,
+        workers: Optional[int] = None,
+        files_per_task: int = 32,
+        batch_size: int = 256,
+        embed_batch_size: int = 64,
+        max_tokens: int = 240,
+        overlap_tokens: int = 32,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        max_file_bytes: int = 1_000_000,
+        progress_interval: float = 5.0,
+        manifest_path: Optional[str] = None,
+        manifest_save_interval: float = 30.0,
+        compact_ratio: float = 0.25
+    ):
+        """Initialize the ingestor
+
+        Args:
+            vector_store: ChromaVectorStore receiving the snippets
+            embeddings: CodeEmbeddings used to embed the snippets
+            workers: Parser processes (None = CPU count, 0 = parse in this process)
+            files_per_task: Files handed to a parser process at once
+            batch_size: Snippets embedded and written together; bounds memory
+            embed_batch_size: Snippets per model call
+            max_tokens: Maximum tokens per snippet (keep below the embedding model's input limit)
+            overlap_tokens: Tokens shared by the pieces of a split definition
+            count_tokens: Token count of the embedding model, picklable for the
+                parser processes, e.g. CodeEmbeddings.token_counter() (None = approximate)
+            max_file_bytes: Larger files are skipped
+            progress_interval: Seconds between progress log lines
+            manifest_path: Manifest of indexed files (None = index everything, no deletes)
+            manifest_save_interval: Seconds between manifest checkpoints during a run
+            compact_ratio: Share of dead rows (replaced or deleted vectors) above
+                which a store with compact() is compacted after a run (0 = never)
+        """
+        self.vector_store = vector_store
+        self.embeddings = embeddings
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.files_per_task = files_per_task
+        self.batch_size = batch_size
+        self.embed_batch_size = embed_batch_size
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = count_tokens
+        self.max_file_bytes = max_file_bytes
+        self.progress_interval = progress_interval
+        self.manifest_path = manifest_path
+        self.manifest_save_interval = manifest_save_interval
+        self.compact_ratio = compact_ratio
+
+    def ingest(self, root: str, full: bool = False) -> Dict[str, Any]:
+        """Index the source files under root
+
+        Args:
+            root: Repository root
+            full: Re-read and re-embed every file, ignoring the manifest
+
+        Returns:
+            Final statistics of the run
+        """
+        root = os.path.abspath(root)
+        stats = IngestStats()
+        self._last_report = self._last_save = time.monotonic()
+        manifest = IngestManifest(self.manifest_path, root) if self.manifest_path else None
+        previous = dict(manifest.files) if manifest else {}
+        seen: Set[str] = set()
+
+        # Snippets waiting to be written, and files to record in the manifest
+        # once everything queued before them has been written
+        pending: List[Tuple[str, str, Dict[str, Any]]] = []
+        uncommitted = deque()
+        queued = 0
+
+        for results in self._parse(self._changed_files(root, previous, seen, stats, full), root):
+            for relative, entry, snippets in results:
+                stats.files += 1
+                if not entry:
+                    continue
+                old_ids = set(previous.get(relative, {}).get("ids", []))
+                stale_ids = old_ids.difference(entry["ids"])
+                # Snippets already stored under the same id need no embedding
+                new_snippets = snippets if full else [s for s in snippets if s[0] not in old_ids]
+                if stale_ids:
+                    self._delete(list(stale_ids), stats)
+                stats.snippets += len(new_snippets)
+                pending.extend(new_snippets)
+                queued += len(new_snippets)
+                uncommitted.append((queued, relative, entry))
+
+            while len(pending) >= self.batch_size:
+                self._write(pending[:self.batch_size], stats)
+                del pending[:self.batch_size]
+                self._commit(manifest, uncommitted, stats.written)
+            self._report(stats)
+        if pending:
+            self._write(pending, stats)
+        self._commit(manifest, uncommitted, stats.written)
+
+        if manifest is not None:
+            # Files that disappeared since the last run
+            for relative in set(previous) - seen:
+                self._delete(previous[relative].get("ids", []), stats)
+                manifest.files.pop(relative, None)
+                stats.removed += 1
+            manifest.save()
+        self._compact()
+
+        result = stats.as_dict()
+        logger.info(f"Ingestion finished: {result}")
+        return result
+
+    def _changed_files(
+        self,
+        root: str,
+        previous: Dict[str, Dict[str, Any]],
+        seen: Set[str],
+        stats: IngestStats,
+        full: bool
+    ) -> Iterator[str]:
+        """Source files whose mtime or size differ from the manifest"""
+        for path in iter_source_files(root, self.max_file_bytes):
+            relative = Path(os.path.relpath(path, root)).as_posix()
+            seen.add(relative)
+            entry = previous.get(relative)
+            if entry and not full:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if entry.get("mtime") == stat.st_mtime_ns and entry.get("size") == stat.st_size:
+                    stats.unchanged += 1
+                    continue
+            yield path
+
+    def _commit(self, manifest: Optional[IngestManifest], uncommitted: deque, written: int):
+        """Record files whose snippets have all been written; checkpoint periodically"""
+        if manifest is None:
+            uncommitted.clear()
+            return
+        while uncommitted and uncommitted[0][0] <= written:
+            _, relative, entry = uncommitted.popleft()
+            manifest.files[relative] = entry
+        if time.monotonic() - self._last_save >= self.manifest_save_interval:
+            manifest.save()
+            self._last_save = time.monotonic()
+
+    def _parse(self, paths: Iterable[str], root: str) -> Iterator[list]:
+        """Parse files in groups, keeping a bounded number of groups in flight
+
+        Yields:
+            Results of parse_file per group, in walk order
+        """
+        groups = _chunks(paths, self.files_per_task)
+        if not self.workers:
+            for group in groups:
+                yield _parse_files(group, root, self.max_tokens, self.overlap_tokens, self.count_tokens)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_parser,
+            initargs=(self.count_tokens,)
+        ) as pool:
+            in_flight = deque()
+            for group in groups:
+                in_flight.append(pool.submit(_parse_files, group, root, self.max_tokens, self.overlap_tokens))
+                # Back-pressure: never more than two groups per worker outstanding
+                if len(in_flight) >= self.workers * 2:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def _write(self, snippets: List[Tuple[str, str, Dict[str, Any]]], stats: IngestStats):
+        """Embed one batch of snippets and upsert it into the vector store"""
+        ids = [snippet_id for snippet_id, _, _ in snippets]
+        documents = [document for _, document, _ in snippets]
+        metadatas = [metadata for _, _, metadata in snippets]
+
+        start = time.monotonic()
+        vectors = self.embeddings.embed_array(documents, batch_size=self.embed_batch_size)
+        stats.embed_seconds += time.monotonic() - start
+
+        start = time.monotonic()
+        self.vector_store.upsert_documents(documents, ids=ids, metadatas=metadatas, embeddings=vectors)
+        stats.write_seconds += time.monotonic() - start
+        stats.written += len(snippets)
+
+    def _delete(self, ids: List[str], stats: IngestStats):
+        """Delete vectors in bounded chunks"""
+        for start in range(0, len(ids), self.batch_size):
+            self.vector_store.delete_documents(ids[start:start + self.batch_size])
+        stats.deleted += len(ids)
+
+    def _compact(self):
+        """Compact the store once dead rows exceed compact_ratio of its rows"""
+        compact = getattr(self.vector_store, "compact", None)
+        if compact is None or not self.compact_ratio:
+            return
+        store_stats = self.vector_store.stats()
+        if store_stats["dead_rows"] > self.compact_ratio * store_stats["rows"]:
+            logger.info(f"Compacting the vector store ({store_stats['dead_rows']} of {store_stats['rows']} rows dead)")
+            compact()
+
+    def watch(self, root: str, interval: float = 5.0):
+        """Keep the index in sync with root until interrupted
+
+        Polls with incremental runs, which only stat unchanged files.
+
+        Args:
+            root: Repository root
+            interval: Seconds between runs
+        """
+        if not self.manifest_path:
+            raise ValueError("Watch mode needs a manifest")
+        logger.info(f"Watching {root} for changes every {interval}s")
+        while True:
+            self.ingest(root)
+            time.sleep(interval)
+
+    def _report(self, stats: IngestStats):
+        now = time.monotonic()
+        if now - self._last_report >= self.progress_interval:
+            self._last_report = now
+            progress = stats.as_dict()
+            logger.info(
+                f"{progress['files']} files, {progress['written']} snippets written "
+                f"({progress['files_per_second']} files/s, {progress['snippets_per_second']} snippets/s)"
+            )
+
+
+def main(argv: Optional[List[str]] = None):
+    # Add the repository root to sys.path when run as a script
+    sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+    from ai.config import (
+        CACHE_DIR, COLLECTION_NAME, EMBEDDING_MODEL, EMBEDDING_BACKEND, EMBEDDING_ONNX_DIR,
+        EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DIR, VECTORSTORE_DIR, VECTORSTORE_BACKEND
+    )
+    from ai.model.embeddings import CodeEmbeddings
+    from ai.vectorstore import VECTORSTORE_BACKENDS, create_vector_store
+
+    parser = argparse.ArgumentParser(description="Index a source tree into the vector store")
+    parser.add_argument("root", help="Repository root to index")
+    parser.add_argument("--vectorstore-dir", default=str(VECTORSTORE_DIR), help="Vector store directory")
+    parser.add_argument("--collection-name", default=COLLECTION_NAME, help="Collection name")
+    parser.add_argument("--vectorstore-backend", choices=VECTORSTORE_BACKENDS, default=VECTORSTORE_BACKEND,
+                        help="Vector store backend")
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL, help="Embedding model name")
+    parser.add_argument("--embedding-backend", choices=["torch", "onnx"], default=EMBEDDING_BACKEND,
+                        help="Embedding backend")
+    parser.add_argument("--embedding-onnx-dir", default=EMBEDDING_ONNX_DIR,
+                        help="Directory of the exported ONNX embedding model")
+    parser.add_argument("--embedding-cache-dir", default=EMBEDDING_CACHE_DIR,
+                        help="Directory for cached embedding vectors (empty for memory only)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Model cache directory")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Parser processes (default: CPU count, 0 = parse in this process)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Snippets embedded and written together")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="Snippets per embedding model call")
+    parser.add_argument("--max-tokens", type=int, default=240, help="Maximum tokens per snippet")
+    parser.add_argument("--overlap-tokens", type=int, default=32,
+                        help="Tokens shared by the pieces of a split definition")
+    parser.add_argument("--max-file-size", type=int, default=1_000_000, help="Skip files larger than this (bytes)")
+    parser.add_argument("--manifest", default=None,
+                        help="Manifest of indexed files (default: one per collection and root in the vector store directory)")
+    parser.add_argument("--no-manifest", action="store_true",
+                        help="Index every file without tracking changes or deleting removed code")
+    parser.add_argument("--full", action="store_true", help="Re-embed every file, ignoring the manifest")
+    parser.add_argument("--compact-ratio", type=float, default=0.25,
+                        help="Compact the mmap store when this share of its rows is dead (0 = never)")
+    parser.add_argument("--watch", action="store_true", help="Keep re-indexing changes until interrupted")
+    parser.add_argument("--watch-interval", type=float, default=5.0, help="Seconds between checks in watch mode")
+    args = parser.parse_args(argv)
+    
+    manifest_path = None
+    if not args.no_manifest:
+        root_hash = hashlib.sha256(os.path.abspath(args.root).encode("utf-8")).hexdigest()[:12]
+        manifest_path = args.manifest or os.path.join(
+            str(args.vectorstore_dir), "manifests", f"{args.collection_name}-{root_hash}.json"
+        )
+
+    logging.basicConfig(level=logging.INFO)
+    embeddings = CodeEmbeddings(
+        model_name=args.embedding_model,
+        cache_dir=args.cache_dir,
+        embedding_cache_size=EMBEDDING_CACHE_SIZE,
+        embedding_cache_dir=args.embedding_cache_dir or None,
+        backend=args.embedding_backend,
+        onnx_dir=args.embedding_onnx_dir
+    )
+    vector_store = create_vector_store(
+        args.vectorstore_backend,
+        persist_directory=str(args.vectorstore_dir),
+        collection_name=args.collection_name,
+        embeddings=embeddings
+    )
+    ingestor = RepositoryIngestor(
+        vector_store,
+        embeddings,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        embed_batch_size=args.embed_batch_size,
+        max_tokens=args.max_tokens,
+        overlap_tokens=args.overlap_tokens,
+        count_tokens=embeddings.token_counter(),
+        max_file_bytes=args.max_file_size,
+        manifest_path=manifest_path,
+        compact_ratio=args.compact_ratio
+    )
+    if vector_store.lexical_index is not None and vector_store.lexical_index.count() != vector_store.count():
+        # Collections written before the lexical index existed
+        logger.info("Rebuilding the lexical index of the collection")
+        vector_store.rebuild_lexical_index()
+    ingestor.ingest(args.root, full=args.full)
+    build_index = getattr(vector_store, "build_index", None)
+    if build_index is not None and vector_store.count() > vector_store.ann_threshold:
+        # Large mmap collections are searched through an HNSW index
+        try:
+            build_index()
+        except ImportError:
+            logger.info("Install hnswlib to build an ANN index; searching exactly")
+    if args.watch:
+        try:
+            ingestor.watch(args.root, interval=args.watch_interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Identifiers and numbers; operators and punctuation carry no lexical signal
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+# Parts of camelCase / PascalCase / snake_case identifiers
+_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+# SQLite limits the number of parameters of one statement
+_SQL_CHUNK = 500
+
+
+def tokenize_code(text: str) -> List[str]:
+    """Lowercased identifiers of code, plus their camelCase and snake_case parts
+
+    The whole identifier is kept so exact API names match strongly, and
+    its parts let "parse_config" match "parseConfig" or "ConfigParser".
+    """
+    tokens = []
+    for word in _WORD.findall(text):
+        if len(word) < 2:
+            continue
+        tokens.append(word.lower())
+        parts = _PART.findall(word)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts if len(part) > 1)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge ranked id lists by summing 1 / (k + rank) over the lists
+
+    Args:
+        rankings: Id lists, best first
+        k: Damping constant; larger values flatten the rank differences
+
+    Returns:
+        List of (id, fused score), best first
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, document_id in enumerate(ranking):
+            scores[document_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """BM25 inverted index over code identifiers, stored in SQLite
+
+    Kept next to a vector collection and updated by its add, upsert and
+    delete calls. Document frequencies and the total length are maintained
+    on write, so a search only reads the postings of the query terms.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, max_postings: int = 50000):
+        """Open or create the index
+
+        Args:
+            path: SQLite file of the index
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalization
+            max_postings: Terms in more documents than this are skipped
+                when the query has rarer ones (they barely affect ranking)
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS postings "
+            "(term TEXT NOT NULL, id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, id)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS postings_id ON postings (id)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _state(self) -> Tuple[int, int]:
+        """(document count, total token count)"""
+        state = dict(self._db.execute("SELECT key, value FROM state").fetchall())
+        return state.get("documents", 0), state.get("length", 0)
+
+    def _set_state(self, documents: int, length: int):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+            [("documents", documents), ("length", length)]
+        )
+
+    def add(self, ids: List[str], documents: List[str]):
+        """Index documents, replacing earlier versions with the same ids"""
+        if not ids:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._remove(ids)
+                count, total = self._state()
+                df: Counter = Counter()
+                for document_id, document in dict(zip(ids, documents)).items():
+                    counts = Counter(tokenize_code(document or ""))
+                    length = sum(counts.values())
+                    self._db.execute("INSERT INTO documents (id, length) VALUES (?, ?)", (document_id, length))
+                    self._db.executemany(
+                        "INSERT INTO postings (term, id, tf) VALUES (?, ?, ?)",
+                        [(term, document_id, tf) for term, tf in counts.items()]
+                    )
+                    df.update(counts.keys())
+                    count += 1
+                    total += length
+                self._db.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                    list(df.items())
+                )
+                self._set_state(count, total)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete(self, ids: List[str]):
+        """Remove documents from the index"""
+        if not ids:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._remove(ids)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _remove(self, ids: List[str]):
+        """Delete postings of ids and update the statistics (inside a transaction)"""
+        count, total = self._state()
+        for start in range(0, len(ids), _SQL_CHUNK):
+            chunk = list(set(ids[start:start + _SQL_CHUNK]))
+            placeholders = ",".join("?" * len(chunk))
+            removed, length = self._db.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents WHERE id IN ({placeholders})", chunk
+            ).fetchone()
+            if not removed:
+                continue
+            df = Counter(term for (term,) in self._db.execute(
+                f"SELECT term FROM postings WHERE id IN ({placeholders})", chunk
+            ))
+            self._db.executemany("UPDATE terms SET df = df - ? WHERE term = ?", [(n, term) for term, n in df.items()])
+            self._db.executemany("DELETE FROM terms WHERE term = ? AND df <= 0", [(term,) for term in df])
+            self._db.execute(f"DELETE FROM postings WHERE id IN ({placeholders})", chunk)
+            self._db.execute(f"DELETE FROM documents WHERE id IN ({placeholders})", chunk)
+            count -= removed
+            total -= length
+        self._set_state(max(count, 0), max(total, 0))
+
+    def search(self, query: str, n_results: int = 20) -> List[Tuple[str, float]]:
+        """Rank documents against a query with BM25
+
+        Args:
+            query: Query text (code or plain words)
+            n_results: Number of results to return
+
+        Returns:
+            List of (id, score), best first
+        """
+        terms = list(dict.fromkeys(tokenize_code(query)))[:64]
+        if not terms or n_results <= 0:
+            return []
+        with self._lock:
+            count, total = self._state()
+            if not count:
+                return []
+            average_length = total / count
+
+            frequencies = {}
+            for start in range(0, len(terms), _SQL_CHUNK):
+                chunk = terms[start:start + _SQL_CHUNK]
+                frequencies.update(self._db.execute(
+                    f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+            if not frequencies:
+                return []
+            rare = {term: df for term, df in frequencies.items() if df <= self.max_postings}
+            frequencies = rare or dict([min(frequencies.items(), key=lambda item: item[1])])
+
+            scores: Dict[str, float] = defaultdict(float)
+            term_frequencies: Dict[str, List[Tuple[str, int, float]]] = defaultdict(list)
+            for term, df in frequencies.items():
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                for document_id, tf in self._db.execute("SELECT id, tf FROM postings WHERE term = ?", (term,)):
+                    term_frequencies[document_id].append((term, tf, idf))
+
+            ids = list(term_frequencies)
+            lengths = {}
+            for start in range(0, len(ids), _SQL_CHUNK):
+                chunk = ids[start:start + _SQL_CHUNK]
+                lengths.update(self._db.execute(
+                    f"SELECT id, length FROM documents WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+
+        for document_id, matches in term_frequencies.items():
+            norm = self.k1 * (1 - self.b + self.b * lengths.get(document_id, average_length) / average_length)
+            scores[document_id] = sum(idf * tf * (self.k1 + 1) / (tf + norm) for _, tf, idf in matches)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+    def clear(self):
+        """Remove every document"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("documents", "postings", "terms", "state"):
+                    self._db.execute(f"DELETE FROM {table}")
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def count(self) -> int:
+        """Number of indexed documents"""
+        with self._lock:
+            return self._state()[0]
+
+
+def hybrid_search(
+    store,
+    query: str,
+    n_results: int = 5,
+    where: Optional[Dict] = None,
+    include: Optional[List[str]] = None,
+    candidates: Optional[int] = None,
+    rrf_k: int = 60
+) -> Dict[str, Any]:
+    """Fuse vector and lexical candidates of a store with reciprocal rank fusion
+
+    The store provides embed_query, search, get_documents and
+    lexical_index. Results have the layout of search, plus "scores" with
+    the fused scores; distances of lexical-only hits are computed from
+    their embeddings so every result has one.
+
+    Args:
+        store: ChromaVectorStore or MmapVectorStore
+        query: Query text
+        n_results: Number of results to return
+        where: Filter criteria applied to both candidate lists
+        include: Result fields to return (None = documents, metadatas, distances)
+        candidates: Candidates taken from each list (None = 4 * n_results, at least 20)
+        rrf_k: Reciprocal rank fusion damping constant
+
+    Returns:
+        Dict with search results, best first
+    """
+    include = ["documents", "metadatas", "distances"] if include is None else list(include)
+    candidates = candidates or max(4 * n_results, 20)
+    vector = np.asarray(store.embed_query(query), dtype=np.float32)
+
+    dense = store.search(vector, n_results=candidates, where=where, include=["distances"])
+    dense_ids = list(dense["ids"][0])
+    distances = dict(zip(dense_ids, dense["distances"][0]))
+
+    lexical_ids = []
+    if store.lexical_index is not None:
+        lexical_ids = [document_id for document_id, _ in store.lexical_index.search(query, candidates)]
+        if where and lexical_ids:
+            # Lexical hits outside the filter are dropped
+            allowed = set(store.get_documents(lexical_ids, where=where, include=[])["ids"])
+            lexical_ids = [document_id for document_id in lexical_ids if document_id in allowed]
+
+    fused = reciprocal_rank_fusion([dense_ids, lexical_ids], k=rrf_k)[:n_results]
+    ids = [document_id for document_id, _ in fused]
+    fields = [field for field in ("documents", "metadatas") if field in include] + ["embeddings"]
+    records = store.get_documents(ids, include=fields) if ids else {"ids": []}
+    position = {document_id: i for i, document_id in enumerate(records["ids"])}
+
+    query_unit = vector / (np.linalg.norm(vector) or 1)
+    results: Dict[str, Any] = {"ids": [[]], "scores": [[]]}
+    for field in include:
+        results[field] = [[]]
+    for document_id, score in fused:
+        i = position.get(document_id)
+        if i is None:
+            continue
+        embedding = np.asarray(records["embeddings"][i], dtype=np.float32)
+        results["ids"][0].append(document_id)
+        results["scores"][0].append(score)
+        for field in ("documents", "metadatas"):
+            if field in include:
+                results[field][0].append(records[field][i])
+        if "embeddings" in include:
+            results["embeddings"][0].append(embedding)
+        if "distances" in include:
+            distance = distances.get(document_id)
+            if distance is None:
+                unit = embedding / (np.linalg.norm(embedding) or 1)
+                distance = max(0.0, 2.0 - 2.0 * float(unit @ query_unit))
+            results["distances"][0].append(distance)
+    return results
@@ -0,0 +1,813 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from ..model.embeddings import normalize_rows
+from .lexical_index import LexicalIndex, hybrid_search
+
+logger = logging.getLogger("mmap-store")
+
+# Rows scored per matrix product in exact search; bounds temporary memory
+_SEARCH_BLOCK = 32768
+# SQLite limits the number of parameters of one statement
+_SQL_CHUNK = 500
+
+
+def matches_where(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """Whether metadata satisfies a Chroma-style where filter
+
+    Supports equality ({"language": "python"}), the operators $eq, $ne,
+    $gt, $gte, $lt, $lte, $in and $nin, and $and/$or lists of filters.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if not _compare(value, operator, operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if operator == "$eq":
+        return value == operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if value is None:
+        return False
+    try:
+        if operator == "$gt":
+            return value > operand
+        if operator == "$gte":
+            return value >= operand
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported where operator: {operator}")
+
+
+class MmapVectorStore:
+    """Vector store on a memory-mapped float32 matrix
+
+    Vectors are appended to a flat file of unit-length float32 rows that is
+    memory-mapped read-only, so opening a collection costs no parsing and
+    every process serving it shares the same page-cache pages. Ids,
+    documents and metadata live in SQLite next to it. Search is an exact
+    blocked matrix product; collections above ann_threshold use an HNSW
+    index when hnswlib is installed and build_index has been run. Ids are
+    looked up in SQLite rather than held in memory. Replaced and deleted
+    vectors stay in the file as dead rows until compact is run.
+
+    Same interface as ChromaVectorStore. Distances are squared L2 distances
+    of the unit vectors (2 - 2 * cosine similarity), as in Chroma's default
+    space.
+    """
+
+    def __init__(
+        self,
+        persist_directory: str,
+        collection_name: str = "code_suggestions",
+        embedding_function: Optional[Callable[[List[str]], Any]] = None,
+        ann_threshold: int = 50000,
+        ef_search: int = 64,
+        lexical_index: bool = True
+    ):
+        """Open or create a collection
+
+        Args:
+            persist_directory: Directory to persist vector database
+            collection_name: Name of the collection
+            embedding_function: Maps a list of texts to their embeddings
+            ann_threshold: Candidate count above which the HNSW index is
+                used instead of exact search
+            ef_search: HNSW search breadth (higher = better recall, slower)
+            lexical_index: Keep a BM25 index of the documents for hybrid_search
+        """
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        self.embedding_function = embedding_function
+        self.ann_threshold = ann_threshold
+        self.ef_search = ef_search
+
+        self.directory = os.path.join(persist_directory, f"{collection_name}.mmap")
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._index_path = os.path.join(self.directory, "hnsw.bin")
+        self.lexical_index = LexicalIndex(os.path.join(self.directory, "lexical.sqlite3")) if lexical_index else None
+
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(
+            os.path.join(self.directory, "documents.sqlite3"),
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER)")
+
+        # In-memory view of the committed state, reloaded when another process writes
+        self._data_version = None
+        self._rows = 0
+        self._dimension = 0
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._live = 0
+        self._metadata: Optional[Dict[int, Dict[str, Any]]] = None
+        self._where_masks: Dict[str, np.ndarray] = {}
+        self._index = None
+        self._index_rows = 0
+        self._index_mtime = None
+        self._refresh(force=True)
+
+        logger.info(f"Memory-mapped vector store opened with collection: {collection_name} ({self.count()} documents)")
+
+    # Loading
+
+    def _refresh(self, force: bool = False):
+        """Reload the in-memory view if the collection changed since the last call"""
+        with self._lock:
+            version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version and not force:
+                # The index may have been rebuilt without changing the documents
+                self._load_index()
+                return
+            self._data_version = version
+
+            state = dict(self._db.execute("SELECT key, value FROM state").fetchall())
+            self._rows = state.get("rows", 0)
+            self._dimension = state.get("dimension", 0)
+            if self._rows and self._dimension:
+                self._vectors = np.memmap(
+                    self._vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self._dimension)
+                )
+            else:
+                self._vectors = np.zeros((0, self._dimension), dtype=np.float32)
+
+            # Only the live rows are read; ids stay in SQLite
+            live = np.fromiter((row for row, in self._db.execute("SELECT row FROM documents")), dtype=np.int64)
+            self._alive = np.zeros(self._rows, dtype=bool)
+            self._alive[live] = True
+            self._live = len(live)
+            self._metadata = None
+            self._where_masks = {}
+            self._load_index()
+
+    def _apply(self, rows: int, dimension: int, added: List[Tuple[int, Dict[str, Any]]], removed: List[int]):
+        """Update the in-memory view after a commit of this process (caller holds the lock)
+
+        PRAGMA data_version does not change on commits of the same
+        connection, and reloading every row would cost a pass over the
+        collection per write, so writers patch the view instead.
+
+        Args:
+            rows: Rows in the vector file after the commit
+            dimension: Embedding dimension of the collection
+            added: (row, metadata) of the inserted documents
+            removed: Rows of the deleted or replaced documents
+        """
+        if rows != self._rows or dimension != self._dimension:
+            self._rows = rows
+            self._dimension = dimension
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, dimension))
+            alive = np.zeros(rows, dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+
+        for row in removed:
+            self._alive[row] = False
+            if self._metadata is not None:
+                self._metadata.pop(row, None)
+        for row, metadata in added:
+            self._alive[row] = True
+            if self._metadata is not None:
+                self._metadata[row] = metadata
+        self._live += len(added) - len(removed)
+
+        # Cached filter masks only need the changed rows evaluated
+        for key, mask in list(self._where_masks.items()):
+            updated = np.zeros(rows, dtype=bool)
+            updated[:len(mask)] = mask
+            updated[removed] = False
+            where = json.loads(key)
+            for row, metadata in added:
+                updated[row] = matches_where(metadata, where)
+            self._where_masks[key] = updated
+
+    def _load_index(self):
+        """Load the HNSW index built by build_index, if present and hnswlib is installed"""
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except OSError:
+            self._index = None
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            import hnswlib
+        except ImportError:
+            logger.warning("hnswlib is not installed; using exact search")
+            self._index_mtime = mtime
+            return
+        try:
+            with open(f"{self._index_path}.json", encoding="utf-8") as f:
+                info = json.load(f)
+            if info["dimension"] != self._dimension or info["rows"] > self._rows:
+                raise ValueError("index does not match the collection")
+            index = hnswlib.Index(space="ip", dim=self._dimension)
+            index.load_index(self._index_path)
+            index.set_ef(self.ef_search)
+            index.set_num_threads(1)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            logger.warning(f"Ignoring HNSW index: {str(e)}")
+            self._index = None
+            self._index_mtime = mtime
+            return
+        self._index = index
+        self._index_rows = info["rows"]
+        self._index_mtime = mtime
+
+    def _rows_of(self, ids: List[str]) -> Dict[str, int]:
+        """Rows of the stored documents among ids"""
+        unique = list(dict.fromkeys(ids))
+        found: Dict[str, int] = {}
+        for start in range(0, len(unique), _SQL_CHUNK):
+            chunk = unique[start:start + _SQL_CHUNK]
+            found.update(self._db.execute(
+                f"SELECT id, row FROM documents WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return found
+
+    def _metadatas(self) -> Dict[int, Dict[str, Any]]:
+        """Metadata of every document by row, loaded on first use"""
+        if self._metadata is None:
+            self._metadata = {
+                row: json.loads(metadata) if metadata else {}
+                for row, metadata in self._db.execute("SELECT row, metadata FROM documents")
+            }
+        return self._metadata
+
+    def _candidates(self, where: Optional[Dict]) -> np.ndarray:
+        """Mask of the live rows matching a where filter"""
+        if not where:
+            return self._alive
+        key = json.dumps(where, sort_keys=True)
+        mask = self._where_masks.get(key)
+        if mask is None:
+            mask = np.zeros(self._rows, dtype=bool)
+            for row, metadata in self._metadatas().items():
+                mask[row] = matches_where(metadata, where)
+            if len(self._where_masks) >= 64:
+                self._where_masks.clear()
+            self._where_masks[key] = mask
+        return mask
+
+    # Writing
+
+    def _embed(self, documents: List[str]) -> np.ndarray:
+        if self.embedding_function is None:
+            raise ValueError("Embeddings are required without an embedding function")
+        return np.asarray(self.embedding_function(documents), dtype=np.float32)
+
+    def _write(
+        self,
+        documents: List[str],
+        ids: List[str],
+        metadatas: Optional[List[Dict]],
+        embeddings: Optional[Union[np.ndarray, List[List[float]]]],
+        replace: bool
+    ) -> List[str]:
+        """Append documents in one transaction, replacing or skipping existing ids"""
+        if not documents:
+            return []
+        if metadatas is None:
+            metadatas = [{} for _ in documents]
+        vectors = self._embed(documents) if embeddings is None else np.asarray(embeddings, dtype=np.float32)
+        vectors = np.ascontiguousarray(normalize_rows(vectors.reshape(len(documents), -1)), dtype=np.float32)
+
+        with self._lock:
+            # BEGIN IMMEDIATE serializes writers across processes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Picks up commits of other processes; none can follow until ours
+                self._refresh()
+                rows = self._rows
+                dimension = self._dimension or vectors.shape[1]
+                if vectors.shape[1] != dimension:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the collection ({dimension})")
+
+                existing = self._rows_of(ids)
+
+                # The last occurrence of a repeated id wins
+                positions = {document_id: index for index, document_id in enumerate(ids)}
+                keep = [
+                    index for index, document_id in enumerate(ids)
+                    if positions[document_id] == index and (replace or document_id not in existing)
+                ]
+                added = []
+                replaced = []
+                if keep:
+                    # Vectors first: readers only map rows the committed state covers
+                    mode = "r+b" if os.path.exists(self._vectors_path) else "wb"
+                    with open(self._vectors_path, mode) as f:
+                        f.seek(rows * dimension * 4)
+                        f.write(vectors[keep].tobytes())
+
+                    replaced = [ids[i] for i in keep if ids[i] in existing]
+                    for start in range(0, len(replaced), _SQL_CHUNK):
+                        chunk = replaced[start:start + _SQL_CHUNK]
+                        self._db.execute(f"DELETE FROM documents WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                    serialized = [json.dumps(metadatas[i] or {}) for i in keep]
+                    self._db.executemany(
+                        "INSERT INTO documents (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                        [
+                            (rows + offset, ids[i], documents[i], serialized[offset])
+                            for offset, i in enumerate(keep)
+                        ]
+                    )
+                    added = [(rows + offset, json.loads(serialized[offset])) for offset, i in enumerate(keep)]
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                        [("rows", rows + len(keep)), ("dimension", dimension)]
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            if keep:
+                self._apply(rows + len(keep), dimension, added, [existing[i] for i in replaced])
+            if self.lexical_index is not None and keep:
+                self.lexical_index.add([ids[i] for i in keep], [documents[i] for i in keep])
+        return ids
+
+    def add_documents(
+        self,
+        documents: List[str],
+        ids: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict]] = None,
+        embeddings: Optional[Union[np.ndarray, List[List[float]]]] = None
+    ) -> List[str]:
+        """Add documents to the vector store; ids that already exist are kept as they are
+
+        Args:
+            documents: List of documents to add
+            ids: List of IDs for the documents (default: content hashes)
+            metadatas: List of metadata for the documents
+            embeddings: Embeddings for the documents (computed if None)
+
+        Returns:
+            List of IDs for the added documents
+        """
+        if ids is None:
+            ids = [hashlib.sha256(document.encode("utf-8")).hexdigest() for document in documents]
+        return self._write(documents, ids, metadatas, embeddings, replace=False)
+
+    def upsert_documents(
+        self,
+        documents: List[str],
+        ids: List[str],
+        metadatas: Optional[List[Dict]] = None,
+        embeddings: Optional[Union[np.ndarray, List[List[float]]]] = None
+    ) -> List[str]:
+        """Insert documents or replace the ones with the same IDs
+
+        Args:
+            documents: List of documents to write
+            ids: List of IDs for the documents
+            metadatas: List of metadata for the documents
+            embeddings: Embeddings for the documents (computed if None)
+
+        Returns:
+            List of IDs for the written documents
+        """
+        return self._write(documents, ids, metadatas, embeddings, replace=True)
+
+    def delete_documents(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        """Delete documents by ID or metadata filter
+
+        The vectors stay in the file as dead rows until compact is run.
+
+        Args:
+            ids: IDs of the documents to delete
+            where: Filter criteria for the documents to delete
+        """
+        if not ids and not where:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows, deleted = self._delete_rows(ids, where)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._apply(self._rows, self._dimension, [], rows)
+            if self.lexical_index is not None:
+                self.lexical_index.delete(deleted)
+
+    def _delete_rows(self, ids: Optional[List[str]], where: Optional[Dict]) -> Tuple[List[int], List[str]]:
+        """Delete matching documents from the table (inside a transaction)
+
+        Returns:
+            Tuple of (rows, IDs) of the deleted documents
+        """
+        self._refresh()
+        rows = set()
+        if ids:
+            rows.update(self._rows_of(ids).values())
+        if where:
+            mask = self._candidates(where) & self._alive
+            if ids:
+                rows &= set(np.flatnonzero(mask).tolist())
+            else:
+                rows.update(np.flatnonzero(mask).tolist())
+        rows = sorted(rows)
+        deleted = []
+        for start in range(0, len(rows), _SQL_CHUNK):
+            chunk = rows[start:start + _SQL_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            deleted.extend(i for i, in self._db.execute(f"SELECT id FROM documents WHERE row IN ({placeholders})", chunk))
+            self._db.execute(f"DELETE FROM documents WHERE row IN ({placeholders})", chunk)
+        return rows, deleted
+
+    def get_documents(
+        self,
+        ids: List[str],
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Fetch documents by ID
+
+        Args:
+            ids: IDs of the documents
+            where: Filter criteria the documents must also match
+            include: Fields to return ("documents", "metadatas", "embeddings")
+
+        Returns:
+            Dict with flat "ids" and the included fields; missing IDs are left out
+        """
+        include = ("documents", "metadatas") if include is None else include
+        with self._lock:
+            self._refresh()
+            mask = self._candidates(where)
+            id_rows = self._rows_of(ids)
+            rows = [id_rows[i] for i in ids if i in id_rows and mask[id_rows[i]]]
+            row_ids = {row: document_id for document_id, row in id_rows.items()}
+            records = {}
+            for start in range(0, len(rows), _SQL_CHUNK):
+                chunk = rows[start:start + _SQL_CHUNK]
+                for row, document, metadata in self._db.execute(
+                    f"SELECT row, document, metadata FROM documents WHERE row IN ({','.join('?' * len(chunk))})", chunk
+                ):
+                    records[row] = (document, json.loads(metadata) if metadata else {})
+            rows = [row for row in rows if row in records]
+            results = {"ids": [row_ids[row] for row in rows]}
+            if "documents" in include:
+                results["documents"] = [records[row][0] for row in rows]
+            if "metadatas" in include:
+                results["metadatas"] = [records[row][1] for row in rows]
+            if "embeddings" in include:
+                results["embeddings"] = [np.array(self._vectors[row]) for row in rows]
+            return results
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embedding of a query text"""
+        return self._embed([query])[0]
+
+    def rebuild_lexical_index(self, batch_size: int = 1000):
+        """Index every document of the collection lexically (for collections written without it)"""
+        if self.lexical_index is None:
+            return
+        self.lexical_index.clear()
+        last = -1
+        while True:
+            with self._lock:
+                page = self._db.execute(
+                    "SELECT row, id, document FROM documents WHERE row > ? ORDER BY row LIMIT ?", (last, batch_size)
+                ).fetchall()
+            if not page:
+                return
+            self.lexical_index.add([document_id for _, document_id, _ in page], [document for _, _, document in page])
+            last = page[-1][0]
+
+    def hybrid_search(
+        self,
+        query: str,
+        n_results: int = 5,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Search by vector similarity and identifier overlap, fused by rank
+
+        Args:
+            query: Query text
+            n_results: Number of results to return
+            where: Filter criteria
+            include: Result fields to return
+
+        Returns:
+            Dict with search results and their fused "scores"
+        """
+        return hybrid_search(self, query, n_results=n_results, where=where, include=include)
+
+    # Searching
+
+    def search(
+        self,
+        query: Union[str, List[float], np.ndarray],
+        n_results: int = 5,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Search for similar documents
+
+        Args:
+            query: Query text or embedding vector
+            n_results: Number of results to return
+            where: Filter criteria
+            include: Result fields to return ("documents", "metadatas",
+                "distances", "embeddings"; None = all but embeddings)
+
+        Returns:
+            Dict with search results, in the same layout as Chroma's
+        """
+        vector = self._embed([query])[0] if isinstance(query, str) else np.asarray(query, dtype=np.float32)
+        vector = normalize_rows(vector.reshape(1, -1))[0].astype(np.float32)
+
+        with self._lock:
+            self._refresh()
+            if not self._rows or vector.shape[0] != self._dimension:
+                rows, scores = [], []
+            else:
+                candidates = self._candidates(where) & self._alive
+                rows, scores = self._nearest(vector, candidates, n_results)
+            return self._results(rows, scores, include)
+
+    def search_many(
+        self,
+        queries: List[Union[str, List[float], np.ndarray]],
+        n_results: Union[int, List[int]] = 5,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """Search for several queries at once
+
+        Text queries are embedded in one batch, and exact search scores every
+        query in a single pass over the matrix.
+
+        Args:
+            queries: Query texts or embedding vectors
+            n_results: Number of results, for all queries or per query
+            where: Filter criteria shared by the queries
+            include: Result fields to return (see search)
+
+        Returns:
+            One result dict per query, each in the layout of search
+        """
+        if not queries:
+            return []
+        counts = [n_results] * len(queries) if isinstance(n_results, int) else list(n_results)
+        if len(counts) != len(queries):
+            raise ValueError("n_results needs one count per query")
+
+        texts = [i for i, query in enumerate(queries) if isinstance(query, str)]
+        embedded = self._embed([queries[i] for i in texts]) if texts else None
+        vectors = [None] * len(queries)
+        for position, i in enumerate(texts):
+            vectors[i] = embedded[position]
+        for i, query in enumerate(queries):
+            if vectors[i] is None:
+                vectors[i] = np.asarray(query, dtype=np.float32)
+        vectors = normalize_rows(np.stack([np.ravel(v) for v in vectors])).astype(np.float32)
+
+        with self._lock:
+            self._refresh()
+            if not self._rows or vectors.shape[1] != self._dimension:
+                return [self._results([], [], include) for _ in queries]
+            candidates = self._candidates(where) & self._alive
+            count = int(candidates.sum())
+            if self._index is not None and count > self.ann_threshold:
+                nearest = [self._nearest(vector, candidates, k) for vector, k in zip(vectors, counts)]
+            else:
+                k = min(max(counts), count)
+                nearest = self._nearest_exact(vectors, candidates, k, 0, self._rows) if k > 0 else [([], [])] * len(queries)
+                nearest = [(rows[:n], scores[:n]) for (rows, scores), n in zip(nearest, counts)]
+            return [self._results(rows, scores, include) for rows, scores in nearest]
+
+    def _nearest(self, vector: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        """Rows and similarities of the k candidates closest to a unit vector"""
+        count = int(candidates.sum())
+        k = min(k, count)
+        if k <= 0:
+            return [], []
+        if self._index is not None and count > self.ann_threshold:
+            try:
+                return self._nearest_ann(vector, candidates, k)
+            except RuntimeError as e:
+                # hnswlib raises when the filter leaves fewer than k reachable rows
+                logger.debug(f"HNSW search failed, using exact search: {str(e)}")
+        return self._nearest_exact(vector, candidates, k, 0, self._rows)[0]
+
+    def _nearest_exact(
+        self,
+        queries: np.ndarray,
+        candidates: np.ndarray,
+        k: int,
+        first: int,
+        last: int
+    ) -> List[Tuple[List[int], List[float]]]:
+        """Blocked exact search of several unit vectors over rows first..last-1
+
+        Every block of rows is read once and scored against all queries
+        with one matrix product.
+        """
+        queries = queries.reshape(-1, queries.shape[-1])
+        best_rows = [np.zeros(0, dtype=np.int64) for _ in queries]
+        best_scores = [np.zeros(0, dtype=np.float32) for _ in queries]
+        for start in range(first, last, _SEARCH_BLOCK):
+            end = min(start + _SEARCH_BLOCK, last)
+            mask = candidates[start:end]
+            if not mask.any():
+                continue
+            rows = np.flatnonzero(mask)
+            block_scores = (self._vectors[start:end] @ queries.T)[rows]
+            rows = rows + start
+            for q in range(len(queries)):
+                # Keep the running top k only
+                merged_rows = np.concatenate([best_rows[q], rows])
+                merged_scores = np.concatenate([best_scores[q], block_scores[:, q]])
+                if len(merged_scores) > k:
+                    top = np.argpartition(-merged_scores, k - 1)[:k]
+                    merged_rows, merged_scores = merged_rows[top], merged_scores[top]
+                best_rows[q], best_scores[q] = merged_rows, merged_scores
+        results = []
+        for rows, scores in zip(best_rows, best_scores):
+            order = np.argsort(-scores)[:k]
+            results.append((rows[order].tolist(), scores[order].tolist()))
+        return results
+
+    def _nearest_ann(self, vector: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        """HNSW search over the indexed rows plus exact search over rows added since"""
+        indexed = candidates[:self._index_rows]
+        filter_rows = None
+        if not indexed.all():
+            filter_rows = lambda row: bool(indexed[row])  # noqa: E731
+        labels, distances = self._index.knn_query(vector, k=min(k, int(indexed.sum())), filter=filter_rows)
+        rows = labels[0].astype(np.int64).tolist()
+        scores = (1.0 - distances[0]).tolist()
+
+        if self._index_rows < self._rows:
+            tail_rows, tail_scores = self._nearest_exact(vector, candidates, k, self._index_rows, self._rows)[0]
+            merged = sorted(zip(scores + tail_scores, rows + tail_rows), reverse=True)[:k]
+            scores = [score for score, _ in merged]
+            rows = [row for _, row in merged]
+        return rows, scores
+
+    def _results(self, rows: List[int], scores: List[float], include: Optional[List[str]] = None) -> Dict:
+        """Fetch documents and metadata of result rows"""
+        include = ("documents", "metadatas", "distances") if include is None else include
+        records = {}
+        if rows:
+            placeholders = ",".join("?" * len(rows))
+            for row, document_id, document, metadata in self._db.execute(
+                f"SELECT row, id, document, metadata FROM documents WHERE row IN ({placeholders})", rows
+            ):
+                records[row] = (document_id, document, json.loads(metadata) if metadata else {})
+        hits = [(row, records[row], score) for row, score in zip(rows, scores) if row in records]
+        results = {"ids": [[record[0] for _, record, _ in hits]]}
+        if "documents" in include:
+            results["documents"] = [[record[1] for _, record, _ in hits]]
+        if "metadatas" in include:
+            results["metadatas"] = [[record[2] for _, record, _ in hits]]
+        if "distances" in include:
+            results["distances"] = [[max(0.0, 2.0 - 2.0 * score) for _, _, score in hits]]
+        if "embeddings" in include:
+            results["embeddings"] = [[np.array(self._vectors[row]) for row, _, _ in hits]]
+        return results
+
+    # Maintenance
+
+    def build_index(self, m: int = 16, ef_construction: int = 200):
+        """Build the HNSW index over the current rows (needs hnswlib)
+
+        Run after bulk ingestion; rows added later are searched exactly until
+        the next build. Every process loads the index on its next search.
+
+        Args:
+            m: Graph links per node
+            ef_construction: Build-time search breadth
+        """
+        import hnswlib
+
+        with self._lock:
+            self._refresh()
+            rows = np.flatnonzero(self._alive)
+            if not len(rows):
+                return
+            index = hnswlib.Index(space="ip", dim=self._dimension)
+            index.init_index(max_elements=self._rows, ef_construction=ef_construction, M=m)
+            for start in range(0, len(rows), _SEARCH_BLOCK):
+                chunk = rows[start:start + _SEARCH_BLOCK]
+                index.add_items(np.asarray(self._vectors[chunk]), chunk)
+
+            tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+            index.save_index(tmp_path)
+            with open(f"{tmp_path}.json", "w", encoding="utf-8") as f:
+                json.dump({"rows": self._rows, "dimension": self._dimension}, f)
+            os.replace(f"{tmp_path}.json", f"{self._index_path}.json")
+            os.replace(tmp_path, self._index_path)
+            logger.info(f"Built HNSW index over {len(rows)} vectors")
+            self._load_index()
+
+    def compact(self) -> int:
+        """Drop the dead rows of replaced and deleted documents from the vector file
+
+        Live vectors are copied to a new file in row order and the documents
+        renumbered in the same transaction. The HNSW index refers to the old
+        rows, so it is deleted; run build_index again afterwards. Processes
+        that mapped the old file keep reading it until their next refresh.
+
+        Returns:
+            Number of rows removed
+        """
+        tmp_path = f"{self._vectors_path}.{os.getpid()}.tmp"
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh()
+                live = np.flatnonzero(self._alive)
+                removed = self._rows - len(live)
+                if not removed:
+                    self._db.execute("ROLLBACK")
+                    return 0
+
+                with open(tmp_path, "wb") as f:
+                    for start in range(0, len(live), _SEARCH_BLOCK):
+                        f.write(np.ascontiguousarray(self._vectors[live[start:start + _SEARCH_BLOCK]]).tobytes())
+
+                # Rows only move down, and in ascending order each target is already free
+                self._db.executemany(
+                    "UPDATE documents SET row = ? WHERE row = ?",
+                    ((new_row, int(old_row)) for new_row, old_row in enumerate(live) if new_row != old_row)
+                )
+                self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('rows', ?)", (len(live),))
+
+                for path in (self._index_path, f"{self._index_path}.json"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                # Swapped in last, so a failure before it leaves the collection as it was;
+                # the old mapping is released first (Windows cannot replace a mapped file)
+                self._vectors = np.zeros((0, self._dimension), dtype=np.float32)
+                os.replace(tmp_path, self._vectors_path)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                self._refresh(force=True)
+                raise
+            self._refresh(force=True)
+            logger.info(f"Compacted {self.collection_name}: removed {removed} dead rows, kept {len(live)}")
+            return removed
+
+    def count(self) -> int:
+        """Number of documents in the collection"""
+        with self._lock:
+            self._refresh()
+            return self._live
+
+    def stats(self) -> Dict[str, Any]:
+        """Sizes of the collection and whether the ANN index is in use"""
+        with self._lock:
+            self._refresh()
+            return {
+                "documents": self._live,
+                "rows": self._rows,
+                "dead_rows": self._rows - self._live,
+                "dimension": self._dimension,
+                "ann_index": self._index is not None,
+                "ann_index_rows": self._index_rows if self._index is not None else 0,
+            }
@@ -0,0 +1,77 @@
+from ai.vectorstore.chunker import CodeChunker
+
+PYTHON = '''import os
+
+CONSTANT = 1
+
+
+class Greeter:
+    """Says hello"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def greet(self):
+        return f"Hello {self.name}"
+
+
+def helper(x):
+    return x * 2
+'''
+
+JAVASCRIPT = '''import x from "y";
+
+function add(a, b) {
+  return a + b;
+}
+
+class Point {
+  constructor(x) {
+    this.x = x;
+  }
+}
+'''
+
+
+def test_python_is_split_at_definitions():
+    chunks = CodeChunker().chunk(PYTHON, "python")
+    assert [(c.kind, c.symbol) for c in chunks] == [("class", "Greeter"), ("function", "helper")]
+    # Small module code is merged into the next definition instead of standing alone
+    assert chunks[0].text.startswith("import os")
+    assert chunks[1].metadata() == {
+        "start_line": 16, "end_line": 17, "symbol": "helper", "parent": "", "kind": "function"
+    }
+
+
+def test_brace_language_blocks_keep_their_closing_line():
+    chunks = CodeChunker().chunk(JAVASCRIPT, "javascript")
+    assert [c.symbol for c in chunks] == ["add", "Point"]
+    assert chunks[0].text.rstrip().endswith("}")
+    assert (chunks[1].start_line, chunks[1].end_line) == (7, 11)
+
+
+def test_large_definition_is_windowed_with_overlap():
+    code = "def big():\n" + "".join(f"    value_{i} = compute_something({i})\n" for i in range(200))
+    chunker = CodeChunker(max_tokens=120, overlap_tokens=20)
+    chunks = chunker.chunk(code, "python")
+    assert len(chunks) > 1
+    assert all(chunker.count_tokens(c.text) <= 120 for c in chunks)
+    assert all(c.symbol == "big" for c in chunks)
+    assert chunks[0].start_line == 1 and chunks[-1].end_line == 201
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.start_line <= previous.end_line
+
+
+def test_unparsable_python_still_chunks():
+    chunks = CodeChunker().chunk("def broken(:\n    pass\n", "python")
+    assert chunks and "broken" in chunks[0].text
+
+
+def test_blank_input_has_no_chunks():
+    assert CodeChunker().chunk("\n   \n") == []
+
+
+def test_query_chunk_picks_the_chunk_at_the_cursor():
+    chunker = CodeChunker(max_tokens=30, min_tokens=0)
+    assert "def helper" in chunker.query_chunk(PYTHON, "python", cursor=PYTHON.index("return x"))
+    assert CodeChunker().query_chunk(PYTHON, "python") == PYTHON
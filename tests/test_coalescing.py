@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ai.model.llm_model import GenerationCancelled
+from ai.service.coalescing import CancelSignal, RequestCoalescer
+
+
+class BlockingGeneration:
+    """Generation that runs until released or cancelled, recording the outcome"""
+
+    def __init__(self, result="suggestion", partial=None):
+        self.release = threading.Event()
+        self.calls = 0
+        self.cancelled = threading.Event()
+        self.result = result
+        self.partial = partial
+
+    def __call__(self, on_partial, cancel_event):
+        self.calls += 1
+        if on_partial is not None and self.partial:
+            on_partial(self.partial)
+        while not self.release.wait(0.01):
+            if cancel_event.is_set():
+                self.cancelled.set()
+                raise GenerationCancelled("cancelled")
+        return self.result
+
+
+async def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_identical_requests_share_one_generation():
+    async def main():
+        coalescer = RequestCoalescer()
+        generate = BlockingGeneration()
+        first = asyncio.create_task(coalescer.run("key", generate))
+        second = asyncio.create_task(coalescer.run("key", generate))
+        await asyncio.sleep(0.05)
+        generate.release.set()
+        assert await first == await second == "suggestion"
+        assert generate.calls == 1
+        assert coalescer.stats() == {"in_flight": 0, "generations": 1, "coalesced": 1}
+
+    asyncio.run(main())
+
+
+def test_generation_is_cancelled_only_after_the_last_subscriber_leaves():
+    async def main():
+        coalescer = RequestCoalescer()
+        generate = BlockingGeneration()
+        cancel_first, cancel_second = CancelSignal(), CancelSignal()
+        first = asyncio.create_task(coalescer.run("key", generate, cancel_first))
+        second = asyncio.create_task(coalescer.run("key", generate, cancel_second))
+        await asyncio.sleep(0.05)
+
+        cancel_first.set()
+        with pytest.raises(GenerationCancelled):
+            await first
+        await asyncio.sleep(0.05)
+        assert not generate.cancelled.is_set()
+
+        cancel_second.set()
+        with pytest.raises(GenerationCancelled):
+            await second
+        await wait_until(generate.cancelled.is_set)
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_remaining_subscriber_still_gets_the_result():
+    async def main():
+        coalescer = RequestCoalescer()
+        generate = BlockingGeneration()
+        cancel_first = CancelSignal()
+        first = asyncio.create_task(coalescer.run("key", generate, cancel_first))
+        second = asyncio.create_task(coalescer.run("key", generate))
+        await asyncio.sleep(0.05)
+        cancel_first.set()
+        generate.release.set()
+        with pytest.raises(GenerationCancelled):
+            await first
+        assert await second == "suggestion"
+
+    asyncio.run(main())
+
+
+def test_already_cancelled_request_does_not_start_a_generation():
+    async def main():
+        coalescer = RequestCoalescer()
+        generate = BlockingGeneration()
+        cancel = CancelSignal()
+        cancel.set()
+        with pytest.raises(GenerationCancelled):
+            await coalescer.run("key", generate, cancel)
+        assert generate.calls == 0
+
+    asyncio.run(main())
+
+
+def test_late_streaming_subscriber_gets_the_text_so_far():
+    async def main():
+        coalescer = RequestCoalescer()
+        generate = BlockingGeneration(partial="def ")
+        early, late = asyncio.Queue(), asyncio.Queue()
+        first = asyncio.create_task(coalescer.run("key", generate, partials=early))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(coalescer.run("key", generate, partials=late))
+        await asyncio.sleep(0.05)
+        generate.release.set()
+        await asyncio.gather(first, second)
+        assert early.get_nowait() == "def "
+        assert late.get_nowait() == "def "
+
+    asyncio.run(main())
+
+
+def test_cancel_signal_callbacks():
+    signal = CancelSignal()
+    calls = []
+    signal.add_callback(lambda: calls.append("a"))
+    removed = lambda: calls.append("b")
+    signal.add_callback(removed)
+    signal.remove_callback(removed)
+    signal.set()
+    signal.add_callback(lambda: calls.append("c"))
+    assert calls == ["a", "c"]
@@ -0,0 +1,63 @@
+import multiprocessing as mp
+
+import numpy as np
+
+from ai.model.embedding_cache import EmbeddingCache
+
+
+def vector_of(text, dimension=8):
+    return np.random.default_rng(list(text.encode())).random(dimension).astype(np.float32)
+
+
+def _fill(directory, prefix, count):
+    cache = EmbeddingCache("model", directory=directory)
+    for i in range(count):
+        text = f"{prefix}-{i}"
+        cache.put_many([text], vector_of(text)[np.newaxis, :])
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    directory = str(tmp_path)
+    EmbeddingCache("model", directory=directory).put_many(["a", "b"], np.stack([vector_of("a"), vector_of("b")]))
+    cache = EmbeddingCache("model", directory=directory)
+    a, b, c = cache.get_many(["a", "b", "c"])
+    assert np.array_equal(a, vector_of("a"))
+    assert np.array_equal(b, vector_of("b"))
+    assert c is None
+    assert cache.stats()["disk_hits"] == 2
+
+
+def test_other_model_starts_over(tmp_path):
+    directory = str(tmp_path)
+    EmbeddingCache("model", directory=directory).put_many(["a"], vector_of("a")[np.newaxis, :])
+    assert EmbeddingCache("other", directory=directory).get_many(["a"]) == [None]
+
+
+def test_entries_of_another_instance_are_picked_up(tmp_path):
+    directory = str(tmp_path)
+    reader = EmbeddingCache("model", directory=directory)
+    writer = EmbeddingCache("model", directory=directory)
+    writer.put_many(["a"], vector_of("a")[np.newaxis, :])
+    assert np.array_equal(reader.get_many(["a"])[0], vector_of("a"))
+    # Appending after the other instance does not reuse its rows
+    reader.put_many(["b"], vector_of("b")[np.newaxis, :])
+    fresh = EmbeddingCache("model", directory=directory)
+    assert np.array_equal(fresh.get_many(["a"])[0], vector_of("a"))
+    assert np.array_equal(fresh.get_many(["b"])[0], vector_of("b"))
+
+
+def test_concurrent_processes_never_share_rows(tmp_path):
+    directory = str(tmp_path)
+    context = mp.get_context("fork")
+    processes = [context.Process(target=_fill, args=(directory, prefix, 100)) for prefix in ("p", "q", "r")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    cache = EmbeddingCache("model", directory=directory)
+    assert cache.stats()["disk_entries"] == 300
+    texts = [f"{prefix}-{i}" for prefix in ("p", "q", "r") for i in range(100)]
+    for text, vector in zip(texts, cache.get_many(texts)):
+        assert np.array_equal(vector, vector_of(text))
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+
+import pytest
+
+from ai.model.llm_model import GenerationCancelled
+from ai.service.inference_executor import InferenceBusy, InferenceExecutor
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def occupy(executor):
+    """Submit a job that holds the only thread until released"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+        return "held"
+
+    future = executor.submit(hold)
+    while not started.is_set():
+        await asyncio.sleep(0.005)
+    return release, future
+
+
+def test_queued_jobs_run_by_priority_then_arrival():
+    async def main():
+        executor = InferenceExecutor(max_workers=1, max_queue_size=8, queue_timeout=None)
+        release, held = await occupy(executor)
+        order = []
+        futures = [
+            executor.submit(order.append, name, priority=priority)
+            for name, priority in (("generate", 2), ("fix", 1), ("completion-1", 0), ("completion-2", 0))
+        ]
+        assert executor.stats()["queued"] == 4
+        release.set()
+        await asyncio.gather(held, *futures)
+        assert order == ["completion-1", "completion-2", "fix", "generate"]
+        executor.shutdown()
+
+    run(main())
+
+
+def test_full_queue_rejects_with_retry_after():
+    async def main():
+        executor = InferenceExecutor(max_workers=1, max_queue_size=1, queue_timeout=None)
+        release, held = await occupy(executor)
+        queued = executor.submit(lambda: "queued", priority=1)
+        with pytest.raises(InferenceBusy) as error:
+            executor.submit(lambda: "rejected", priority=1)
+        assert error.value.retry_after > 0
+        release.set()
+        assert await queued == "queued"
+        assert executor.stats()["rejected"] == 1
+        executor.shutdown()
+
+    run(main())
+
+
+def test_urgent_job_displaces_the_least_urgent_one():
+    async def main():
+        executor = InferenceExecutor(max_workers=1, max_queue_size=2, queue_timeout=None)
+        release, held = await occupy(executor)
+        fix = executor.submit(lambda: "fix", priority=1)
+        generate = executor.submit(lambda: "generate", priority=2)
+        completion = executor.submit(lambda: "completion", priority=0)
+        with pytest.raises(InferenceBusy):
+            await generate
+        release.set()
+        assert await completion == "completion"
+        assert await fix == "fix"
+        executor.shutdown()
+
+    run(main())
+
+
+def test_job_waiting_past_its_deadline_expires():
+    async def main():
+        executor = InferenceExecutor(max_workers=1, max_queue_size=4, queue_timeout=5.0)
+        release, held = await occupy(executor)
+        ran = []
+        late = executor.submit(ran.append, "late", timeout=0.05)
+        with pytest.raises(InferenceBusy):
+            await late
+        stats = executor.stats()
+        assert stats["expired"] == 1 and stats["queued"] == 0
+        release.set()
+        await held
+        await asyncio.sleep(0.05)
+        assert ran == []
+        executor.shutdown()
+
+    run(main())
+
+
+def test_cancelled_job_is_not_started():
+    async def main():
+        executor = InferenceExecutor(max_workers=1, max_queue_size=4, queue_timeout=None)
+        release, held = await occupy(executor)
+        cancel = threading.Event()
+        ran = []
+        job = executor.submit(ran.append, "cancelled", cancel_event=cancel)
+        cancel.set()
+        release.set()
+        with pytest.raises(GenerationCancelled):
+            await job
+        assert ran == []
+        assert executor.stats()["cancelled"] == 1
+        executor.shutdown()
+
+    run(main())
+
+
+def test_errors_reach_the_caller_and_stats_track_waits():
+    async def main():
+        executor = InferenceExecutor(max_workers=2, max_queue_size=0)
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await executor.submit(fail)
+        assert await executor.submit(lambda: 42) == 42
+        stats = executor.stats()
+        assert stats["completed"] == 2 and stats["running"] == 0
+        assert stats["max_workers"] == 2 and stats["mean_wait_ms"] >= 0
+        executor.shutdown()
+
+    run(main())
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from ai.vectorstore.ingest import RepositoryIngestor
+
+
+class WordPieceCount:
+    """Stand-in for the embedding tokenizer: every character is a word piece"""
+
+    def __call__(self, text):
+        return len(text)
+
+
+class Embeddings:
+    def embed_array(self, documents, batch_size=32):
+        return np.zeros((len(documents), 3), dtype=np.float32)
+
+
+class Store:
+    def __init__(self):
+        self.documents = []
+
+    def upsert_documents(self, documents, ids, metadatas, embeddings):
+        self.documents.extend(documents)
+
+    def delete_documents(self, ids):
+        pass
+
+
+SOURCE = "\n\n".join(
+    f"def handler_{i}(request):\n"
+    f"    value = request.args.get('value_{i}', default=None)\n"
+    f"    if value is None:\n"
+    f"        return respond_with_error(request, 'missing value_{i}')\n"
+    f"    return respond(request, int(value) * {i})"
+    for i in range(20)
+)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_snippets_fit_the_given_token_count(tmp_path, workers):
+    (tmp_path / "handlers.py").write_text(SOURCE)
+    store = Store()
+    RepositoryIngestor(
+        store, Embeddings(), workers=workers, max_tokens=120, overlap_tokens=16,
+        count_tokens=WordPieceCount()
+    ).ingest(str(tmp_path))
+    assert store.documents
+    # The default estimate (a third of the characters) would allow 360-character snippets
+    assert all(len(document) <= 120 for document in store.documents)
+
+
+def test_full_reindex_compacts_the_mmap_store(tmp_path):
+    from ai.vectorstore.mmap_store import MmapVectorStore
+
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "handlers.py").write_text(SOURCE)
+    store = MmapVectorStore(str(tmp_path / "store"), "test", lexical_index=False)
+    ingestor = RepositoryIngestor(store, Embeddings(), workers=0, manifest_path=str(tmp_path / "manifest.json"))
+    ingestor.ingest(str(source))
+    documents = store.count()
+    ingestor.ingest(str(source), full=True)
+    stats = store.stats()
+    assert stats["documents"] == documents
+    assert stats["dead_rows"] == 0
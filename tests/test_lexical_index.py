@@ -0,0 +1,55 @@
+import pytest
+
+from ai.vectorstore.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize_code
+
+
+@pytest.fixture
+def index(tmp_path):
+    return LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+
+
+def test_tokenize_splits_identifiers():
+    tokens = tokenize_code("parseConfig(HTTPServer, max_retries) + 2")
+    assert "parseconfig" in tokens and "parse" in tokens and "config" in tokens
+    assert "httpserver" in tokens and "http" in tokens and "server" in tokens
+    assert "max_retries" in tokens and "retries" in tokens
+    assert "+" not in tokens
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]], k=60)
+    assert [document_id for document_id, _ in fused][:2] == ["b", "c"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+    assert {document_id for document_id, _ in fused} == {"a", "b", "c", "d"}
+
+
+def test_bm25_ranks_rare_matches_first(index):
+    index.add(
+        ["config", "client", "both"],
+        ["def parse_config(path): return load(path)", "class HttpClient: pass", "parse_config(HttpClient())"]
+    )
+    ranked = index.search("parse_config")
+    assert {document_id for document_id, _ in ranked} == {"config", "both"}
+    assert index.search("HttpClient", n_results=1)[0][0] == "client"
+    assert index.search("nothing_matches") == []
+
+
+def test_add_replaces_and_delete_updates_statistics(index):
+    index.add(["a", "b"], ["alpha shared", "beta shared"])
+    index.add(["a"], ["gamma shared"])
+    assert index.count() == 2
+    assert index.search("alpha") == []
+    assert index.search("gamma")[0][0] == "a"
+    assert index._db.execute("SELECT df FROM terms WHERE term = 'shared'").fetchone() == (2,)
+    index.delete(["a", "missing"])
+    assert index.count() == 1
+    assert index.search("gamma") == []
+    assert index._db.execute("SELECT df FROM terms WHERE term = 'shared'").fetchone() == (1,)
+    index.clear()
+    assert index.count() == 0
+
+
+def test_index_persists(tmp_path):
+    path = str(tmp_path / "lexical.sqlite3")
+    LexicalIndex(path).add(["a"], ["load_settings"])
+    assert LexicalIndex(path).search("load_settings")[0][0] == "a"
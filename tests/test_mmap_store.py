@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pytest
+
+from ai.vectorstore.mmap_store import MmapVectorStore, matches_where
+
+
+def embed(texts):
+    """Letter histogram of each text; enough to rank near-identical strings"""
+    vectors = np.zeros((len(texts), 26), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for char in text.lower():
+            if "a" <= char <= "z":
+                vectors[i, ord(char) - ord("a")] += 1
+    return vectors + 1e-3
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MmapVectorStore(str(tmp_path), "test", embedding_function=embed)
+
+
+def add_sample(store):
+    store.add_documents(
+        ["def parse_config(path)", "class HttpClient", "fn main() {}"],
+        ids=["a", "b", "c"],
+        metadatas=[{"language": "python"}, {"language": "python"}, {"language": "rust"}]
+    )
+
+
+def test_add_and_search(store):
+    add_sample(store)
+    results = store.search("parse_config", n_results=2)
+    assert results["ids"][0][0] == "a"
+    assert store.count() == 3
+
+
+def test_where_filter(store):
+    add_sample(store)
+    results = store.search("main", n_results=3, where={"language": "rust"})
+    assert results["ids"][0] == ["c"]
+    assert matches_where({"size": 3}, {"$and": [{"size": {"$gte": 2}}, {"size": {"$lt": 4}}]})
+    assert not matches_where({"language": "go"}, {"language": {"$in": ["python", "rust"]}})
+
+
+def test_upsert_replaces_and_add_skips_existing(store):
+    add_sample(store)
+    store.add_documents(["ignored"], ids=["a"])
+    assert store.get_documents(["a"])["documents"] == ["def parse_config(path)"]
+    store.upsert_documents(["def load_settings()"], ids=["a"], metadatas=[{"language": "python"}])
+    assert store.get_documents(["a"])["documents"] == ["def load_settings()"]
+    assert store.count() == 3
+    assert store.stats()["dead_rows"] == 1
+
+
+def test_delete_by_id_and_filter(store):
+    add_sample(store)
+    # A cached filter mask is kept in sync by writes
+    assert len(store.search("x", n_results=5, where={"language": "python"})["ids"][0]) == 2
+    store.delete_documents(ids=["a"])
+    assert store.get_documents(["a", "b"])["ids"] == ["b"]
+    assert store.search("x", n_results=5, where={"language": "python"})["ids"][0] == ["b"]
+    store.delete_documents(where={"language": "python"})
+    assert store.count() == 1
+    assert store.search("parse_config", n_results=5)["ids"][0] == ["c"]
+    store.add_documents(["def parse_config(path)"], ids=["a"], metadatas=[{"language": "python"}])
+    assert store.search("x", n_results=5, where={"language": "python"})["ids"][0] == ["a"]
+
+
+def test_other_instance_sees_writes(tmp_path, store):
+    add_sample(store)
+    reader = MmapVectorStore(str(tmp_path), "test", embedding_function=embed)
+    assert reader.count() == 3
+    store.delete_documents(ids=["b"])
+    store.add_documents(["struct Point"], ids=["d"])
+    assert reader.count() == 3 - 1 + 1
+    assert reader.get_documents(["b", "d"])["ids"] == ["d"]
+    # Writes of the reader are seen by the first instance too
+    reader.upsert_documents(["fn other() {}"], ids=["c"])
+    assert store.get_documents(["c"])["documents"] == ["fn other() {}"]
+    assert store.search("other", n_results=1)["ids"][0] == ["c"]
+
+
+def test_reopen_round_trip(tmp_path, store):
+    add_sample(store)
+    store.delete_documents(ids=["c"])
+    reopened = MmapVectorStore(str(tmp_path), "test", embedding_function=embed)
+    assert sorted(reopened.get_documents(["a", "b", "c"])["ids"]) == ["a", "b"]
+    embeddings = reopened.get_documents(["a"], include=["embeddings"])["embeddings"][0]
+    assert np.isclose(np.linalg.norm(embeddings), 1.0)
+
+
+def test_hybrid_search_uses_identifier_matches(store):
+    add_sample(store)
+    results = store.hybrid_search("HttpClient", n_results=2)
+    assert results["ids"][0][0] == "b"
+    assert len(results["scores"][0]) == len(results["ids"][0])
+
+
+def unit(vector):
+    return vector / np.linalg.norm(vector)
+
+
+def test_compact_drops_dead_rows(tmp_path):
+    store = MmapVectorStore(str(tmp_path), "test", embedding_function=embed)
+    ids = [f"id{i}" for i in range(200)]
+    store.add_documents([f"def handler_{i}(request)" for i in range(200)], ids=ids)
+    # Every letter count differs, so each document has its own vector
+    documents = ["a" * (i % 50 + 1) + "b" * (i // 50 + 1) for i in range(200)]
+    store.upsert_documents(documents, ids=ids)
+    store.delete_documents(["id0", "id1"])
+    assert store.stats()["dead_rows"] == 202
+    size = os.path.getsize(store._vectors_path)
+
+    other = MmapVectorStore(str(tmp_path), "test", embedding_function=embed)
+    assert store.compact() == 202
+    stats = store.stats()
+    assert (stats["documents"], stats["rows"], stats["dead_rows"]) == (198, 198, 0)
+    assert os.path.getsize(store._vectors_path) < size
+    assert store.compact() == 0
+
+    # Renumbered rows still resolve to their documents and vectors, in this and other processes
+    for instance in (store, other, MmapVectorStore(str(tmp_path), "test", embedding_function=embed)):
+        assert instance.count() == 198
+        assert instance.search(documents[150], n_results=1)["ids"][0] == ["id150"]
+        fetched = instance.get_documents(["id5", "id0"], include=["documents", "embeddings"])
+        assert fetched["ids"] == ["id5"]
+        assert fetched["documents"] == [documents[5]]
+        assert np.allclose(fetched["embeddings"][0], unit(embed([documents[5]])[0]))
+
+    store.add_documents(["class Router"], ids=["router"])
+    assert other.get_documents(["router"])["documents"] == ["class Router"]
+    assert other.stats()["rows"] == 199
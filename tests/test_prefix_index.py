@@ -0,0 +1,42 @@
+from ai.service.prefix_index import CompletionPrefixIndex
+
+
+def test_typing_into_the_suggestion_returns_the_rest():
+    index = CompletionPrefixIndex()
+    index.record("doc", "def add(a, b):\n    ", "return a + b")
+    assert index.lookup("doc", "def add(a, b):\n    ") == "return a + b"
+    assert index.lookup("doc", "def add(a, b):\n    ret") == "urn a + b"
+
+
+def test_diverging_or_finished_buffer_misses():
+    index = CompletionPrefixIndex()
+    index.record("doc", "x = ", "compute()")
+    assert index.lookup("doc", "x = other") is None
+    assert index.lookup("doc", "x = compute()") is None
+    assert index.lookup("doc", "y = ") is None
+    assert index.lookup("other", "x = ") is None
+
+
+def test_suffix_must_match():
+    index = CompletionPrefixIndex()
+    index.record("doc", "f(", "a, b", ")\n")
+    assert index.lookup("doc", "f(a", ")\n") == ", b"
+    assert index.lookup("doc", "f(a", "") is None
+
+
+def test_empty_continuation_forgets_the_document():
+    index = CompletionPrefixIndex()
+    index.record("doc", "x = ", "1")
+    index.record("doc", "x = ", "")
+    assert index.lookup("doc", "x = ") is None
+
+
+def test_least_recently_used_document_is_dropped():
+    index = CompletionPrefixIndex(max_documents=2)
+    index.record("a", "", "1")
+    index.record("b", "", "2")
+    assert index.lookup("a", "") == "1"
+    index.record("c", "", "3")
+    assert index.lookup("b", "") is None
+    assert index.lookup("a", "") == "1"
+    assert index.lookup("c", "") == "3"
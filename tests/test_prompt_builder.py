@@ -0,0 +1,76 @@
+from ai.chains.prompt_builder import PromptBuilder, approximate_token_count, compact_template
+
+TEMPLATE = "Code:\n{code}\nContext:\n{context}\nAnswer:"
+
+
+def words(text):
+    """One token per whitespace-separated word"""
+    return len(text.split())
+
+
+def test_compact_template_strips_padding():
+    template = """
+        [INST] Fix:
+
+        
+        {code}
+        [/INST]
+        """
+    assert compact_template(template) == "[INST] Fix:\n\n{code}\n[/INST]"
+
+
+def test_approximate_token_count():
+    assert approximate_token_count("") == 0
+    assert approximate_token_count("abcd") == 1
+    assert approximate_token_count("abcde") == 2
+
+
+def test_prompt_fits_the_budget():
+    builder = PromptBuilder(count_tokens=words, n_ctx=200, max_new_tokens=100, min_new_tokens=50)
+    code = "\n".join(f"line {i} value" for i in range(300))
+    context = "\n".join(f"example {i} text" for i in range(300))
+    prompt, max_tokens = builder.build(TEMPLATE, code, context)
+    assert words(prompt) <= builder.prompt_budget
+    assert 1 <= max_tokens <= 100
+    assert words(prompt) + max_tokens <= 200
+    assert "example 0 text" in prompt
+
+
+def test_small_input_is_kept_whole():
+    builder = PromptBuilder(count_tokens=words, n_ctx=200)
+    prompt, _ = builder.build(TEMPLATE, "x = 1", None)
+    assert prompt == "Code:\nx = 1\nContext:\nNo additional context.\nAnswer:"
+
+
+def test_fit_code_keeps_lines_around_the_cursor():
+    builder = PromptBuilder(count_tokens=words, cursor_share=0.5)
+    lines = [f"line{i}\n" for i in range(100)]
+    code = "".join(lines)
+    cursor = code.index("line50")
+    kept = builder.fit_code(code, 10, cursor)
+    assert "line50" in kept
+    assert words(kept) <= 10
+    assert kept == "".join(lines[int(kept.split()[0][4:]):int(kept.split()[-1][4:]) + 1])
+
+
+def test_fit_code_cuts_a_huge_line_before_the_cursor():
+    builder = PromptBuilder(count_tokens=words)
+    code = " ".join(f"w{i}" for i in range(100))
+    kept = builder.fit_code(code, 10, len(code))
+    assert words(kept) <= 10 and kept.endswith("w99")
+
+
+def test_fit_text_keeps_leading_whole_lines():
+    builder = PromptBuilder(count_tokens=words)
+    assert builder.fit_text("a b\nc d\ne f", 4) == "a b\nc d"
+    assert builder.fit_text("a b", 0) == ""
+
+
+def test_infill_keeps_the_text_next_to_the_cursor():
+    builder = PromptBuilder(count_tokens=words, n_ctx=60)
+    prefix = "".join(f"before{i}\n" for i in range(100))
+    suffix = "".join(f"after{i}\n" for i in range(100))
+    prompt, max_tokens = builder.build_infill("<PRE> {prefix} <SUF>{suffix} <MID>", prefix, suffix, 20)
+    assert "before99" in prompt and "after0" in prompt
+    assert "before0\n" not in prompt and "after99" not in prompt
+    assert words(prompt) + max_tokens <= 60
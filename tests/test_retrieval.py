@@ -0,0 +1,87 @@
+import numpy as np
+
+from ai.chains.retrieval import ContextPacker, RetrievedSnippet, flatten_results, mmr_select
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def chroma_result(documents, distances, embeddings=None):
+    """Search result of one query in Chroma's layout"""
+    result = {
+        "ids": [[f"id{i}" for i in range(len(documents))]],
+        "documents": [documents],
+        "metadatas": [[{"language": "python"} for _ in documents]],
+        "distances": [distances]
+    }
+    if embeddings is not None:
+        result["embeddings"] = [embeddings]
+    return result
+
+
+def test_flatten_returns_every_result_of_the_query():
+    documents = [f"def f{i}(): pass" for i in range(5)]
+    results = chroma_result(documents, [0.1, 0.2, 0.3, 0.4, 0.5], [[float(i), 1.0] for i in range(5)])
+    snippets = flatten_results(results)
+    assert [snippet.document for snippet in snippets] == documents
+    assert [snippet.distance for snippet in snippets] == [0.1, 0.2, 0.3, 0.4, 0.5]
+    assert all(snippet.metadata == {"language": "python"} for snippet in snippets)
+    assert np.array_equal(snippets[3].embedding, np.array([3.0, 1.0], dtype=np.float32))
+
+
+def test_flatten_selects_the_query_and_skips_empty_documents():
+    results = {
+        "documents": [["first"], ["a", "", "b"]],
+        "distances": [[0.1], [0.2, 0.3, 0.4]]
+    }
+    snippets = flatten_results(results, query_index=1)
+    assert [snippet.document for snippet in snippets] == ["a", "b"]
+    assert [snippet.distance for snippet in snippets] == [0.2, 0.4]
+    assert flatten_results(results, query_index=2) == []
+
+
+def test_mmr_drops_near_duplicates():
+    snippets = [
+        RetrievedSnippet("def save(user)", distance=0.1, embedding=np.array([1.0, 0.0], dtype=np.float32)),
+        RetrievedSnippet("def save( user )", distance=0.12, embedding=np.array([0.99, 0.05], dtype=np.float32)),
+        RetrievedSnippet("def load(user)", distance=0.5, embedding=np.array([0.0, 1.0], dtype=np.float32))
+    ]
+    picked = mmr_select(snippets, k=3, diversity=0.0, duplicate_threshold=0.95)
+    assert [snippet.document for snippet in picked] == ["def save(user)", "def load(user)"]
+    # Below the threshold both are kept
+    picked = mmr_select(snippets, k=3, diversity=0.0, duplicate_threshold=0.9999)
+    assert len(picked) == 3
+
+
+def test_mmr_without_embeddings_drops_exact_duplicates():
+    snippets = [RetrievedSnippet(text, distance=i) for i, text in enumerate(["a", "a", "b", "c"])]
+    assert [snippet.document for snippet in mmr_select(snippets, k=2)] == ["a", "b"]
+
+
+def test_pack_skips_a_snippet_that_does_not_fit_and_keeps_a_smaller_one():
+    packer = ContextPacker(count_tokens=word_count, max_tokens=30)
+    best = RetrievedSnippet("def best(): return 1", distance=0.1)
+    large = RetrievedSnippet(" ".join(["token"] * 40), distance=0.2)
+    small = RetrievedSnippet("def small(): pass", distance=0.3)
+    context = packer.pack([best, large, small])
+    assert "def best()" in context
+    assert "token" not in context
+    assert "def small()" in context
+
+
+def test_pack_stays_within_budget_ordered_by_relevance():
+    packer = ContextPacker(count_tokens=word_count, max_tokens=40)
+    snippets = [
+        RetrievedSnippet(" ".join(["middle"] * 8), distance=0.4),
+        RetrievedSnippet(" ".join(["best"] * 8), distance=0.1),
+        RetrievedSnippet(" ".join(["worst"] * 8), distance=0.8),
+        RetrievedSnippet(" ".join(["extra"] * 8), distance=0.9)
+    ]
+    context = packer.pack(snippets)
+    assert word_count(context) <= 40
+    assert "extra" not in context
+    blocks = context.split("\n\n")
+    assert [block.split("\n")[1].split()[0] for block in blocks] == ["best", "middle", "worst"]
+    assert [block.split("\n")[0] for block in blocks] == ["Example 1 (code):", "Example 2 (code):", "Example 3 (code):"]
+    assert packer.pack(snippets, max_tokens=5) == ""
@@ -0,0 +1,58 @@
+import hashlib
+
+import numpy as np
+
+from ai.chains.semantic_cache import SemanticSuggestionCache
+
+
+class TruncatingEmbeddings:
+    """Bag-of-words embedder that, like the real model, only reads the first max_seq_length words"""
+
+    def __init__(self, max_seq_length=16, dimension=64):
+        self.max_seq_length = max_seq_length
+        self.dimension = dimension
+        self.calls = 0
+
+    def fits(self, text):
+        return len(text.split()) <= self.max_seq_length
+
+    def embed_array(self, texts, normalize=False):
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.split()[:self.max_seq_length]:
+                vectors[row, int(hashlib.sha256(word.encode()).hexdigest(), 16) % self.dimension] += 1
+        if normalize:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def test_near_duplicate_hits():
+    cache = SemanticSuggestionCache(TruncatingEmbeddings())
+    cache.add("def add(a, b): return a + b", "fixed", "fix", "python")
+    suggestion, _ = cache.lookup("def add(a, b):  return a + b", "fix", "python")
+    assert suggestion == "fixed"
+
+
+def test_entries_are_separated_by_type_and_language():
+    cache = SemanticSuggestionCache(TruncatingEmbeddings())
+    cache.add("def add(a, b): return a + b", "fixed", "fix", "python")
+    assert cache.lookup("def add(a, b): return a + b", "generate", "python")[0] is None
+    assert cache.lookup("def add(a, b): return a + b", "fix", "javascript")[0] is None
+
+
+def test_inputs_differing_after_the_truncation_point_do_not_hit():
+    embeddings = TruncatingEmbeddings(max_seq_length=16)
+    cache = SemanticSuggestionCache(embeddings)
+    header = " ".join(f"import module{i}" for i in range(10))
+    first = header + " def save(user): db.insert(user)"
+    second = header + " def delete(user): db.remove(user)"
+    # The model cannot tell the two apart
+    vectors = embeddings.embed_array([first, second], normalize=True)
+    assert float(vectors[0] @ vectors[1]) > 0.999
+
+    cache.add(first, "fix of save", "fix", "python")
+    suggestion, vector = cache.lookup(second, "fix", "python")
+    assert suggestion is None and vector is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["too_long"] == 1
@@ -0,0 +1,82 @@
+import pickle
+
+from ai.chains.code_suggestion import CodeSuggestion
+from ai.chains.stop_conditions import (
+    BracketBalanceStop, CodeFenceStop, DedentStop, MaxLinesStop, StopEngine
+)
+
+
+def test_code_fence_stops_after_closing_fence():
+    stop = CodeFenceStop("")
+    assert stop.check("```python\nx = 1\n") is None
+    text = "```python\nx = 1\n```\nExplanation"
+    assert text[:stop.check(text)] == "```python\nx = 1\n```"
+
+
+def test_max_lines_cuts_at_the_limit():
+    stop = MaxLinesStop("", max_lines=2)
+    assert stop.check("a\nb") is None
+    assert "a\nb\nc\n"[:stop.check("a\nb\nc\n")] == "a\nb"
+
+
+def test_bracket_balance_finishes_the_closing_line():
+    stop = BracketBalanceStop("foo(a,", language="python")
+    assert stop.active
+    assert stop.check(" b") is None
+    text = " b)\nnext_line()"
+    assert text[:stop.check(text)] == " b)"
+
+
+def test_bracket_balance_inactive_without_open_brackets():
+    assert not BracketBalanceStop("x = 1\n").active
+
+
+def test_python_floor_division_is_not_a_comment():
+    stop = BracketBalanceStop("total = f(a", language="python")
+    text = " // b)\nrest"
+    assert text[:stop.check(text)] == " // b)"
+
+
+def test_python_comment_hides_brackets():
+    stop = BracketBalanceStop("f(a", language="python")
+    assert stop.check(" # )\n") is None
+
+
+def test_hash_is_not_a_comment_in_javascript():
+    stop = BracketBalanceStop("call(this.#count", language="javascript")
+    text = ")\nnext()"
+    assert text[:stop.check(text)] == ")"
+    stop = BracketBalanceStop("call(a", language="javascript")
+    assert stop.check(" // )\n") is None
+
+
+def test_unknown_language_has_no_comments():
+    stop = BracketBalanceStop("f(a")
+    text = " // b)\nrest"
+    assert text[:stop.check(text)] == " // b)"
+
+
+def test_dedent_stops_before_leaving_the_block():
+    stop = DedentStop("def f():\n    x = 1\n    ")
+    text = "return x\n\ndef g():\n    pass"
+    assert text[:stop.check(text)] == "return x\n"
+
+
+def test_engine_takes_the_earliest_cut_and_pickles():
+    engine = StopEngine.from_rules([CodeFenceStop, MaxLinesStop], "", language="python")
+    engine = pickle.loads(pickle.dumps(engine))
+    text = "```\nx\n```" + "\n" * 50
+    assert engine(text) == len("```\nx\n```")
+    assert engine.reason == "CodeFenceStop"
+
+
+def test_line_cap_follows_the_input_length():
+    suggestion = CodeSuggestion(model_pipeline=object())
+    code = "\n".join(f"x{i} = {i}" for i in range(500))
+    engine = suggestion.get_stop_condition("fix", code)
+    answer = code + "\n"
+    assert engine(answer) is None
+    assert engine(answer * 2) is not None
+
+    generate = suggestion.get_stop_condition("generate", "write a parser")
+    assert generate("\n" * 251) == 249
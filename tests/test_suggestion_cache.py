@@ -0,0 +1,51 @@
+import time
+
+from ai.chains.suggestion_cache import SuggestionCache
+
+
+def test_key_ignores_whitespace_noise_of_whole_snippets():
+    a = SuggestionCache.make_key("def f():\r\n    return 1   \n\n", "fix")
+    b = SuggestionCache.make_key("\ndef f():\n    return 1", "fix")
+    assert a == b
+
+
+def test_key_separates_type_context_and_model():
+    base = SuggestionCache.make_key("x = 1", "fix", "ctx", model_file="a.gguf", temperature=0.7)
+    assert base != SuggestionCache.make_key("x = 1", "generate", "ctx", model_file="a.gguf", temperature=0.7)
+    assert base != SuggestionCache.make_key("x = 1", "fix", "other", model_file="a.gguf", temperature=0.7)
+    assert base != SuggestionCache.make_key("x = 1", "fix", "ctx", model_file="b.gguf", temperature=0.7)
+    assert base != SuggestionCache.make_key("x = 1", "fix", "ctx", model_file="a.gguf", temperature=0.2)
+
+
+def test_fim_key_keeps_whitespace_at_the_cursor():
+    # The middle after "def f():" starts with a newline, after "def f():\n    " it does not
+    assert SuggestionCache.make_key("def f():", "fim", "") != SuggestionCache.make_key("def f():\n    ", "fim", "")
+    assert SuggestionCache.make_key("foo(a,", "fim", ")") != SuggestionCache.make_key("foo(a, ", "fim", ")")
+    assert SuggestionCache.make_key("x = 1\n", "fim", "\ny") != SuggestionCache.make_key("x = 1", "fim", "\ny")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = SuggestionCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+
+
+def test_entries_expire(monkeypatch):
+    cache = SuggestionCache(ttl=10)
+    cache.put("a", "A")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SuggestionCache(disk_path=path).put("a", "A")
+    cache = SuggestionCache(disk_path=path)
+    assert cache.get("a") == "A"
+    assert cache.stats()["disk_hits"] == 1
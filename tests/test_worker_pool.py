@@ -0,0 +1,61 @@
+import time
+
+from ai.model.worker_pool import ModelWorkerPool, _Job
+
+
+class _FakeProcess:
+    def __init__(self):
+        self.terminated = False
+
+    def is_alive(self):
+        return not self.terminated
+
+    def terminate(self):
+        self.terminated = True
+
+
+def _pool_with_job(silent_for: float, progress_timeout: float = 30.0):
+    pool = ModelWorkerPool(num_workers=1, model_kwargs={"model_file": "m.gguf"}, progress_timeout=progress_timeout)
+    worker = pool._workers[0]
+    worker.ready = worker.healthy = True
+    worker.process = _FakeProcess()
+    job = _Job(1, "prompt", 16, False, {})
+    job.worker_id = 0
+    worker.active[job.job_id] = job
+    worker.last_seen = time.time() - silent_for
+    return pool, worker, job
+
+
+def test_hung_worker_is_restarted_and_its_job_failed():
+    pool, worker, job = _pool_with_job(silent_for=60)
+    process = worker.process
+    with pool._lock:
+        pool._check_health()
+    assert process.terminated
+    assert worker.restarts == 1
+    assert not worker.active
+    kind, message = job.events.get_nowait()
+    assert kind == "error" and "No progress" in message
+
+
+def test_worker_making_progress_is_kept():
+    pool, worker, job = _pool_with_job(silent_for=5)
+    with pool._lock:
+        pool._check_health()
+    assert not worker.process.terminated
+    assert job.events.empty()
+
+
+def test_progress_timeout_can_be_disabled():
+    pool, worker, job = _pool_with_job(silent_for=600, progress_timeout=0)
+    with pool._lock:
+        pool._check_health()
+    assert not worker.process.terminated
+
+
+def test_heartbeat_resets_the_progress_clock():
+    pool, worker, job = _pool_with_job(silent_for=60)
+    with pool._lock:
+        pool._handle_message(("alive", 0, job.job_id))
+        pool._check_health()
+    assert not worker.process.terminated
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import time
+
+from ai.service.ws_server import CodeSuggestionServer, ConnectionState
+
+
+class FakeModel:
+    n_ctx = 2048
+
+    def count_tokens(self, text):
+        return len(text) // 3
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class RecordingHandler:
+    """Stands in for handle_suggestion: runs until released or cancelled"""
+
+    def __init__(self):
+        self.started = []
+        self.finished = []
+        self.cancel_events = {}
+        self.released = set()
+
+    def release(self, request_id):
+        self.released.add(request_id)
+
+    async def __call__(self, websocket, request_id, data, cancel_event=None):
+        self.started.append(request_id)
+        self.cancel_events[request_id] = cancel_event
+        while request_id not in self.released and not cancel_event.is_set():
+            await asyncio.sleep(0.005)
+        self.finished.append(request_id)
+
+
+async def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.005)
+
+
+def make_server(max_requests_per_connection=4):
+    server = CodeSuggestionServer(model=FakeModel(), max_requests_per_connection=max_requests_per_connection)
+    handler = server.handle_suggestion = RecordingHandler()
+    return server, handler
+
+
+def request(request_id, suggestion_type, document="doc", **extra):
+    return {"id": request_id, "type": suggestion_type, "code": "x", "documentId": document, **extra}
+
+
+def test_superseded_by_same_id_and_interactive_requests_of_the_document():
+    async def main():
+        state = ConnectionState()
+        for request_id in ("c1", "c2", "gen", "other"):
+            state.tasks[request_id] = asyncio.create_task(asyncio.sleep(0))
+        state.interactive.update({"c1": "doc", "c2": "doc", "other": "elsewhere"})
+
+        assert sorted(state.superseded_by("c3", "completion", "doc")) == ["c1", "c2"]
+        assert state.superseded_by("c4", "fim", "new-doc") == []
+        assert state.superseded_by("gen", "generate", "doc") == ["gen"]
+        # Non-interactive requests leave the completions alone
+        assert state.superseded_by("fix", "fix", "doc") == []
+        await asyncio.gather(*state.tasks.values())
+
+    asyncio.run(main())
+
+
+def test_interactive_request_does_not_cancel_a_running_generate():
+    async def main():
+        server, handler = make_server()
+        websocket = FakeWebSocket()
+        server.connection_states[websocket] = ConnectionState(4)
+        await server._start_suggestion(websocket, "gen", request("gen", "generate"))
+        await server._start_suggestion(websocket, "c1", request("c1", "completion"))
+        await wait_until(lambda: len(handler.started) == 2)
+        await server._start_suggestion(websocket, "c2", request("c2", "completion"))
+        await wait_until(lambda: "c1" in handler.finished)
+
+        assert handler.cancel_events["c1"].is_set()
+        assert not handler.cancel_events["gen"].is_set()
+        handler.release("gen")
+        handler.release("c2")
+        await wait_until(lambda: len(handler.finished) == 3)
+        server.inference.shutdown()
+
+    asyncio.run(main())
+
+
+def test_ordered_requests_run_in_arrival_order():
+    async def main():
+        server, handler = make_server()
+        websocket = FakeWebSocket()
+        server.connection_states[websocket] = ConnectionState(4)
+        state = server.connection_states[websocket]
+        await server._start_suggestion(websocket, "first", request("first", "fix", ordered=True))
+        await server._start_suggestion(websocket, "second", request("second", "fix", "doc2", ordered=True))
+        await server._start_suggestion(websocket, "free", request("free", "fix", "doc3"))
+        await wait_until(lambda: "free" in handler.started)
+        assert state.ordered_tail is state.tasks["second"]
+
+        # The unordered request runs at once; the second ordered one waits for the first
+        await asyncio.sleep(0.05)
+        assert "second" not in handler.started
+        handler.release("second")
+        handler.release("first")
+        await wait_until(lambda: len(handler.finished) == 2 and "second" in handler.started)
+        assert handler.finished[0] == "first"
+        await wait_until(lambda: state.ordered_tail is None)
+        handler.release("free")
+        await wait_until(lambda: len(handler.finished) == 3)
+        server.inference.shutdown()
+
+    asyncio.run(main())
+
+
+def test_requests_beyond_the_pending_limit_are_answered_busy():
+    async def main():
+        server, handler = make_server(max_requests_per_connection=1)
+        websocket = FakeWebSocket()
+        server.connection_states[websocket] = ConnectionState(1)
+        limit = ConnectionState.MAX_PENDING_PER_SLOT
+        for i in range(limit):
+            await server._start_suggestion(websocket, f"gen{i}", request(f"gen{i}", "generate"))
+        await server._start_suggestion(websocket, "extra", request("extra", "generate"))
+
+        assert len(server.connection_states[websocket].tasks) == limit
+        assert websocket.sent[-1]["id"] == "extra"
+        assert websocket.sent[-1]["status"] == "busy"
+        assert "retryAfterMs" in websocket.sent[-1]
+
+        # Replacing an in-flight request is still admitted
+        await server._start_suggestion(websocket, "gen0", request("gen0", "generate"))
+        assert len(websocket.sent) == 1
+        for i in range(limit):
+            handler.release(f"gen{i}")
+        await wait_until(lambda: not server.connection_states[websocket].tasks)
+        server.inference.shutdown()
+
+    asyncio.run(main())